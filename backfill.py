@@ -0,0 +1,162 @@
+import os
+import time
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
+
+import warnings
+warnings.filterwarnings('ignore')
+
+import nea_assignment
+import taxi_assignment
+from src import quadtree
+from src import stationmeta
+from src import querycache
+
+# Grid data and station history are read once per worker process rather than shipped with every task
+_grids_df = None
+_tree = None
+_index = None
+_cache = None
+_project = None
+_dataset_id = None
+
+def init_worker(gridfile:str,kind:str,project:str,dataset_id:str,cache:str=None,tree:str=None):
+    global _grids_df, _tree, _index, _cache, _project, _dataset_id
+    _project, _dataset_id = project, dataset_id
+    if cache:
+        _cache = querycache.QueryCache(cache)
+    if kind=='taxi':
+        _grids_df = taxi_assignment.get_grid_data(gridfile)
+        if tree:
+            _tree = quadtree.QuadTree.load(tree)
+    else:
+        _grids_df = nea_assignment.get_grid_data(gridfile)
+        _index = stationmeta.StationIndex(stationmeta.query_changes(kind,project_id=project,dataset_id=dataset_id))
+
+
+def assign_day(kind:str,date:str,freq:str,output:str)->tuple:
+    '''Rebuild the assignment table for every timestamp of one day and write it as a partition
+    Args:
+        kind:   taxi, rainfall, air-temperature or relative-humidity
+        date:   Day to assign i.e. 2022-06-01
+        freq:   Interval between timestamps i.e. 15min
+        output: Directory to write part-<kind>-<date>.parquet to
+    Returns:
+        (date, rows written, query cache counters of the day)
+    Comments:
+        Timestamps without data are skipped, any other error fails the day.
+    '''
+    # The worker's cache lives across days, only the lookups of this day are reported
+    before = _cache.counters() if _cache is not None else {}
+    df_list = []
+    for timestamp in pd.date_range(date,periods=int(pd.Timedelta(days=1)//pd.Timedelta(freq)),freq=freq):
+        query = str(timestamp)
+        if kind=='taxi':
+            taxi = taxi_assignment.query_taxi_availability(query,_project,_dataset_id,_cache)
+            if taxi.empty:
+                print(f"Empty data for {query}")
+                continue
+            df_list.append(taxi_assignment.assign_taxis(taxi,_grids_df,_tree).reset_index())
+        else:
+            try:
+                _index.as_of(query)
+            except KeyError:
+                print(f"Empty data for {query}")
+                continue
+            df_list.append(nea_assignment.assign_measure(query,kind,_grids_df,_index,_cache,_project,_dataset_id))
+
+    counters = {key:value-before[key] for key,value in _cache.counters().items()} if _cache is not None else {}
+    path = get_partition_path(kind,date,output)
+    if not df_list:
+        # A partition left by an earlier run would otherwise be merged as if it were rebuilt
+        if os.path.exists(path):
+            os.remove(path)
+        return date, 0, counters
+    df = pd.concat(df_list,ignore_index=True)
+    df.to_parquet(path,index=False)
+    return date, len(df), counters
+
+
+def get_partition_path(kind:str,date:str,output:str)->str:
+    return os.path.join(output,f'part-{kind}-{date}.parquet')
+
+
+def merge_partitions(kind:str,output:str,dates:list)->pd.DataFrame:
+    '''Concatenate the partitions of kind for dates in date order, ignoring partitions of other runs
+    Returns:
+        pandas DataFrame, None if none of the dates has a partition
+    '''
+    files = [get_partition_path(kind,date,output) for date in sorted(dates)]
+    files = [file for file in files if os.path.exists(file)]
+    if not files:
+        return None
+    return pd.concat([pd.read_parquet(file) for file in files],ignore_index=True)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Rebuilds taxi or station assignment tables for a date range over a process pool')
+    parser.add_argument('--project','-p', nargs='?', default='ml-eng-cs611-group-project', type=str, help='GCP project name i.e. ml-eng-cs611-group-project')
+    parser.add_argument('--dataset_id','-d', nargs='?', default='taxi_dataset_reference', type=str, help='GBQ dataset ID i.e. taxi_dataset_reference')
+    parser.add_argument('--kind','-k', nargs='?', default='taxi', type=str, help='taxi, rainfall, air-temperature or relative-humidity')
+    parser.add_argument('--gridfile','-g', nargs='?', default='./updated codes/filter_grids_2/filter_grids_2.shp', type=str, help='Path to gridfiles (static data)')
+    parser.add_argument('--tree', nargs='?', default=None, type=str, help='If provided, tree saved by src/quadtree.py, for a --gridfile written by it')
+    parser.add_argument('--startdate','-s', type=str, help='First day to assign i.e. 2022-06-01')
+    parser.add_argument('--enddate','-e', type=str, help='Last day to assign i.e. 2022-06-30')
+    parser.add_argument('--freq','-f', nargs='?', default='15min', type=str, help='Interval between assigned timestamps i.e. 15min')
+    parser.add_argument('--workers','-w', nargs='?', default=None, type=int, help='Number of worker processes. Defaults to the number of cores')
+    parser.add_argument('--output','-o', nargs='?', default='./backfill', type=str, help='Directory for partitions and the merged result')
+    parser.add_argument('--gbq', action="store_true", help='If provided, append the merged result to GBQ')
+    parser.add_argument('--cache','-c', nargs='?', default=None, const='./.querycache', type=str, help='If provided, directory to cache historical query results in, shared by the workers')
+    args = parser.parse_args()
+
+    kind = args.kind
+    output = args.output
+    os.makedirs(output,exist_ok=True)
+    dates = pd.date_range(args.startdate,args.enddate,freq='D').strftime('%Y-%m-%d')
+
+    print(f"Assigning {kind} for {len(dates)} day(s) from {args.startdate} to {args.enddate}")
+    start = time.monotonic()
+    rows = 0
+    assigned, failed = [], []
+    cache = querycache.QueryCache(args.cache) if args.cache else None
+    with ProcessPoolExecutor(max_workers=args.workers,initializer=init_worker,initargs=(args.gridfile,kind,args.project,args.dataset_id,args.cache,args.tree)) as executor:
+        futures = {executor.submit(assign_day,kind,date,args.freq,output):date for date in dates}
+        progress = tqdm(as_completed(futures),total=len(futures),desc='Days assigned')
+        for future in progress:
+            try:
+                date, count, counters = future.result()
+            except Exception as e:
+                print(f"Failed to assign {futures[future]}: {e!r}")
+                failed.append(futures[future])
+                continue
+            rows += count
+            if cache is not None:
+                cache.add(counters)
+            if count:
+                assigned.append(date)
+            progress.set_postfix(rows_per_s=f'{rows/(time.monotonic()-start):.0f}')
+
+    elapsed = time.monotonic()-start
+    print(f"Assigned {rows} rows over {len(dates)} day(s) in {elapsed:.1f}s "
+          f"({len(dates)/elapsed*3600:.0f} days/hour, {rows/elapsed:.0f} rows/s)")
+    if cache is not None:
+        cache.report()
+
+    if failed:
+        print(f"{len(failed)} day(s) failed: {', '.join(sorted(failed))}")
+    consolidated_df = merge_partitions(kind,output,assigned)
+    if consolidated_df is None:
+        raise SystemExit("No partitions assigned, nothing to merge")
+    merged_path = os.path.join(output,f'{kind}-{dates[0]}-{dates[-1]}.parquet')
+    consolidated_df.to_parquet(merged_path,index=False)
+    print(f"Merged {len(consolidated_df)} rows into {merged_path}")
+
+    if args.gbq and failed:
+        raise SystemExit("Not loading to GBQ as some days failed, rerun them first")
+    if args.gbq:
+        table_id = 'assignment-taxi' if kind=='taxi' else f'assignment-station-{kind}'
+        consolidated_df.to_gbq('.'.join([args.dataset_id,table_id]),args.project,if_exists='append')
+        print(f"Loaded to {args.dataset_id}.{table_id}")
@@ -15,17 +15,45 @@ from google.cloud.storage import Blob
 # pandas
 # pandas-gbq
 # requests
+# zstandard (optional, for zstd compressed snapshots)
+
+# Shared modules, deployed alongside main.py
+# src/compression.py
+# src/stationmeta.py
+from src.compression import loads
+from src import stationmeta
+
+# Created once per instance and reused across events
+_bucket = None
+# Station state per measure, read from BigQuery on a cold start and kept up to date after
+_trackers = {}
+
+def get_bucket():
+    global _bucket
+    if _bucket is None:
+        client = storage.Client(project="ml-eng-cs611-group-project")
+        _bucket = client.bucket("ml-eng-cs611-group-project-nea")
+    return _bucket
+
+def get_tracker(measure:str, project_id:str, dataset_id:str):
+    '''stationmeta.StationTracker of a measure, started from the latest stored version of every station'''
+    if measure not in _trackers:
+        _trackers[measure] = stationmeta.StationTracker(stationmeta.query_current_stations(measure, project_id, dataset_id))
+    return _trackers[measure]
 
 def jsonParser(event, context):
     '''Parses NEA JSON file that hits the Google Cloud Storage buckets and uploads the metadata and readings to their respective BigQuery tables
     '''
-    client = storage.Client(project="ml-eng-cs611-group-project")
-    bucket = client.get_bucket("ml-eng-cs611-group-project-nea")
+    bucket = get_bucket()
     
     file = event
     path = file['name']
+    # Only snapshots are parsed, archives, repairs (loaded by repair_gaps.py) and other objects also fire the trigger
+    if path.startswith(('archive/','repair/')) or not path.endswith('.json'):
+        print(f"Skipping {path}")
+        return
     blob = bucket.blob(path)
-    data = json.loads(blob.download_as_string(client=None))
+    data = loads(blob.download_as_bytes(raw_download=True))
     
     filename_pattern = r"\d\d\d\d-\d\d-\d\dT\d\d-\d\d-\d\d"
     re_timestamp = re.compile(filename_pattern)
@@ -83,9 +111,21 @@ def jsonParser(event, context):
 
     item_table = dataset_id+'.'+measure+'-items'
     metadata_table = dataset_id+'.'+measure+'-metadata'
+    station_table = dataset_id+'.'+measure+'-stations'
     
     df_items.to_gbq(item_table,project_id,chunksize=None,if_exists='append')
-
+    # Full snapshots are still read by the views i.e. all-item-join-live, until they move to <measure>-stations
     df_metadata.to_gbq(metadata_table,project_id,chunksize=None,if_exists='append')
 
+    # Station metadata is almost always identical to the previous snapshot, only changes are stored
+    tracker = get_tracker(measure, project_id, dataset_id)
+    df_changes = tracker.update(df_metadata)
+    if len(df_changes):
+        try:
+            df_changes.to_gbq(station_table,project_id,chunksize=None,if_exists='append')
+        except Exception:
+            tracker.rollback()
+            raise
+    tracker.commit()
+
     return None
\ No newline at end of file
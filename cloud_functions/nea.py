@@ -1,39 +1,101 @@
 import functions_framework
 import google.cloud.storage as storage
-import json
-import pandas as pd
+import gzip
+import os
+import re
 import requests
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
-from google.cloud.storage import Blob
+from requests.adapters import HTTPAdapter
+
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
 
 # requirements.txt
 # functions-framework==3.*
 # google.cloud.storage
-# pandas
 # requests
+# zstandard (optional, for COMPRESSION=zstd)
+
+DATA_SETS = ["air-temperature","rainfall","relative-humidity"]
+COMPRESSION = os.environ.get("COMPRESSION","gzip") # gzip or zstd
+API_BASE = os.environ.get("API_BASE","https://api.data.gov.sg/v1") # Overridable for load tests against src/replay.py
+
+# Created once per instance and reused across invocations
+_session = None
+_bucket = None
+_last_timestamp = {}
+
+def get_session():
+  global _session
+  if _session is None:
+    _session = requests.Session()
+    _session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=len(DATA_SETS)))
+  return _session
+
+def get_bucket():
+  global _bucket
+  if _bucket is None:
+    client = storage.Client(project="ml-eng-cs611-group-project")
+    _bucket = client.bucket("ml-eng-cs611-group-project-nea")
+  return _bucket
+
+def compress(data:bytes):
+  '''Returns the compressed payload and its content-encoding'''
+  if COMPRESSION == "zstd" and zstandard is not None:
+    return zstandard.ZstdCompressor(level=10).compress(data), "zstd"
+  return gzip.compress(data, compresslevel=6), "gzip"
+
+def upstream_timestamp(data:bytes):
+  '''Reads the first timestamp of a raw API response without decoding the JSON'''
+  match = re.search(rb'"timestamp"\s*:\s*"([^"]+)"', data)
+  return match.group(1).decode() if match else None
+
+def last_stored_timestamp(bucket, measure:str, now:datetime):
+  '''Upstream timestamp of the latest stored snapshot, cached across warm invocations'''
+  if measure not in _last_timestamp:
+    blobs = list(bucket.list_blobs(prefix=measure+"/"+now.strftime("%Y-%m-%d")))
+    if blobs:
+      latest = max(blobs, key=lambda blob: blob.name)
+      _last_timestamp[measure] = (latest.metadata or {}).get("upstream_timestamp")
+  return _last_timestamp.get(measure)
+
+def fetch(measure:str, date_time:str, api_base:str=API_BASE):
+  url = api_base + "/environment/" + measure
+  params={'date_time':date_time}
+  response=get_session().get(url, params=params)
+  response.raise_for_status()
+  return response.content
 
 @functions_framework.cloud_event
 def hello_pubsub(cloud_event):
   '''Returns dictionary of JSON objects for weather data given a datetime string
   Each entry in the dictionary is the JSON response for each of the API Endpoints of
-  ["air-temperature","rainfall","relative-humidity"]    
+  ["air-temperature","rainfall","relative-humidity"]
   '''
-  data_sets = ["air-temperature","rainfall","relative-humidity"]
-
   now = datetime.now(timezone(timedelta(hours=8)))
   date_time = now.strftime("%Y-%m-%dT%H:%M:%S")
   file_name = now.strftime("%Y-%m-%dT%H-%M-%S")+".json"
 
-  client = storage.Client(project="ml-eng-cs611-group-project")
-  bucket = client.get_bucket("ml-eng-cs611-group-project-nea")
+  bucket = get_bucket()
+
+  with ThreadPoolExecutor(max_workers=len(DATA_SETS)) as executor:
+    responses = dict(zip(DATA_SETS, executor.map(lambda measure: fetch(measure, date_time), DATA_SETS)))
+
+  for measure, data in responses.items():
+    timestamp = upstream_timestamp(data)
+    if timestamp is not None and timestamp == last_stored_timestamp(bucket, measure, now):
+      print(f"Skipping {measure}, snapshot {timestamp} already stored")
+      continue
 
-  for measure in data_sets:
-    url = "https://api.data.gov.sg/v1/environment/" + measure
-    params={'date_time':date_time}
-    response=requests.get(url, params=params)
-    json_data = response.json()
-    string_data = json.dumps(json_data)
-    bucket.blob(measure+"/"+file_name).upload_from_string(string_data)
+    payload, encoding = compress(data)
+    blob = bucket.blob(measure+"/"+file_name)
+    blob.content_encoding = encoding
+    blob.metadata = {"upstream_timestamp": timestamp}
+    blob.upload_from_string(payload, content_type="application/json")
+    _last_timestamp[measure] = timestamp
 
-  return None
\ No newline at end of file
+  return None
@@ -1,5 +1,6 @@
 import functions_framework
 import math
+import os
 import datetime
 import pandas as pd
 import numpy as np
@@ -15,14 +16,124 @@ import requests
 # absl-py
 # requests
 
-def get_grid_longitude(longitude:float):
-    '''Maps longitude to a grid'''
-    return math.ceil((longitude-103.6)/0.020454545454545583)
+# Shared modules, deployed alongside main.py
+# src/grid.py
+# src/neighbours.py
+from src import grid
+from src import neighbours
 
+# 'vertex' to call the Vertex AI endpoint, 'local' to use coefficients fitted by src/forecaster.py
+PREDICTION_BACKEND = os.environ.get('PREDICTION_BACKEND', 'vertex')
+LOCAL_MODEL_PATH = os.environ.get('LOCAL_MODEL_PATH', os.path.join(os.path.dirname(__file__), 'forecaster.npz'))
+# Adjacency written by src/neighbours.py. Nearby grids are only recommended if it is deployed with the function.
+NEIGHBOURS_PATH = os.environ.get('NEIGHBOURS_PATH', os.path.join(os.path.dirname(__file__), 'neighbours.npz'))
+WALKING_RADIUS = float(os.environ.get('WALKING_RADIUS', 1000)) # metres
+
+GOOGLE_CLOUD_PROJECT = 'ml-eng-cs611-group-project'
+GOOGLE_CLOUD_REGION = 'asia-southeast1'
+ENDPOINT_ID='1152815951490580480'
+FEATURES = ['taxi_count','air_temperature','rainfall','relative_humidity','sin_day','cos_day','sin_hour','cos_hour','sin_mth','cos_mth']
+
+# Loaded once per instance and reused across requests
+_local_model = None
+_neighbours = None
+
+def get_local_model():
+    global _local_model
+    if _local_model is None:
+        with np.load(LOCAL_MODEL_PATH) as f:
+            _local_model = {k: f[k] for k in f.files}
+    return _local_model
+
+def predict_local(model_input, grid_num:int, label:str='y_30'):
+    '''Predicts taxi_count with the per-grid coefficients: a single dot product. None for grids the model was not fitted on.'''
+    model = get_local_model()
+    g = min(int(np.searchsorted(model['grid_nums'], grid_num)), len(model['grid_nums'])-1)
+    if model['grid_nums'][g] != grid_num:
+        return None
+    x = np.append(model_input[list(model['features'])].to_numpy(dtype=np.float32)[0], 1)
+    return float(x @ model['coef'][g][:, list(model['labels']).index(label)])
+
+def predict_vertex(model_input):
+    '''Predicts taxi_count of every row of model_input with one request to the Vertex AI endpoint'''
+    if not ENDPOINT_ID:
+        logging.error('Please set the endpoint id.')
+
+    client_options = {
+        'api_endpoint': GOOGLE_CLOUD_REGION + '-aiplatform.googleapis.com'
+        }
+    # Initialize client that will be used to create and send requests.
+    client = aiplatform.gapic.PredictionServiceClient(client_options=client_options)
+
+    # One instance per row, each feature as a single element list
+    instances = [{feature: [float(value)] for feature, value in row.items()}
+                 for row in model_input[FEATURES].to_dict('records')]
+
+    endpoint = client.endpoint_path(
+        project=GOOGLE_CLOUD_PROJECT,
+        location=GOOGLE_CLOUD_REGION,
+        endpoint=ENDPOINT_ID,
+    )
+    # Send a prediction request and get response.
+    response = client.predict(endpoint=endpoint, instances=instances)
+    return [prediction[0] for prediction in response.predictions]
+
+def predict_grids(model_input):
+    '''Predicted taxi_count of every row of model_input, with the configured backend. NaN for grids it cannot predict.'''
+    if PREDICTION_BACKEND == 'local':
+        predictions = [predict_local(model_input.iloc[[i]], grid_num) for i, grid_num in enumerate(model_input['grid_num'])]
+        return [np.nan if p is None else p for p in predictions]
+    return predict_vertex(model_input)
+
+def get_availability(taxis):
+    if taxis>10:
+        return 'Good'
+    elif taxis>5:
+        return 'Fair'
+    return 'Poor'
+
+def get_neighbours():
+    global _neighbours
+    if _neighbours is None and os.path.exists(NEIGHBOURS_PATH):
+        _neighbours = neighbours.Neighbours(NEIGHBOURS_PATH)
+    return _neighbours
+
+def nearby_grids(grid_num:int, longitude:float, latitude:float, radius:float=WALKING_RADIUS):
+    '''Grids within walking distance of the user, read from the precomputed adjacency
+    Returns:
+        DataFrame of grid_num, distance (metres to the nearest edge of the grid) and direction, nearest first
+    '''
+    adjacency = get_neighbours()
+    if adjacency is None:
+        return pd.DataFrame(columns=['grid_num', 'distance', 'direction'])
+    grid_nums, distances = adjacency.get(grid_num, longitude, latitude, radius)
+
+    bounds = adjacency.bounds[np.searchsorted(adjacency.grid_nums, grid_nums)]
+    # Compass direction from the user to the centre of each grid
+    angle = np.degrees(np.arctan2((bounds[:, 1]+bounds[:, 3])/2-latitude, (bounds[:, 0]+bounds[:, 2])/2-longitude))
+    directions = np.array(['east', 'north-east', 'north', 'north-west', 'west', 'south-west', 'south', 'south-east'])
+    return pd.DataFrame({
+        'grid_num': grid_nums,
+        'distance': distances,
+        'direction': directions[np.round(angle/45).astype(int) % 8]
+    })
+
+def recommend_neighbour(weather_data, grid_num:int, longitude:float, latitude:float, predicted_taxis:int):
+    '''Nearby grid with better predicted availability, or None'''
+    nearby = nearby_grids(grid_num, longitude, latitude)
+    model_input = weather_data[weather_data['grid_num'].isin(nearby['grid_num'])]
+    if not len(model_input):
+        return None
+    predictions = np.trunc(np.asarray(predict_grids(model_input), dtype=float))
+    if np.isnan(predictions).all():
+        return None
+    best = int(np.nanargmax(predictions))
+    if predictions[best] <= max(predicted_taxis, 5):
+        return None
+    alternative = nearby.set_index('grid_num').loc[model_input['grid_num'].iloc[best]]
+    return (f'Alternatively, walk about [{alternative["distance"]:.0f}]m {alternative["direction"]} where predicted taxis is '
+            f'[{int(predictions[best])}]: Availability is [{get_availability(predictions[best])}].')
 
-def get_grid_latitude(latitude:float):
-    '''Maps latitude to a grid'''
-    return (13 - math.ceil((latitude -1.208)/0.020538461538461547))*22
 
 def round_time(dt=None, date_delta=datetime.timedelta(minutes=1), to='average'):
     """
@@ -68,10 +179,6 @@ def hello_world(request):
     request_json = request.get_json()
     print(f"Dialogflow received {request_json}")
 
-    GOOGLE_CLOUD_PROJECT = 'ml-eng-cs611-group-project'     
-    GOOGLE_CLOUD_REGION = 'asia-southeast1'
-    ENDPOINT_ID='1152815951490580480'
-    
     # Parse Dialogflow JSON
     intent = request_json['queryResult']['action']
    
@@ -90,7 +197,7 @@ def hello_world(request):
     print(f"Lat:{latitude} Long:{longitude}")
 
     # Calculate grid
-    grid_num = get_grid_longitude(longitude) + get_grid_latitude(latitude)
+    grid_num = int(grid.get_grid_num(longitude, latitude))
 
     # Calculate timestamp to look up
     ct = datetime.datetime.now()
@@ -129,50 +236,13 @@ def hello_world(request):
         model_input = weather_data[weather_data['grid_num']==grid_num]
         print(f"The array going into model is {model_input}")
         # Get Predictions
-
-        if not ENDPOINT_ID:
-            from absl import logging
-            logging.error('Please set the endpoint id.')
-
-        client_options = {
-            'api_endpoint': GOOGLE_CLOUD_REGION + '-aiplatform.googleapis.com'
-            }
-        # Initialize client that will be used to create and send requests.
-        client = aiplatform.gapic.PredictionServiceClient(client_options=client_options)
-
-        # Set data values for the prediction request.
-        # Our model expects 4 feature inputs and produces 3 output values for each
-        # species. Note that the output is logit value rather than probabilities.
-        # See the model code to understand input / output structure.
-
-        instances = [{            
-            "taxi_count":model_input['taxi_count'].astype('float').to_list(), 
-            "air_temperature":model_input['air_temperature'].to_list(), 
-            "rainfall": model_input['rainfall'].to_list(), 
-            "relative_humidity":model_input['relative_humidity'].to_list(), 
-            "sin_day":model_input['sin_day'].to_list(), 
-            "cos_day":model_input['cos_day'].to_list(), 
-            "sin_hour":model_input['sin_hour'].to_list(), 
-            "cos_hour":model_input['cos_hour'].to_list(), 
-            "sin_mth":model_input['sin_mth'].to_list(), 
-            "cos_mth":model_input['cos_mth'].to_list()
-        }]
-
-        endpoint = client.endpoint_path(
-            project=GOOGLE_CLOUD_PROJECT,
-            location=GOOGLE_CLOUD_REGION,
-            endpoint=ENDPOINT_ID,
-        )
-        # Send a prediction request and get response.
-        response = client.predict(endpoint=endpoint, instances=instances)
-        predicted_taxis=int(response.predictions[0][0])
+        predicted_taxis = predict_local(model_input, grid_num) if PREDICTION_BACKEND == 'local' else None
+        # Grids the local model was not fitted on fall back to the endpoint
+        if predicted_taxis is None:
+            predicted_taxis = predict_vertex(model_input)[0]
+        predicted_taxis=int(predicted_taxis)
         current_taxis=model_input['taxi_count'].to_list()[0]
-        if predicted_taxis>10:
-            availability='Good'
-        elif predicted_taxis>5:
-            availability='Fair'
-        else:
-            availability='Poor'
+        availability=get_availability(predicted_taxis)
 
         if predicted_taxis > current_taxis and current_taxis<=5:
             recommendation=f'Book later as taxi availability will improve by [{100*(predicted_taxis/current_taxis-1):.2f}]%'
@@ -183,6 +253,12 @@ def hello_world(request):
 
         result = f'Predicted taxis in 30 minutes is [{predicted_taxis}]: Availability is [{availability}]. Recommendation: [{recommendation}]'
 
+        # Rather than only waiting, point to a better grid within walking distance
+        if availability=='Poor':
+            alternative=recommend_neighbour(weather_data, grid_num, longitude, latitude, predicted_taxis)
+            if alternative:
+                result = result+' '+alternative
+
     fulfilment = {
         "fulfillmentMessages": [
             {
@@ -8,7 +8,6 @@ from shapely import wkt
 from datetime import datetime
 import json
 import re
-import math
 from collections import Counter
 
 # requirements.txt
@@ -18,6 +17,23 @@ from collections import Counter
 # pandas-gbq
 # geopandas
 # shapely
+# zstandard (optional, for zstd compressed snapshots)
+
+# Shared modules, deployed alongside main.py
+# src/grid.py
+# src/compression.py
+from src import grid
+from src.compression import loads
+
+# Created once per instance and reused across events
+_bucket = None
+
+def get_bucket(project:str,bucket:str):
+  global _bucket
+  if _bucket is None:
+    client = storage.Client(project=project)
+    _bucket = client.bucket(bucket)
+  return _bucket
 
 def jsonParserTaxi(event, context):  
   """Triggered by a change to a Cloud Storage bucket. Assigns taxis to grid numerically.
@@ -26,30 +42,25 @@ def jsonParserTaxi(event, context):
     context (google.cloud.functions.Context): Metadata for the event.
   """
 
-  def get_grid_longitude(longitude:float):
-    '''Maps longitude to a grid'''
-    return math.ceil((longitude-103.6)/0.020454545454545583)
-
-  def get_grid_latitude(latitude:float):
-    '''Maps latitude to a grid'''
-    return (13 - math.ceil((latitude -1.208)/0.020538461538461547))*22
-
   dataset_id = 'taxi_dataset'
   project = "ml-eng-cs611-group-project"
   bucket = "ml-eng-cs611-group-project-taxis"
   table_id = 'taxi-availability'
   table_id_assignment = 'assignment-taxi'
 
-  client = storage.Client(project=project)
-  bucket = client.get_bucket(bucket)
+  bucket = get_bucket(project,bucket)
 
   print(f"event is {event}")
   print(f"context is {context}")
 
   # Parse LTA JSON files
   path = event['name']
+  # Only snapshots are parsed, archives, repairs (loaded by repair_gaps.py) and other objects also fire the trigger
+  if path.startswith(('archive/','repair/')) or not path.endswith('.json'):
+    print(f"Skipping {path}")
+    return
   blob = bucket.blob(path)
-  lta_data = json.loads(blob.download_as_string(client=None))  
+  lta_data = loads(blob.download_as_bytes(raw_download=True))  
   features = lta_data['features'][0]
   coordinates = features['geometry']['coordinates']
   longitude = [i[0] for i in coordinates]
@@ -69,7 +80,7 @@ def jsonParserTaxi(event, context):
   longitude_array = df['longitude'].to_numpy()
   latitude_array = df['latitude'].to_numpy()
 
-  test = [get_grid_longitude(longitude_array[i]) + get_grid_latitude(latitude_array[i]) for i in range(len(longitude_array))]
+  test = grid.get_grid_num(longitude_array,latitude_array).tolist()
 
   # # getting dictionary of items
   c = Counter(test)
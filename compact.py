@@ -0,0 +1,40 @@
+import gcsfs
+import pandas as pd
+
+from src import archive
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Packs each day of snapshots into a single archive with an offset index')
+    parser.add_argument('--project','-p', nargs='?', default='ml-eng-cs611-group-project', type=str, help='GCP project name i.e. ml-eng-cs611-group-project')
+    parser.add_argument('--bucket','-b', nargs='?', default='ml-eng-cs611-group-project-nea', type=str, help='GCS bucket name i.e. ml-eng-cs611-group-project-nea or ml-eng-cs611-group-project-taxis')
+    parser.add_argument('--archive_bucket','-a', nargs='?', default='ml-eng-cs611-group-project-archive', type=str, help='GCS bucket to write archives to. Must not be watched by the parser triggers')
+    parser.add_argument('--measure','-m', nargs='?', default=None, type=str, help='Snapshot folder i.e. taxis, rainfall, air-temperature or relative-humidity. Default to all 3 NEA measures')
+    parser.add_argument('--startdate','-s', type=str, help='First day to pack i.e. 2022-05-24')
+    parser.add_argument('--enddate','-e', nargs='?', default=None, type=str, help='If provided, pack every day up to this date')
+    args = parser.parse_args()
+
+    project = args.project
+    bucket = args.bucket
+    measure = args.measure
+    archive_bucket = args.archive_bucket
+    start_date = args.startdate
+    end_date = args.enddate or start_date
+
+    # Archives written to a snapshot bucket would fire the finalize triggers of the parser functions
+    if archive_bucket==bucket:
+        raise ValueError(f"Archives must be written to a different bucket than the snapshots in {bucket}")
+
+    if measure:
+        measures = [measure]
+    else:
+        measures = ['rainfall','air-temperature','relative-humidity']
+
+    fs = gcsfs.GCSFileSystem(project=project)
+
+    for date in pd.date_range(start_date,end_date,freq='D').strftime('%Y-%m-%d'):
+        for measure in measures:
+            out_path = '/'.join([archive_bucket,measure,date+'.pack'])
+            count = archive.pack_day(fs,'/'.join([bucket,measure]),date,out_path)
+            print(f"Wrote {count} snapshot(s) to {out_path}")
@@ -0,0 +1,162 @@
+import os
+import time
+import threading
+import numpy as np
+import pandas as pd
+import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from cloud_functions import gov
+from cloud_functions import nea
+from src import replay
+from src import ingestion
+
+# Parse includes the taxi count assignment, as in IngestionWorker.parse
+STAGES = ['collect','parse','sink']
+
+
+class Bench():
+    '''Drives collect, parse, assign and sink end to end against a replay.ReplayServer
+    Args:
+        base_url:   API base of the replay server
+        output:     Directory for the stored snapshots (laid out like the buckets) and the sink tables
+        retries:    Attempts per request before a snapshot is counted as failed
+    Comments:
+        Snapshots are fetched and compressed by the collector functions, and parsed by
+        ingestion.IngestionWorker including the station metadata of the NEA streams.
+    '''
+    def __init__(self,base_url:str,output:str,retries:int=3):
+        self.base_url=base_url
+        self.root=os.path.join(output,'bucket')
+        self.sink=ingestion.LocalSink(os.path.join(output,'tables'))
+        self.worker=ingestion.IngestionWorker(self.sink)
+        self.retries=retries
+        self.lock=threading.Lock()
+        # The worker parses on one thread in snapshot order, its station trackers are not thread safe.
+        # Parse, sink and tracker commit of a snapshot run under parse_lock once the stream reaches its turn.
+        self.parse_lock=threading.Lock()
+        self.parsed=threading.Condition(self.parse_lock)
+        self.turn={stream:0 for stream in replay.ENDPOINTS}
+        self.timings={stage:[] for stage in STAGES}
+        self.failed=0
+        self.retried=0
+
+    def record(self,stage:str,start:float):
+        elapsed = time.perf_counter()-start
+        with self.lock:
+            self.timings[stage].append(elapsed)
+
+    def collect(self,stream:str,timestamp:pd.Timestamp)->str:
+        '''Fetch and store one snapshot with the fetch and compress of the collector functions'''
+        collector = gov if stream=='taxis' else nea
+        date_time = f"{timestamp:%Y-%m-%dT%H:%M:%S}"
+        for attempt in range(self.retries):
+            try:
+                data = gov.fetch(date_time,self.base_url) if stream=='taxis' else nea.fetch(stream,date_time,self.base_url)
+                break
+            except requests.HTTPError:
+                if attempt+1==self.retries:
+                    raise
+                with self.lock:
+                    self.retried += 1
+        payload, encoding = collector.compress(data)
+        path = os.path.join(self.root,stream,f"{timestamp:%Y-%m-%dT%H-%M-%S}.json")
+        with open(path,'wb') as f:
+            f.write(payload)
+        return path
+
+    def process(self,stream:str,timestamp:pd.Timestamp,turn:int)->int:
+        '''Run one snapshot through every stage
+        Args:
+            turn:   Position of timestamp in the stream, snapshots are parsed in this order
+        Returns:
+            Rows written to the sink
+        '''
+        start = time.perf_counter()
+        try:
+            path = self.collect(stream,timestamp)
+            self.record('collect',start)
+        except Exception:
+            path = None
+            with self.lock:
+                self.failed += 1
+
+        with self.parsed:
+            self.parsed.wait_for(lambda:self.turn[stream]==turn)
+            try:
+                if path is None:
+                    return 0
+                start = time.perf_counter()
+                tables = self.worker.parse(path)
+                self.record('parse',start)
+
+                start = time.perf_counter()
+                # One CSV per table, so appends are serialized
+                with self.lock:
+                    for table_id, df in tables.items():
+                        self.sink.write(table_id,df)
+                if stream in self.worker.trackers:
+                    self.worker.trackers[stream].commit()
+                self.record('sink',start)
+                return sum(len(df) for df in tables.values())
+            finally:
+                self.turn[stream] += 1
+                self.parsed.notify_all()
+
+    def run(self,timestamps,workers:int=4)->dict:
+        '''Process every stream at every timestamp concurrently
+        Returns:
+            Dictionary of snapshots, rows, failed, retried and elapsed seconds
+        '''
+        for stream in replay.ENDPOINTS:
+            os.makedirs(os.path.join(self.root,stream),exist_ok=True)
+        begin = time.perf_counter()
+        rows = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Submitted in timestamp order, so the snapshot a worker waits for has always started
+            futures = [executor.submit(self.process,stream,timestamp,turn) for turn,timestamp in enumerate(sorted(timestamps)) for stream in replay.ENDPOINTS]
+            for future in as_completed(futures):
+                rows += future.result()
+        return {'snapshots':len(self.timings['sink']),'rows':rows,'failed':self.failed,
+                'retried':self.retried,'elapsed':time.perf_counter()-begin}
+
+    def latency(self)->pd.DataFrame:
+        '''Per-stage latency percentiles in milliseconds'''
+        rows = []
+        for stage, timings in self.timings.items():
+            if timings:
+                ms = np.array(timings)*1000
+                rows.append({'stage':stage,'n':len(ms),'mean':ms.mean(),'p50':np.percentile(ms,50),
+                             'p95':np.percentile(ms,95),'p99':np.percentile(ms,99),'max':ms.max()})
+        return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Measures end to end ingestion throughput against a local replay of the data.gov.sg API')
+    parser.add_argument('--recorded','-r', nargs='?', default=None, type=str, help='If provided, replay snapshots from this directory laid out like the buckets instead of synthetic ones')
+    parser.add_argument('--taxis', nargs='?', default=3000, type=int, help='Taxis per synthetic snapshot')
+    parser.add_argument('--stations', nargs='?', default=60, type=int, help='Stations per synthetic snapshot')
+    parser.add_argument('--start','-s', nargs='?', default='2022-06-01 00:00:00', type=str, help='First timestamp to request')
+    parser.add_argument('--snapshots','-n', nargs='?', default=96, type=int, help='Number of timestamps to request per stream')
+    parser.add_argument('--freq','-f', nargs='?', default='15min', type=str, help='Interval between requested timestamps')
+    parser.add_argument('--workers','-w', nargs='?', default=4, type=int, help='Concurrent snapshots in flight')
+    parser.add_argument('--latency', nargs='?', default=0.05, type=float, help='Seconds of latency added by the replay server')
+    parser.add_argument('--jitter', nargs='?', default=0.05, type=float, help='Up to this many seconds of random extra latency')
+    parser.add_argument('--error_rate', nargs='?', default=0.0, type=float, help='Fraction of requests answered with an error')
+    parser.add_argument('--retries', nargs='?', default=3, type=int, help='Attempts per request')
+    parser.add_argument('--output','-o', nargs='?', default='./bench', type=str, help='Directory for stored snapshots and sink tables')
+    args = parser.parse_args()
+
+    source = replay.RecordedSource(args.recorded) if args.recorded else replay.SyntheticSource(args.taxis,args.stations)
+    timestamps = pd.date_range(args.start,periods=args.snapshots,freq=args.freq)
+
+    with replay.ReplayServer(source,latency=args.latency,jitter=args.jitter,error_rate=args.error_rate) as server:
+        bench = Bench(server.base_url,args.output,args.retries)
+        result = bench.run(timestamps,args.workers)
+
+    print(f"Processed {result['snapshots']} snapshot(s), {result['rows']} rows in {result['elapsed']:.1f}s "
+          f"({result['snapshots']/result['elapsed']:.1f} snapshots/s, {result['rows']/result['elapsed']:.0f} rows/s), "
+          f"{result['failed']} failed, {result['retried']} retried request(s), {server.errors}/{server.requests} injected error(s)")
+    print(bench.latency().to_string(index=False,float_format='%.1f'))
@@ -0,0 +1,27 @@
+from src import ingestion
+from src import stationmeta
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Micro-batched ingestion of NEA and LTA snapshots from a watched directory')
+    parser.add_argument('--watch','-w', type=str, help='Local directory laid out like the buckets i.e. taxis/<ts>.json and <measure>/<ts>.json')
+    parser.add_argument('--project','-p', nargs='?', default='ml-eng-cs611-group-project', type=str, help='GCP project name i.e. ml-eng-cs611-group-project')
+    parser.add_argument('--dataset_id','-d', nargs='?', default='taxi_dataset', type=str, help='GBQ dataset ID i.e. taxi_dataset')
+    parser.add_argument('--local','-l', nargs='?', default=None, type=str, help='If provided, write CSV tables to this directory instead of GBQ')
+    parser.add_argument('--max_rows','-r', nargs='?', default=200000, type=int, help='Flush after this many buffered rows')
+    parser.add_argument('--max_wait','-t', nargs='?', default=30, type=float, help='Flush after the oldest buffered snapshot is this many seconds old')
+    parser.add_argument('--existing','-e', action="store_true", help='If provided, also ingest files already in the watched directory')
+    args = parser.parse_args()
+
+    if args.local:
+        sink = ingestion.LocalSink(args.local)
+        trackers = None
+    else:
+        sink = ingestion.GbqSink(args.project,args.dataset_id)
+        trackers = {measure:stationmeta.StationTracker(stationmeta.query_current_stations(measure,args.project,args.dataset_id))
+                    for measure in ingestion.MEASURES}
+
+    worker = ingestion.IngestionWorker(sink,max_rows=args.max_rows,max_wait=args.max_wait,trackers=trackers)
+    watcher = ingestion.DirectoryWatcher(args.watch,existing=args.existing)
+    ingestion.run(worker,watcher)
@@ -9,6 +9,8 @@ import warnings
 warnings.filterwarnings('ignore')
 
 from src import assignment
+from src import stationmeta
+from src import querycache
 
 def get_grid_data(gridfile:str) -> type(gpd.GeoDataFrame):
     '''Read the shpfile containing Singapore grid data
@@ -32,34 +34,44 @@ def get_grid_data(gridfile:str) -> type(gpd.GeoDataFrame):
     return grids_df
 
 
-def query_nea_metadata(measure:str, query:str, project_id:str='ml-eng-cs611-group-project',dataset_id:str='taxi_dataset_reference')->type(pd.DataFrame):
-    '''Query NEA BigQuery for metadata
+def query_nea_metadata(measure:str, query:str, project_id:str='ml-eng-cs611-group-project',dataset_id:str='taxi_dataset_reference',index:stationmeta.StationIndex=None,cache:querycache.QueryCache=None)->type(pd.DataFrame):
+    '''Query NEA BigQuery for the stations active at a timestamp
     Args:
         measure:            rainfall, relative-humidity or air-temperature
         query_timestamp:    i.e. 2022-06-01 13:15:00
         project_id:         Google Cloud project_id
         dataset_id:         Google Cloud dataset_id
+        index:              If provided, stationmeta.StationIndex of the measure to look up instead of querying
+        cache:              If provided, querycache.QueryCache to read historical results from
     Returns:
         pandas.DataFrame containing metadata for selected measure
     '''
-    table_dict={'rainfall':'rainfall-metadata','relative-humidity':'relative-humidity-metadata','air-temperature':'air-temperature-metadata'}
+    if index is not None:
+        df = index.as_of(query)[['station','latitude','longitude']].copy()
+        df.insert(0,'timestamp',pd.Timestamp(query))
+        return df.reset_index(drop=True)
 
+    table_dict={'rainfall':'rainfall-stations','relative-humidity':'relative-humidity-stations','air-temperature':'air-temperature-stations'}
+
+    # Latest change of every station at or before the timestamp, dropping stations removed since
     sql = f"""
-    SELECT timestamp, station, latitude, longitude
+    SELECT CAST('{query}' AS DATETIME) AS timestamp, station, latitude, longitude
     FROM `{dataset_id}.{table_dict[measure]}`
-    WHERE timestamp = '{query}'
+    WHERE valid_from <= '{query}'
+    QUALIFY ROW_NUMBER() OVER (PARTITION BY station ORDER BY valid_from DESC) = 1 AND active
     """
 
-    return pd.read_gbq(sql, project_id=project_id)
+    return querycache.read_gbq(sql, project_id, cache)
 
 
-def query_nea_items(measure:str, query:str, project_id:str='ml-eng-cs611-group-project',dataset_id:str='taxi_dataset_reference')->type(pd.DataFrame):
+def query_nea_items(measure:str, query:str, project_id:str='ml-eng-cs611-group-project',dataset_id:str='taxi_dataset_reference',cache:querycache.QueryCache=None)->type(pd.DataFrame):
     '''Query NEA BigQuery for values
     Args:
         measure:            rainfall, relative-humidity or air-temperature
         query_timestamp:    i.e. 2022-06-01 13:15:00
         project_id:         Google Cloud project_id
         dataset_id:         Google Cloud dataset_id
+        cache:              If provided, querycache.QueryCache to read historical results from
     Returns:
         pandas.DataFrame containing metadata for selected measure
     '''
@@ -72,15 +84,20 @@ def query_nea_items(measure:str, query:str, project_id:str='ml-eng-cs611-group-p
     WHERE timestamp = '{query}'
     """
 
-    return pd.read_gbq(sql, project_id=project_id)
+    return querycache.read_gbq(sql, project_id, cache)
 
 
-def assign_measure(query:str,measure:str,grids_df:type(gpd.GeoDataFrame))->type(pd.DataFrame):
+def assign_measure(query:str,measure:str,grids_df:type(gpd.GeoDataFrame),index:stationmeta.StationIndex=None,cache:querycache.QueryCache=None,
+                   project_id:str='ml-eng-cs611-group-project',dataset_id:str='taxi_dataset_reference')->type(pd.DataFrame):
     '''Generate ranked assignment of stations to grids sorted by Euclidean distance
     Args:
         query:str:                      Timestamp to query databases e.g. '2022-06-01 13:15:00'
         measure:str:                    relative-humidity, rainfall or air-temperature
         grids_df:geopandas.DataFrame:   DataFrame containing map data of Singapore
+        index:stationmeta.StationIndex: If provided, station lookup of the measure instead of querying per timestamp
+        cache:querycache.QueryCache:    If provided, cache of historical station queries
+        project_id:str:                 Google Cloud project_id
+        dataset_id:str:                 Google Cloud dataset_id
     
     Returns:
         measure_df  pandas DataFrame of the following schema:
@@ -91,7 +108,7 @@ def assign_measure(query:str,measure:str,grids_df:type(gpd.GeoDataFrame))->type(
             station_id:     Unique identifier for station            
     '''
 
-    df_metadata=query_nea_metadata(measure=measure,query=query)
+    df_metadata=query_nea_metadata(measure=measure,query=query,project_id=project_id,dataset_id=dataset_id,index=index,cache=cache)
     df_metadata['latlon']=df_metadata[['longitude','latitude',]].apply(tuple,axis=1)
     df_metadata.index=df_metadata['station']
     grid_nums = list(grids_df['grid_num'].unique())
@@ -123,6 +140,7 @@ if __name__ == '__main__':
     parser.add_argument('--table_id','-t', nargs='?', default='assignment-station', type=str, help='GBQ table ID i.e. assignment-taxi')
     parser.add_argument('--gridfile','-g', nargs='?', default='./updated codes/filter_grids_2/filter_grids_2.shp', type=str, help='Path to gridfiles (static data)')
     parser.add_argument('--query','-q', type=str, help='Timestamp to assign i.e. 2022-06-01 13:15:00')
+    parser.add_argument('--cache','-c', nargs='?', default=None, const='./.querycache', type=str, help='If provided, directory to cache historical query results in')
     args = parser.parse_args()
     
     project = args.project
@@ -135,6 +153,7 @@ if __name__ == '__main__':
     measures = ['rainfall','air-temperature','relative-humidity']
 
     fs = gcsfs.GCSFileSystem(project=project)
+    cache = querycache.QueryCache(args.cache) if args.cache else None
         
     ### Section 1: Read grid file data and preprocess
     grids_df = get_grid_data(gridfile)
@@ -146,7 +165,10 @@ if __name__ == '__main__':
     
     for measure in measures:
         print(f"Assigning stations for [{measure}]")
-        result=assign_measure(query,measure,grids_df)    
+        result=assign_measure(query,measure,grids_df,cache=cache)
         table_id=f'assignment-station-{measure}'
         print(f"Writing to table {dataset_id}.{table_id}")
-        result.to_gbq('.'.join([dataset_id,table_id]),project,if_exists='append')
\ No newline at end of file
+        result.to_gbq('.'.join([dataset_id,table_id]),project,if_exists='append')
+
+    if cache is not None:
+        cache.report()
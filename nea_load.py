@@ -2,14 +2,16 @@ import gcsfs
 import re
 
 from src import jsonParser
+from src import stationmeta
 
-def load_nea_to_gbq(project:str,dataset_id:str,measure:str,filename:str,fs:None):
+def load_nea_to_gbq(project:str,dataset_id:str,measure:str,filename:str,fs:None,tracker:stationmeta.StationTracker=None):
     '''Load a single json 
     Args:
         project:str:        
         dataset_id:str:
         measure:str:
         filename:str:
+        tracker:            Station state of the measure, reused across files. Read from GBQ if None.
     '''
     print(f"Current processing {filename}")
     parser = jsonParser.jsonParser(fs)
@@ -19,13 +21,27 @@ def load_nea_to_gbq(project:str,dataset_id:str,measure:str,filename:str,fs:None)
 
     item_table = dataset_id+'.'+measure+'-items'
     metadata_table = dataset_id+'.'+measure+'-metadata'
+    station_table = dataset_id+'.'+measure+'-stations'
 
     print(f"Writing {measure} items to {item_table}")
     items.to_gbq(item_table,project,chunksize=None,if_exists='append')
 
-    print(f"Writing {measure} metadata to {metadata_table}")    
+    # Full snapshots are still read by the views i.e. all-item-join-live, until they move to <measure>-stations
+    print(f"Writing {measure} metadata to {metadata_table}")
     metadata.to_gbq(metadata_table,project,chunksize=None,if_exists='append')
 
+    if tracker is None:
+        tracker = stationmeta.StationTracker(stationmeta.query_current_stations(measure,project,dataset_id))
+    changes = tracker.update(metadata)
+    if len(changes):
+        print(f"Writing {len(changes)} {measure} station change(s) to {station_table}")
+        try:
+            changes.to_gbq(station_table,project,chunksize=None,if_exists='append')
+        except Exception:
+            tracker.rollback()
+            raise
+    tracker.commit()
+
 
 def get_start_index(start_file:str,file_list:list):
     '''Iteratively search from start of file list to find first occurence of end_file.
@@ -100,6 +116,7 @@ if __name__ == '__main__':
         
         fs.glob('/'.join([bucket,measure,"*"]))
         filenames = fs.glob('/'.join([bucket,measure,"*"]))
+        tracker = stationmeta.StationTracker(stationmeta.query_current_stations(measure,project,dataset_id))
 
         if batch:              
             start_index = get_start_index(start_file,filenames)
@@ -107,7 +124,7 @@ if __name__ == '__main__':
             filenames = filenames[start_index:end_index]
 
             for file in filenames:
-                load_nea_to_gbq(project,dataset_id,measure,file,fs)
+                load_nea_to_gbq(project,dataset_id,measure,file,fs,tracker)
                     
             print("Last file loaded.")
 
@@ -121,6 +138,6 @@ if __name__ == '__main__':
                 print("No filename provided, default to latest file")      
                 filename=filenames[-1]
 
-            load_nea_to_gbq(project,dataset_id,measure,filename,fs)
+            load_nea_to_gbq(project,dataset_id,measure,filename,fs,tracker)
     
     
\ No newline at end of file
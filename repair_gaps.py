@@ -0,0 +1,93 @@
+import json
+import gcsfs
+import pandas as pd
+
+from src import gaps
+from src import alignment
+from src import dataloader
+from src import jsonParser
+
+
+def fetch_snapshot(fs,bucket:str,stream:str,timestamp)->str:
+    '''Fetch one missing snapshot from the API and store it under the repair prefix, with the name the collectors use.
+    The parser functions skip the prefix, so the snapshot is only loaded by load_snapshots.
+    Returns:
+        Path of the stored object
+    '''
+    query = f"{timestamp:%Y-%m-%dT%H:%M:%S}"
+    if stream=='taxi':
+        data = dataloader.get_taxi_data(query)
+    else:
+        data = dataloader.get_weather_data(query,stream)[stream]
+    filename = '/'.join([bucket,gaps.REPAIR_PREFIX,gaps.STREAMS[stream][0],f"{timestamp:%Y-%m-%dT%H-%M-%S}.json"])
+    fs.pipe(filename,json.dumps(data).encode())
+    return filename
+
+
+def load_snapshots(project:str,dataset_id:str,stream:str,filenames:list,fs):
+    '''Parse snapshots and append them to GBQ with one load per table'''
+    parser = jsonParser.jsonParser(fs)
+    if stream=='taxi':
+        tables = {'taxi-availability':[parser.load_taxi_data(filename) for filename in filenames]}
+    else:
+        # Station changes are recorded in order by the live path, replaying past snapshots would break their intervals.
+        # Full snapshots are still read by the views i.e. all-item-join-live, until they move to <measure>-stations.
+        tables = {stream+'-items':[parser.get_items(filename,stream) for filename in filenames],
+                  stream+'-metadata':[parser.get_metadata(filename,stream) for filename in filenames]}
+    for table, df_list in tables.items():
+        df = pd.concat(df_list,ignore_index=True)
+        print(f"Writing {len(df)} rows to {dataset_id}.{table}")
+        df.to_gbq(dataset_id+'.'+table,project,chunksize=None,if_exists='append')
+
+
+def repair(fs,project:str,dataset_id:str,bucket:str,stream:str,work:pd.DataFrame):
+    '''Fetch and load the timestamps of a plan from gaps.plan'''
+    filenames = []
+    for row in work.itertuples():
+        filename = row.filename
+        try:
+            if row.fetch:
+                filename = fetch_snapshot(fs,bucket,stream,row.timestamp)
+                print(f"Fetched {filename}")
+        except Exception:
+            print(f"Empty data for {row.timestamp}")
+            continue
+        if row.load:
+            filenames.append(filename)
+    if filenames:
+        load_snapshots(project,dataset_id,stream,filenames,fs)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Finds 15 minute intervals missing in storage or GBQ and fetches and loads only those')
+    parser.add_argument('--project','-p', nargs='?', default='ml-eng-cs611-group-project', type=str, help='GCP project name i.e. ml-eng-cs611-group-project')
+    parser.add_argument('--dataset_id','-d', nargs='?', default='taxi_dataset_reference', type=str, help='GBQ dataset ID i.e. taxi_dataset_reference')
+    parser.add_argument('--taxi_bucket', nargs='?', default='ml-eng-cs611-group-project-taxis', type=str, help='GCS bucket of taxi snapshots')
+    parser.add_argument('--nea_bucket', nargs='?', default='ml-eng-cs611-group-project-nea', type=str, help='GCS bucket of NEA snapshots')
+    parser.add_argument('--stream','-m', nargs='?', type=str, help='taxi, rainfall, air-temperature or relative-humidity. Default to all 4')
+    parser.add_argument('--startdate','-s', type=str, help='Start of the range to repair i.e. 2022-06-01')
+    parser.add_argument('--enddate','-e', type=str, help='End of the range to repair i.e. 2022-06-30 23:45')
+    parser.add_argument('--freq','-f', nargs='?', default='15min', type=str, help='Interval of the expected schedule')
+    parser.add_argument('--tolerance','-t', nargs='?', default='5min', type=str, help='Largest distance between a scheduled timestamp and a snapshot covering it')
+    parser.add_argument('--dry_run', action="store_true", help='If provided, only print the missing intervals')
+    args = parser.parse_args()
+
+    project = args.project
+    dataset_id = args.dataset_id
+    streams = [args.stream] if args.stream else list(gaps.STREAMS)
+    schedule = alignment.get_schedule(args.startdate,args.enddate,args.freq)
+    fs = gcsfs.GCSFileSystem(project=project)
+
+    for stream in streams:
+        bucket = args.taxi_bucket if stream=='taxi' else args.nea_bucket
+        storage = gaps.get_storage_snapshots(fs,bucket,stream,schedule[0]-pd.Timedelta(args.tolerance),schedule[-1]+pd.Timedelta(args.tolerance))
+        sink = gaps.query_sink_timestamps(stream,schedule[0]-pd.Timedelta(args.tolerance),schedule[-1]+pd.Timedelta(args.tolerance),project,dataset_id)
+        work = gaps.plan(schedule,storage,sink,args.tolerance)
+
+        print(f"[{stream}] {work['fetch'].sum()} timestamp(s) to fetch, {work['load'].sum()} to load out of {len(schedule)}")
+        if len(work):
+            print(gaps.get_intervals(work['timestamp'],args.freq).to_string(index=False))
+        if not args.dry_run and len(work):
+            repair(fs,project,dataset_id,bucket,stream,work)
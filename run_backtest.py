@@ -0,0 +1,18 @@
+from src import backtest
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Backtests the 30/60 minute forecasts and recommendations against history')
+    parser.add_argument('--cube','-c', type=str, help='Directory of the feature cube holding the history')
+    parser.add_argument('--model','-m', nargs='?', default='forecaster.npz', type=str, help='Coefficients written by src/forecaster.py')
+    parser.add_argument('--startdate','-s', type=str, help='First day to backtest i.e. 2019-01-01')
+    parser.add_argument('--enddate','-e', type=str, help='Last day to backtest i.e. 2019-12-31')
+    parser.add_argument('--workers','-w', nargs='?', default=None, type=int, help='Number of worker processes. Defaults to the number of cores')
+    parser.add_argument('--output','-o', nargs='?', default=None, type=str, help='If provided, write metrics to this CSV')
+    args = parser.parse_args()
+
+    metrics = backtest.run(args.cube,args.model,args.startdate,args.enddate,args.workers)
+    print(metrics.to_string(index=False))
+    if args.output:
+        metrics.to_csv(args.output,index=False)
@@ -0,0 +1,153 @@
+import numpy as np
+import pandas as pd
+
+TABLES = {
+    'taxi':'taxi-availability',
+    'rainfall':'rainfall-items',
+    'air-temperature':'air-temperature-items',
+    'relative-humidity':'relative-humidity-items'
+}
+# Tables and snapshot names use naive Singapore time
+TIMEZONE = 'Asia/Singapore'
+
+
+def to_naive(timestamps)->pd.DatetimeIndex:
+    '''Timestamps as naive Singapore time
+    Comments:
+        GBQ stores Singapore wall-clock times and read_gbq labels them UTC, so a UTC label is
+        only dropped. Real offsets, i.e. the +08:00 strings of the feeds, are converted.
+    '''
+    try:
+        timestamps = pd.DatetimeIndex(pd.to_datetime(timestamps))
+    except (ValueError,TypeError):
+        # Strings with different offsets, converted one at a time
+        return pd.DatetimeIndex([to_naive([t])[0] for t in timestamps])
+    if timestamps.tz is None:
+        return timestamps
+    wall = timestamps.tz_localize(None)
+    if (wall==timestamps.tz_convert('UTC').tz_localize(None)).all():
+        return wall
+    return timestamps.tz_convert(TIMEZONE).tz_localize(None)
+
+
+def get_schedule(start,end,freq:str='15min')->pd.DatetimeIndex:
+    '''Canonical timestamps between start and end, both inclusive'''
+    start, end = (to_naive([t])[0] for t in (start,end))
+    return pd.date_range(start.ceil(freq),end.floor(freq),freq=freq)
+
+
+def match_snapshots(snapshots,schedule:pd.DatetimeIndex,tolerance:str='5min',direction:str='nearest')->pd.DataFrame:
+    '''As-of match every canonical timestamp to one snapshot
+    Args:
+        snapshots:  Timestamps of the snapshots of one stream, in any order and with repeats.
+                    Both snapshots and schedule may be tz-aware, they are compared in naive Singapore time.
+        schedule:   Canonical timestamps i.e. from get_schedule
+        tolerance:  Largest distance between a canonical timestamp and its snapshot
+        direction:  'backward' to use the latest snapshot at or before, 'forward' the earliest at
+                    or after, 'nearest' the closest either way
+    Returns:
+        pandas DataFrame of the schema:
+            - timestamp:            Canonical timestamp
+            - snapshot_timestamp:   Matched snapshot, NaT for a gap
+    '''
+    snapshots = pd.DataFrame({'snapshot_timestamp':np.unique(to_naive(snapshots).to_numpy())})
+    schedule = pd.DataFrame({'timestamp':to_naive(schedule)})
+    # Align resolutions, merge_asof requires identical dtypes on both keys
+    snapshots['snapshot_timestamp'] = snapshots['snapshot_timestamp'].astype(schedule['timestamp'].dtype)
+    return pd.merge_asof(schedule,snapshots,left_on='timestamp',right_on='snapshot_timestamp',
+                         direction=direction,tolerance=pd.Timedelta(tolerance))
+
+
+def match_positions(times:np.ndarray,schedule:np.ndarray,tolerance:str='5min',direction:str='nearest')->np.ndarray:
+    '''Array counterpart of match_snapshots for hot paths, two binary searches and no merge
+    Args:
+        times:      Sorted unique naive datetime64 array of the snapshots
+        schedule:   Naive datetime64 array of the timestamps to match
+    Returns:
+        Position in times of the snapshot matched to every timestamp, -1 for a gap
+    '''
+    times = np.asarray(times,dtype='datetime64[ns]').view(np.int64)
+    schedule = np.asarray(schedule,dtype='datetime64[ns]').view(np.int64)
+    if not len(times):
+        return np.full(len(schedule),-1)
+    never = np.iinfo(np.int64).max
+    backward = np.searchsorted(times,schedule,side='right')-1
+    forward = np.searchsorted(times,schedule,side='left')
+    backward_gap = np.where(backward>=0,schedule-times[backward.clip(min=0)],never)
+    forward_gap = np.where(forward<len(times),times[forward.clip(max=len(times)-1)]-schedule,never)
+    if direction=='backward':
+        position, gap = backward, backward_gap
+    elif direction=='forward':
+        position, gap = forward, forward_gap
+    else:
+        # Ties go backward, as in merge_asof
+        position = np.where(backward_gap<=forward_gap,backward,forward)
+        gap = np.minimum(backward_gap,forward_gap)
+    return np.where(gap<=pd.Timedelta(tolerance).value,position,-1)
+
+
+def align(df:pd.DataFrame,start,end,freq:str='15min',tolerance:str='5min',direction:str='nearest'):
+    '''Snap one stream onto the canonical schedule
+    Args:
+        df:     Rows of one stream with a timestamp column, i.e. taxi-availability or <measure>-items
+    Returns:
+        aligned:    Rows of the matched snapshots, with timestamp replaced by the canonical timestamp
+                    and the original kept as snapshot_timestamp. Unmatched snapshots are dropped.
+        gaps:       DatetimeIndex of canonical timestamps without a snapshot within tolerance
+    '''
+    matches = match_snapshots(df['timestamp'],get_schedule(start,end,freq),tolerance,direction)
+    gaps = pd.DatetimeIndex(matches.loc[matches['snapshot_timestamp'].isna(),'timestamp'])
+    matches = matches.dropna(subset=['snapshot_timestamp'])
+
+    df = df.rename(columns={'timestamp':'snapshot_timestamp'})
+    df['snapshot_timestamp'] = to_naive(df['snapshot_timestamp']).astype(matches['snapshot_timestamp'].dtype)
+    aligned = matches.merge(df,on='snapshot_timestamp',how='inner')
+    return aligned, gaps
+
+
+def align_streams(streams:dict,start,end,freq:str='15min',tolerance:str='5min',direction:str='nearest'):
+    '''Snap several streams onto the same canonical schedule and report their gaps
+    Args:
+        streams:    Dictionary of stream name to DataFrame, i.e. taxi, rainfall, air-temperature, relative-humidity
+    Returns:
+        aligned:    Dictionary of stream name to aligned DataFrame, see align
+        report:     pandas DataFrame with one row per stream of the schema:
+                        - stream
+                        - expected:     Number of canonical timestamps
+                        - matched
+                        - gaps
+                        - max_offset:   Largest distance between a snapshot and its canonical timestamp
+                        - gap_timestamps
+    '''
+    aligned, rows = {}, []
+    expected = len(get_schedule(start,end,freq))
+    for name, df in streams.items():
+        aligned[name], gaps = align(df,start,end,freq,tolerance,direction)
+        offsets = (aligned[name]['snapshot_timestamp']-aligned[name]['timestamp']).abs()
+        rows.append({
+            'stream':name,
+            'expected':expected,
+            'matched':expected-len(gaps),
+            'gaps':len(gaps),
+            'max_offset':offsets.max() if len(offsets) else pd.NaT,
+            'gap_timestamps':list(gaps)
+        })
+        print(f"[{name}] matched {expected-len(gaps)}/{expected} timestamps, {len(gaps)} gap(s)")
+    return aligned, pd.DataFrame(rows)
+
+
+def query_stream(stream:str,start,end,tolerance:str='5min',project_id:str='ml-eng-cs611-group-project',dataset_id:str='taxi_dataset_reference')->pd.DataFrame:
+    '''Query a whole date range of one stream, padded by tolerance so edge snapshots can still be matched
+    Args:
+        stream:     taxi, rainfall, air-temperature or relative-humidity
+        start:      i.e. 2022-06-01 00:00:00
+        end:        i.e. 2022-06-30 23:45:00
+    '''
+    start = pd.Timestamp(start)-pd.Timedelta(tolerance)
+    end = pd.Timestamp(end)+pd.Timedelta(tolerance)
+    sql = f"""
+    SELECT *
+    FROM `{dataset_id}.{TABLES[stream]}`
+    WHERE timestamp BETWEEN '{start}' AND '{end}'
+    """
+    return pd.read_gbq(sql, project_id=project_id)
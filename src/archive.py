@@ -0,0 +1,126 @@
+import re
+import gzip
+import json
+import struct
+import bisect
+from datetime import datetime
+
+from src.compression import decompress
+
+# Archive layout: one gzip member per snapshot, each holding a single JSON line, so the data
+# section is itself a valid newline-delimited JSON gzip stream. It is followed by a JSON
+# index of snapshot names, offsets and lengths, and a fixed size footer pointing at the index.
+FOOTER = struct.Struct('<Q4s')
+MAGIC = b'SNP1'
+
+re_timestamp = re.compile(r"\d\d\d\d-\d\d-\d\dT\d\d-\d\d-\d\d")
+
+
+def get_timestamp(name:str)->datetime:
+    '''Timestamp of a snapshot, truncated to the minute as in jsonParser'''
+    return datetime.strptime(re_timestamp.findall(name)[0][:16],'%Y-%m-%dT%H-%M')
+
+
+def pack(snapshots,f)->int:
+    '''Write an archive
+    Args:
+        snapshots:  Iterable of (name, data) where name is the original object name i.e.
+                    rainfall/2022-05-24T22-21-01.json and data its raw, possibly compressed, bytes
+        f:          Writable binary file object
+    Returns:
+        Number of snapshots written
+    '''
+    names, offsets, lengths = [], [], []
+    offset = 0
+    for name, data in sorted(snapshots,key=lambda snapshot: snapshot[0]):
+        member = gzip.compress(decompress(data).rstrip(b'\n')+b'\n',compresslevel=9,mtime=0)
+        f.write(member)
+        names.append(name)
+        offsets.append(offset)
+        lengths.append(len(member))
+        offset += len(member)
+
+    index = json.dumps({'names':names,'offsets':offsets,'lengths':lengths}).encode()
+    f.write(index)
+    f.write(FOOTER.pack(len(index),MAGIC))
+    return len(names)
+
+
+def pack_day(fs,prefix:str,date:str,out_path:str)->int:
+    '''Pack every snapshot of one day into a single archive
+    Args:
+        fs:         gcsfs.GCSFileSystem object, or fsspec local filesystem
+        prefix:     Snapshot folder i.e. ml-eng-cs611-group-project-nea/rainfall
+        date:       Day to pack i.e. 2022-05-24
+        out_path:   Path of the archive to write i.e. ml-eng-cs611-group-project-archive/rainfall/2022-05-24.pack
+    Returns:
+        Number of snapshots packed
+    '''
+    filenames = fs.glob('/'.join([prefix,date+"T*"]))
+    print(f"Packing {len(filenames)} snapshot(s) from {prefix} on {date}")
+    # cat fetches all objects of the day concurrently instead of one request at a time
+    contents = fs.cat(filenames)
+    with fs.open(out_path,'wb') as f:
+        # Keep names relative to the bucket i.e. rainfall/2022-05-24T22-21-01.json, as in the trigger events
+        return pack((('/'.join(name.split('/')[-2:]),contents[name]) for name in filenames),f)
+
+
+class SnapshotArchive():
+    '''Reader for a daily snapshot archive
+    Args:
+        path:   Path to archive. Accepts Google Cloud URL if fs is provided.
+        fs:     gcsfs.GCSFileSystem object. If None, the local filesystem is used.
+    '''
+    def __init__(self,path:str,fs=None):
+        self.path=path
+        self.fs=fs
+        with self._open() as f:
+            f.seek(-FOOTER.size,2)
+            size = f.tell()
+            index_length, magic = FOOTER.unpack(f.read(FOOTER.size))
+            if magic!=MAGIC:
+                raise ValueError(f"{path} is not a snapshot archive")
+            f.seek(size-index_length)
+            index = json.loads(f.read(index_length))
+        self.names=index['names']
+        self.offsets=index['offsets']
+        self.lengths=index['lengths']
+        self.timestamps=[get_timestamp(name) for name in self.names]
+
+    def _open(self):
+        if self.fs!=None:
+            return self.fs.open(self.path,'rb')
+        return open(self.path,'rb')
+
+    def __len__(self):
+        return len(self.names)
+
+    def find(self,timestamp)->int:
+        '''Position of the latest snapshot at or before timestamp'''
+        if isinstance(timestamp,str):
+            timestamp = datetime.fromisoformat(timestamp)
+        i = bisect.bisect_right(self.timestamps,timestamp)-1
+        if i<0:
+            raise KeyError(f"No snapshot at or before {timestamp} in {self.path}")
+        return i
+
+    def read(self,timestamp):
+        '''Seek to a single snapshot
+        Returns:
+            name:   Original object name of the snapshot
+            data:   Decoded JSON of the snapshot
+        '''
+        i = self.find(timestamp)
+        with self._open() as f:
+            f.seek(self.offsets[i])
+            member = f.read(self.lengths[i])
+        return self.names[i], json.loads(gzip.decompress(member))
+
+    def __iter__(self):
+        '''Yields (name, data) for every snapshot in one sequential read'''
+        if not self.names:
+            return
+        with self._open() as f:
+            buffer = f.read(self.offsets[-1]+self.lengths[-1])
+        for name, offset, length in zip(self.names,self.offsets,self.lengths):
+            yield name, json.loads(gzip.decompress(buffer[offset:offset+length]))
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 import gcsfs
 import sys
@@ -20,6 +21,8 @@ from collections import Counter
 warnings.filterwarnings('ignore')
 sys.path.append('smu-cs611-mleng-project')
 from src import jsonParser
+from src import fallback
+from src import alignment
 
 class Assignment():
     '''Object to assign taxi and NEA data to grids
@@ -114,4 +117,130 @@ class Assignment():
         self.grids = self.grids.merge(self.taxi_count, how='left',on='grid_num')
         self.grids['taxi_count']=self.grids['taxi_count'].fillna(0)
         self.grids['timestamp']=self.grids['timestamp'].fillna(self.taxi_timestamp)
-        return self.grids
\ No newline at end of file
+        return self.grids
+
+    def batch_taxi_count(self,timestamps:np.ndarray,grids)->np.ndarray:
+        '''Taxis per grid at every timestamp, as an int array of shape [timestamp, grid]
+        Args:
+            timestamps: Sorted naive datetime64[ns] array
+            grids:      GeoDataFrame of the grids in output order, taxis are counted in the polygon containing them
+        '''
+        import shapely
+        taxi = self.taxi_data
+        if 'longitude' in taxi.columns:
+            longitude, latitude = taxi['longitude'].to_numpy(dtype=float), taxi['latitude'].to_numpy(dtype=float)
+        else:
+            longitude, latitude = shapely.get_x(taxi['geometry'].values), shapely.get_y(taxi['geometry'].values)
+
+        taxi_times = alignment.to_naive(taxi['timestamp']).to_numpy().astype('datetime64[ns]')
+        t_idx = np.searchsorted(timestamps,taxi_times).clip(max=len(timestamps)-1)
+        valid = timestamps[t_idx]==taxi_times
+
+        # A taxi on the edge between two grids is only counted in the first of them
+        taxi_idx, g_idx = shapely.STRtree(grids.geometry.values).query(shapely.points(longitude,latitude),predicate='intersects')
+        taxi_idx, first = np.unique(taxi_idx,return_index=True)
+        grid_of = np.full(len(taxi),-1)
+        grid_of[taxi_idx] = g_idx[first]
+        valid &= grid_of>=0
+
+        n = len(grids)
+        return np.bincount(t_idx[valid]*n+grid_of[valid],minlength=len(timestamps)*n).reshape(len(timestamps),n)
+
+    def batch_measure(self,measure:str,timestamps:np.ndarray,centroids:np.ndarray,tolerance:str='5min',direction:str='nearest'):
+        '''Reading of the nearest station with one for every grid at every timestamp
+        Args:
+            timestamps: Sorted naive datetime64[ns] array
+            tolerance:  Largest distance between a timestamp and the readings matched to it
+            direction:  Readings matched to a timestamp, see alignment.match_snapshots
+        Returns:
+            values:     float array of shape [timestamp, grid], NaN where no station has a reading
+            station_id: object array of shape [timestamp, grid] of the station used, None where none was
+        '''
+        items = self.nea_data[measure]['items']
+        metadata = self.nea_data[measure]['metadata']
+        values = np.full((len(timestamps),len(centroids)),np.nan)
+        station_id = np.full(values.shape,None,dtype=object)
+        if not len(items) or not len(metadata):
+            return values, station_id
+
+        item_times, stations, readings = fallback.get_reading_matrix(
+            items.assign(timestamp=alignment.to_naive(items['timestamp']).to_numpy().astype('datetime64[ns]')))
+        # Readings are published on their own schedule, i.e. 22:21 for a taxi snapshot at 22:20:58
+        matched = alignment.match_positions(item_times,timestamps,tolerance,direction)
+        # Row of the reading matrix for every timestamp, the trailing all-NaN row where there are no readings
+        row = np.where(matched>=0,matched,len(item_times))
+        readings = np.concatenate([readings,np.full((1,len(stations)),np.nan)])[row]
+
+        # Station set in effect at every timestamp is the latest metadata at or before its readings,
+        # -1 before the first metadata, where the timestamp is left without readings
+        meta_times = alignment.to_naive(metadata['timestamp']).to_numpy().astype('datetime64[ns]')
+        versions = np.unique(meta_times)
+        version = np.searchsorted(versions,np.where(matched>=0,item_times[matched.clip(min=0)],timestamps),side='right')-1
+
+        rankings = {}
+        for v in np.unique(version[version>=0]):
+            ss = metadata[meta_times==versions[v]].sort_values('station')
+            key = (tuple(ss['station']),tuple(ss['longitude']),tuple(ss['latitude']))
+            if key not in rankings:
+                # Columns of the reading matrix ranked by distance from every grid centroid, -1 for stations without readings
+                coordinates = ss[['longitude','latitude']].to_numpy(dtype=float)
+                distances = np.hypot(centroids[:,None,0]-coordinates[None,:,0],centroids[:,None,1]-coordinates[None,:,1])
+                ranked = ss['station'].to_numpy().astype(str)[np.argsort(distances,axis=1,kind='stable')]
+                pos = np.searchsorted(stations,ranked).clip(max=len(stations)-1)
+                rankings[key] = np.where(stations[pos]==ranked,pos,-1)
+            rank_idx = rankings[key]
+
+            t = version==v
+            values[t], chosen = fallback.resolve_readings(rank_idx,readings[t])
+            station_idx = np.take_along_axis(np.broadcast_to(rank_idx,chosen.shape+rank_idx.shape[1:]),
+                                             chosen.clip(min=0)[...,None],axis=2)[...,0]
+            station_id[t] = np.where(chosen>=0,stations[station_idx],None)
+        return values, station_id
+
+    def batch(self,timestamps=None,wide:bool=False,tolerance:str='5min',direction:str='nearest')->pd.DataFrame:
+        '''Assign taxi counts and NEA readings to every grid at many timestamps at once
+        Args:
+            timestamps: Timestamps to assign. Defaults to every timestamp in taxi_data.
+                        nea_data and taxi_data may hold any number of timestamps, naive or tz-aware.
+            wide:       If True, return one row per timestamp with (feature, grid_num) columns
+            tolerance:  Largest distance between a timestamp and the NEA readings matched to it
+            direction:  'nearest', 'backward' or 'forward', see alignment.match_snapshots
+        Returns:
+            pandas DataFrame with one row per timestamp and grid of the schema
+                - timestamp
+                - grid_num
+                - taxi_count
+                - Per measure, the reading named by its Description and <measure>_station_id
+        Comments:
+            Timestamps, grids and stations are mapped to integer positions once and readings are
+            gathered into dense [timestamp, grid] arrays, so no frames are merged. Timestamps are
+            compared in naive Singapore time. Stations are ranked by distance from the grid centroids
+            and a grid falls back to its next nearest station when the nearest has no reading, as in
+            fallback.resolve_measure. The readings of a measure are matched as-of every timestamp.
+            Taxis are counted in the grid polygon containing them, so any grid shapefile works,
+            i.e. SG_grids, filter_grids_2 or QuadTree.to_gdf.
+        '''
+        grids = self.grids.drop_duplicates('grid_num').sort_values('grid_num')
+        grid_nums = grids['grid_num'].to_numpy().astype(int)
+        centroids = np.column_stack([grids.geometry.centroid.x,grids.geometry.centroid.y])
+        if timestamps is None:
+            timestamps = self.taxi_data['timestamp']
+        timestamps = np.unique(alignment.to_naive(timestamps).to_numpy().astype('datetime64[ns]'))
+
+        features = {'taxi_count':self.batch_taxi_count(timestamps,grids)}
+        station_ids = {}
+        for measure in ['rainfall','air-temperature','relative-humidity']:
+            items = self.nea_data[measure]['items']
+            name = items['Description'].iloc[0] if 'Description' in items.columns and len(items) else measure
+            features[name], station_ids[f'{measure}_station_id'] = self.batch_measure(measure,timestamps,centroids,tolerance,direction)
+
+        if wide:
+            columns = pd.MultiIndex.from_product([list(features),grid_nums],names=['feature','grid_num'])
+            return pd.DataFrame(np.concatenate(list(features.values()),axis=1),columns=columns,
+                                index=pd.DatetimeIndex(timestamps,name='timestamp'))
+
+        n_timestamps, n_grids = len(timestamps), len(grid_nums)
+        df = pd.DataFrame({'timestamp':np.repeat(timestamps,n_grids),'grid_num':np.tile(grid_nums,n_timestamps)})
+        for name, values in {**features,**station_ids}.items():
+            df[name] = values.ravel()
+        return df
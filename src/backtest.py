@@ -0,0 +1,141 @@
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
+
+from src import cube
+from src import forecaster
+
+HORIZONS = {30:'y_30',60:'y_60'}
+AVAILABILITY = ['Poor','Fair','Good']
+
+
+def get_availability(taxis:np.ndarray)->np.ndarray:
+    '''Vectorized availability classes of prediction-v2: 0 Poor (<=5), 1 Fair (<=10), 2 Good'''
+    return (taxis>5).astype(int)+(taxis>10).astype(int)
+
+
+def get_book_later(predicted:np.ndarray,current:np.ndarray)->np.ndarray:
+    '''Vectorized recommendation of prediction-v2: True for "Book later", False for "Book now"'''
+    return (predicted>current) & (current<=5)
+
+
+def backtest_day(cube_path:str,model_path:str,date:str)->dict:
+    '''Replay every interval of one day, comparing predictions against realized taxi_count
+    Returns:
+        Dictionary of metric sums per horizon, to be combined with merge_results
+    '''
+    features = cube.FeatureCube(cube_path,mode='r')
+    model = forecaster.Forecaster.load(model_path)
+    grid_idx = model.grid_index(features.grid_nums)
+    known = grid_idx>=0
+    grid_idx = grid_idx[known]
+    feature_idx = [features.features.index(f) for f in forecaster.FEATURES if f in features.features]
+    names = [f for f in forecaster.FEATURES if f in features.features]
+    taxi = features.features.index('taxi_count')
+
+    results = {}
+    for minutes, label in HORIZONS.items():
+        if label not in model.labels:
+            continue
+        results[minutes] = {'n':0,'abs_error':0.,'sq_error':0.,'error':0.,'availability_correct':0,
+                            'book_later':0,'book_later_correct':0,'book_now':0,'book_now_correct':0,
+                            'availability_confusion':np.zeros((3,3),dtype=int)}
+
+    offset = {minutes:int(pd.Timedelta(minutes=minutes)//features.freq) for minutes in results}
+    for timestamp in pd.date_range(date,periods=int(pd.Timedelta(days=1)//features.freq),freq=features.freq):
+        slot = features.slot(timestamp)
+        if not 0<=slot<features.length:
+            continue
+        current = features.cube[slot][known]
+
+        # Same feature space as the serving query, for every grid at once
+        df = pd.DataFrame(current[:,feature_idx],columns=names)
+        df['timestamp'] = timestamp
+        x = model.design(df)
+        predicted = np.trunc(np.einsum('gf,gfl->gl',x,model.coef[grid_idx]))
+
+        for minutes, metrics in results.items():
+            if slot+offset[minutes]>=features.length:
+                continue
+            realized = features.cube[slot+offset[minutes]][known][:,taxi]
+            y = predicted[:,model.labels.index(HORIZONS[minutes])]
+            valid = ~(np.isnan(realized) | np.isnan(y) | np.isnan(current[:,taxi]))
+            y, realized, now = y[valid], realized[valid], current[valid,taxi]
+
+            error = y-realized
+            metrics['n'] += len(y)
+            metrics['abs_error'] += np.abs(error).sum()
+            metrics['sq_error'] += (error**2).sum()
+            metrics['error'] += error.sum()
+
+            predicted_class, realized_class = get_availability(y), get_availability(realized)
+            metrics['availability_correct'] += int((predicted_class==realized_class).sum())
+            np.add.at(metrics['availability_confusion'],(predicted_class,realized_class),1)
+
+            later = get_book_later(y,now)
+            metrics['book_later'] += int(later.sum())
+            metrics['book_later_correct'] += int((later & (realized>now)).sum())
+            metrics['book_now'] += int((~later).sum())
+            metrics['book_now_correct'] += int((~later & (realized<=now)).sum())
+    return results
+
+
+def merge_results(results:list)->dict:
+    '''Sum metric dictionaries of several days'''
+    merged = {}
+    for result in results:
+        for minutes, metrics in result.items():
+            if minutes not in merged:
+                merged[minutes] = {k:(v.copy() if isinstance(v,np.ndarray) else v) for k,v in metrics.items()}
+            else:
+                for k,v in metrics.items():
+                    merged[minutes][k] = merged[minutes][k]+v
+    return merged
+
+
+def summarize(merged:dict)->pd.DataFrame:
+    '''Error and recommendation accuracy metrics per horizon'''
+    rows = []
+    for minutes, m in sorted(merged.items()):
+        n = max(m['n'],1)
+        rows.append({
+            'horizon':f'{minutes}min',
+            'n':m['n'],
+            'mae':m['abs_error']/n,
+            'rmse':np.sqrt(m['sq_error']/n),
+            'bias':m['error']/n,
+            'availability_accuracy':m['availability_correct']/n,
+            'book_later_rate':m['book_later']/n,
+            'book_later_precision':m['book_later_correct']/max(m['book_later'],1),
+            'book_now_precision':m['book_now_correct']/max(m['book_now'],1),
+            'recommendation_accuracy':(m['book_later_correct']+m['book_now_correct'])/n
+        })
+    return pd.DataFrame(rows)
+
+
+def run(cube_path:str,model_path:str,start:str,end:str,workers:int=None)->pd.DataFrame:
+    '''Backtest every day between start and end, one day per process
+    Args:
+        cube_path:  Directory of a cube.FeatureCube holding the history
+        model_path: Coefficients written by src/forecaster.py
+        start:      First day i.e. 2019-01-01
+        end:        Last day i.e. 2019-12-31
+        workers:    Size of the process pool, defaults to the number of cores
+    Returns:
+        pandas DataFrame of metrics per horizon
+    '''
+    dates = pd.date_range(start,end,freq='D').strftime('%Y-%m-%d')
+    begin = time.monotonic()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(backtest_day,cube_path,model_path,date) for date in dates]
+        for future in tqdm(as_completed(futures),total=len(futures),desc='Days backtested'):
+            results.append(future.result())
+
+    merged = merge_results(results)
+    print(f"Backtested {len(dates)} day(s) in {time.monotonic()-begin:.1f}s")
+    for minutes, m in sorted(merged.items()):
+        print(f"[{minutes}min] availability confusion (rows predicted, columns realized {AVAILABILITY}):\n{m['availability_confusion']}")
+    return summarize(merged)
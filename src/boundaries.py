@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from shapely.geometry import Polygon, MultiPolygon
+from shapely.strtree import STRtree
+import xml.etree.ElementTree as ET
+
+SUBZONE_FILE = './eda/singapore_map/subzone-census2010-shp/Subzone_Census2010.shp'
+NPC_FILE = './Gridding/singapore-police-force-npc-boundary/spf-boundaries.kml'
+KML = {'kml':'http://www.opengis.net/kml/2.2'}
+
+
+def load_subzones(path:str=SUBZONE_FILE)->gpd.GeoDataFrame:
+    '''Read the 2010 census subzones, reprojected from SVY21 to longitude/latitude'''
+    subzones = gpd.read_file(path).to_crs(epsg=4326)
+    return subzones[['SUBZONE_N','SUBZONE_C','PLN_AREA_N','REGION_N','geometry']]
+
+
+def load_npc(path:str=NPC_FILE)->gpd.GeoDataFrame:
+    '''Read the Neighbourhood Police Centre boundaries from KML
+    Returns:
+        geopandas DataFrame with the KML SimpleData fields (NPC_NAME, DIVISION, DIV, ...) and geometry
+    '''
+    def ring(element):
+        text = element.find('.//kml:coordinates',KML).text.split()
+        return [tuple(float(v) for v in point.split(',')[:2]) for point in text]
+
+    rows = []
+    for placemark in ET.parse(path).getroot().iter('{%s}Placemark' % KML['kml']):
+        row = {data.get('name'):data.text for data in placemark.iter('{%s}SimpleData' % KML['kml'])}
+        polygons = [Polygon(ring(polygon.find('kml:outerBoundaryIs',KML)),
+                            [ring(inner) for inner in polygon.findall('kml:innerBoundaryIs',KML)])
+                    for polygon in placemark.iter('{%s}Polygon' % KML['kml'])]
+        row['geometry'] = polygons[0] if len(polygons)==1 else MultiPolygon(polygons)
+        rows.append(row)
+    return gpd.GeoDataFrame(rows,geometry='geometry',crs='EPSG:4326')
+
+
+class BoundaryLayer():
+    '''Polygon layer that taxis are assigned to with a single bulk STRtree query
+    Args:
+        name:   Name of the layer i.e. subzone
+        gdf:    geopandas DataFrame of polygons in longitude/latitude
+        key:    Column identifying each polygon i.e. SUBZONE_N
+    '''
+    def __init__(self,name:str,gdf:gpd.GeoDataFrame,key:str):
+        self.name=name
+        self.key=key
+        # A key may span several polygons, i.e. an NPC split into separate placemarks
+        self.keys, self.polygon_key=np.unique(gdf[key].to_numpy().astype(str),return_inverse=True)
+        self.tree=STRtree(gdf.geometry.values)
+
+    def assign(self,longitude,latitude)->np.ndarray:
+        '''Index of the polygon containing each point, -1 for points outside every polygon'''
+        # Parked taxis repeat the same coordinates across snapshots, only query each location once
+        coordinates, inverse = np.unique(np.column_stack([longitude,latitude]),axis=0,return_inverse=True)
+        points = shapely.points(coordinates)
+        point_idx, polygon_idx = self.tree.query(points,predicate='within')
+        result = np.full(len(points),-1)
+        # Points on a shared border match several polygons, the lowest index wins
+        result[point_idx[::-1]] = polygon_idx[::-1]
+        return result[inverse.ravel()]
+
+    def count(self,taxi_df:pd.DataFrame)->pd.DataFrame:
+        '''Count taxis per polygon for every timestamp
+        Args:
+            taxi_df:    pandas DataFrame of one or many snapshots, of the schema returned by
+                        jsonParser.load_taxi_data (timestamp, longitude, latitude)
+        Returns:
+            pandas DataFrame of the schema:
+                - timestamp
+                - <key>
+                - taxi_count
+            with a row for every polygon at every timestamp
+        '''
+        timestamps, t_idx = np.unique(taxi_df['timestamp'].to_numpy(),return_inverse=True)
+        polygon_idx = self.assign(taxi_df['longitude'].to_numpy(),taxi_df['latitude'].to_numpy())
+        inside = polygon_idx>=0
+        print(f"[{self.name}] {(~inside).sum()} of {len(inside)} taxi(s) outside every polygon")
+
+        n = len(self.keys)
+        key_idx = self.polygon_key[polygon_idx[inside]]
+        counts = np.bincount(t_idx[inside]*n+key_idx,minlength=len(timestamps)*n)
+        return pd.DataFrame({
+            'timestamp':np.repeat(timestamps,n),
+            self.key:np.tile(self.keys,len(timestamps)),
+            'taxi_count':counts
+        })
+
+
+def get_layers(subzone_file:str=SUBZONE_FILE,npc_file:str=NPC_FILE)->list:
+    '''Subzone and NPC layers of the boundary files shipped with the repo'''
+    return [BoundaryLayer('subzone',load_subzones(subzone_file),'SUBZONE_N'),
+            BoundaryLayer('npc',load_npc(npc_file),'NPC_NAME')]
+
+
+def count_layers(taxi_df:pd.DataFrame,layers:list)->dict:
+    '''Per-polygon taxi counts of every layer, keyed by layer name'''
+    return {layer.name:layer.count(taxi_df) for layer in layers}
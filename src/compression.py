@@ -0,0 +1,25 @@
+import gzip
+import json
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Shared by src/jsonParser.py and the jsonParser and taxiAssignment cloud functions, which deploy it alongside main.py
+
+
+def decompress(data:bytes)->bytes:
+    '''Decompress gzip or zstd payloads written by the collectors, passing plain JSON through'''
+    if data[:2]==b'\x1f\x8b':
+        data = gzip.decompress(data)
+    elif data[:4]==b'\x28\xb5\x2f\xfd':
+        if zstandard is None:
+            raise ImportError("zstandard is required to read zstd compressed snapshots")
+        data = zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return data
+
+
+def loads(data:bytes):
+    '''Decode a snapshot, compressed or not'''
+    return json.loads(decompress(data))
@@ -0,0 +1,196 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+
+FEATURES = ['taxi_count','rainfall','air_temperature','relative_humidity']
+
+
+class FeatureCube():
+    '''Memory-mapped array of shape [timestamp, grid_num, feature] stored on local disk
+    Args:
+        path:       Directory holding cube.npy and meta.json
+        grid_nums:  List of grid_num covered by the cube. Required when creating a new cube.
+        start:      First timestamp of the cube i.e. 2019-01-01 00:00:00. Required when creating a new cube.
+        freq:       Interval between consecutive timestamps
+        features:   Feature names, in storage order
+        capacity:   Number of timestamps to preallocate. Defaults to a year of 15 minute intervals.
+        mode:       'r' to open read-only (serving), 'r+' to allow appends
+    Comments:
+        Timestamps are implicit: slot i holds start + i*freq, so the timestamp index is a
+        division rather than a lookup. Slots never appended to hold NaN.
+    '''
+    def __init__(self,path:str,grid_nums=None,start=None,freq:str='15min',features:list=FEATURES,capacity:int=35040,mode:str='r+'):
+        self.path=path
+        self.mode=mode
+        self.meta_path=os.path.join(path,'meta.json')
+        self.data_path=os.path.join(path,'cube.npy')
+
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path,'r') as f:
+                meta = json.load(f)
+        else:
+            if grid_nums is None or start is None:
+                raise ValueError(f"No cube found at {path}, grid_nums and start are required to create one")
+            os.makedirs(path,exist_ok=True)
+            meta = {
+                'start':str(pd.Timestamp(start)),
+                'freq':str(pd.Timedelta(freq)),
+                'grid_nums':[int(i) for i in sorted(grid_nums)],
+                'features':list(features),
+                'length':0
+            }
+            cube = np.lib.format.open_memmap(self.data_path,mode='w+',dtype=np.float32,
+                                             shape=(capacity,len(meta['grid_nums']),len(meta['features'])))
+            cube[:] = np.nan
+            cube.flush()
+            del cube
+            self._write_meta(meta)
+
+        self.start=pd.Timestamp(meta['start'])
+        self.freq=pd.Timedelta(meta['freq'])
+        self.grid_nums=np.array(meta['grid_nums'],dtype=int)
+        self.features=meta['features']
+        self.length=meta['length']
+        self.cube=np.load(self.data_path,mmap_mode=mode)
+
+    def _write_meta(self,meta:dict):
+        tmp_path = self.meta_path+'.tmp'
+        with open(tmp_path,'w') as f:
+            json.dump(meta,f)
+        os.replace(tmp_path,self.meta_path) # Readers never see a half written index
+
+    def _save_meta(self):
+        self._write_meta({
+            'start':str(self.start),
+            'freq':str(self.freq),
+            'grid_nums':self.grid_nums.tolist(),
+            'features':self.features,
+            'length':self.length
+        })
+
+    def _grow(self,capacity:int):
+        '''Reallocate the cube file with a larger capacity, keeping existing data'''
+        print(f"Growing cube from {self.cube.shape[0]} to {capacity} timestamps")
+        tmp_path = self.data_path+'.tmp'
+        cube = np.lib.format.open_memmap(tmp_path,mode='w+',dtype=np.float32,
+                                         shape=(capacity,)+self.cube.shape[1:])
+        cube[:self.length] = self.cube[:self.length]
+        cube[self.length:] = np.nan
+        cube.flush()
+        del cube
+        del self.cube
+        os.replace(tmp_path,self.data_path)
+        self.cube=np.load(self.data_path,mmap_mode=self.mode)
+
+    @property
+    def capacity(self):
+        return self.cube.shape[0]
+
+    @property
+    def timestamps(self):
+        '''DatetimeIndex of all appended slots'''
+        return pd.date_range(self.start,periods=self.length,freq=self.freq)
+
+    @property
+    def end(self):
+        '''Timestamp of the last appended slot'''
+        return self.start+(self.length-1)*self.freq
+
+    def slot(self,timestamp):
+        '''Position of a timestamp along the first axis of the cube'''
+        offset = pd.Timestamp(timestamp)-self.start
+        if offset%self.freq!=pd.Timedelta(0):
+            raise ValueError(f"{timestamp} is not aligned to the {self.freq} schedule starting {self.start}")
+        return int(offset//self.freq)
+
+    def grid_index(self,grid_nums):
+        '''Position of grid_num(s) along the second axis of the cube'''
+        grid_nums = np.asarray(grid_nums,dtype=int)
+        idx = np.searchsorted(self.grid_nums,grid_nums).clip(max=len(self.grid_nums)-1)
+        if not np.all(self.grid_nums[idx]==grid_nums):
+            raise KeyError(f"grid_num {np.setdiff1d(grid_nums,self.grid_nums)} not in cube")
+        return idx
+
+    def append(self,timestamp,values):
+        '''Write one interval into the cube
+        Args:
+            timestamp:  Timestamp of the interval. Gaps since the last append are left as NaN.
+            values:     Either a float array of shape [grid, feature] in cube order, or a pandas
+                        DataFrame with a grid_num column and one column per feature. Grids
+                        missing from the DataFrame are left as NaN.
+        '''
+        slot = self.slot(timestamp)
+        if slot<0:
+            raise ValueError(f"{timestamp} is before the start of the cube {self.start}")
+        if slot>=self.capacity:
+            self._grow(max(2*self.capacity,slot+1))
+
+        if isinstance(values,pd.DataFrame):
+            row = np.full(self.cube.shape[1:],np.nan,dtype=np.float32)
+            row[self.grid_index(values['grid_num'].to_numpy())] = values[self.features].to_numpy(dtype=np.float32)
+        else:
+            row = np.asarray(values,dtype=np.float32)
+        self.cube[slot] = row
+
+        if slot>=self.length:
+            self.length=slot+1
+            self._save_meta()
+
+    def window(self,start=None,end=None):
+        '''Zero-copy view of all slots between start and end, both inclusive
+        Returns:
+            numpy memmap of shape [timestamp, grid, feature]
+        '''
+        i = 0 if start is None else self.slot(start)
+        j = self.length if end is None else self.slot(end)+1
+        return self.cube[max(i,0):min(j,self.length)]
+
+    def get(self,timestamp,grid_num=None,feature:str=None):
+        '''Lookup a single interval, optionally narrowed to one grid and/or feature'''
+        slot = self.slot(timestamp)
+        if not 0<=slot<self.length:
+            raise KeyError(f"{timestamp} not in cube")
+        row = self.cube[slot]
+        if grid_num is not None:
+            row = row[self.grid_index(grid_num)]
+        if feature is not None:
+            row = row[...,self.features.index(feature)]
+        return row
+
+    def flush(self):
+        if self.mode!='r':
+            self.cube.flush()
+            self._save_meta()
+
+    def to_frame(self,start=None,end=None)->pd.DataFrame:
+        '''Long format pandas DataFrame of a window, with the schema timestamp, grid_num, *features'''
+        window = self.window(start,end)
+        i = 0 if start is None else max(self.slot(start),0)
+        timestamps = pd.date_range(self.start+i*self.freq,periods=window.shape[0],freq=self.freq)
+        df = pd.DataFrame(window.reshape(-1,window.shape[2]),columns=self.features)
+        df.insert(0,'grid_num',np.tile(self.grid_nums,window.shape[0]))
+        df.insert(0,'timestamp',np.repeat(timestamps,window.shape[1]))
+        return df
+
+
+def from_frame(path:str,df:pd.DataFrame,grid_nums=None,freq:str='15min',features:list=FEATURES)->FeatureCube:
+    '''Bulk build a cube from a long format table such as the all-item-join view
+    Args:
+        path:       Directory to create the cube in
+        df:         pandas DataFrame with timestamp, grid_num and feature columns
+        grid_nums:  grid_num covered by the cube. Defaults to those found in df.
+    Returns:
+        FeatureCube opened for appends
+    '''
+    timestamps = pd.to_datetime(df['timestamp'])
+    start = timestamps.min().floor(freq)
+    if grid_nums is None:
+        grid_nums = np.unique(df['grid_num'].to_numpy().astype(int))
+
+    slots = ((timestamps-start)//pd.Timedelta(freq)).to_numpy()
+    cube = FeatureCube(path,grid_nums=grid_nums,start=start,freq=freq,features=features,capacity=int(slots.max())+1)
+    cube.cube[slots,cube.grid_index(df['grid_num'].to_numpy())] = df[features].to_numpy(dtype=np.float32)
+    cube.length = int(slots.max())+1
+    cube.flush()
+    return cube
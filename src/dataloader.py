@@ -1,4 +1,4 @@
-from pydantic import NoneStr
+import os
 import requests
 import numpy as np
 import pandas as pd
@@ -7,7 +7,9 @@ import re
 import argparse
 import json
 
-from sklearn import datasets
+# Overridable to point at a local stand-in such as src/replay.py
+API_BASE = os.environ.get('API_BASE','https://api.data.gov.sg/v1')
+
 
 def get_weather_data(query:str,dataset:str=None):
     '''Returns dictionary of JSON objects for weather data given a datetime string
@@ -22,7 +24,7 @@ def get_weather_data(query:str,dataset:str=None):
     results={}
 
     for measure in data_sets:
-        URL = "https://api.data.gov.sg/v1/environment/"+measure
+        URL = API_BASE+"/environment/"+measure
         params={'date_time':query}
         r=requests.get(URL,params=params)
         results[measure]=r.json()
@@ -31,7 +33,7 @@ def get_weather_data(query:str,dataset:str=None):
 def get_taxi_data(query:str):
     '''Returns the coordinates of all taxis via the LTA API endpoint for a given datetime string
     '''
-    URL = "https://api.data.gov.sg/v1/transport/taxi-availability"
+    URL = API_BASE+"/transport/taxi-availability"
     params={'date_time':query}
     r=requests.get(URL,params=params)
     return r.json()
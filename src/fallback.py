@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+
+
+def get_rank_matrix(rank_df:pd.DataFrame,query:str=None):
+    '''Pivot a station ranking table into a dense [grid, rank] array of station ids
+    Args:
+        rank_df:    Ranking table written by nea_assignment.py, of the schema
+                        - grid_num
+                        - date_active
+                        - date_inactive
+                        - rank
+                        - station_id
+        query:      If provided, only rankings active at this timestamp are kept i.e. 2022-06-01 13:15:00
+    Returns:
+        grid_nums:  numpy array of grid_num, one per row of the rank matrix
+        ranked:     numpy object array of station_id of shape [grid, rank]. Grids with
+                    fewer ranked stations are padded with None.
+    '''
+    if query is not None and 'date_active' in rank_df.columns:
+        query = pd.to_datetime(query)
+        rank_df = rank_df[(rank_df['date_active']<=query) & (rank_df['date_inactive']>query)]
+        # Several assignments may be active, keep the latest one per grid and rank
+        rank_df = rank_df.sort_values('date_active').drop_duplicates(['grid_num','rank'],keep='last')
+
+    grid_nums, grid_idx = np.unique(rank_df['grid_num'].to_numpy().astype(int),return_inverse=True)
+    rank = rank_df['rank'].to_numpy().astype(int)
+
+    ranked = np.full((len(grid_nums),rank.max()+1),None,dtype=object)
+    ranked[grid_idx,rank] = rank_df['station_id'].to_numpy()
+    return grid_nums, ranked
+
+
+def get_reading_matrix(items_df:pd.DataFrame,stations=None):
+    '''Pivot NEA readings into a dense [timestamp, station] array
+    Args:
+        items_df:   pandas DataFrame of the schema returned by jsonParser.get_items or query_nea_items
+                        - timestamp
+                        - station_id
+                        - value
+        stations:   Optional station_id ordering for the columns. Defaults to all stations seen in items_df.
+    Returns:
+        timestamps: numpy datetime64 array, one per row of the reading matrix
+        stations:   numpy array of station_id, one per column of the reading matrix
+        readings:   float array of shape [timestamp, station]. Missing readings are NaN.
+    '''
+    timestamps, t_idx = np.unique(items_df['timestamp'].to_numpy(),return_inverse=True)
+    station_ids = items_df['station_id'].to_numpy().astype(str)
+
+    if stations is None:
+        stations, s_idx = np.unique(station_ids,return_inverse=True)
+        valid = np.ones(len(s_idx),dtype=bool)
+    else:
+        stations = np.asarray(stations).astype(str)
+        order = np.argsort(stations)
+        pos = np.searchsorted(stations,station_ids,sorter=order).clip(max=len(stations)-1)
+        s_idx = order[pos]
+        valid = stations[s_idx]==station_ids # drop readings from stations outside the ordering
+
+    readings = np.full((len(timestamps),len(stations)),np.nan)
+    readings[t_idx[valid],s_idx[valid]] = items_df['value'].to_numpy().astype(float)[valid]
+    return timestamps, stations, readings
+
+
+def resolve_readings(rank_idx:np.ndarray,readings:np.ndarray):
+    '''For every timestamp and grid, pick the reading of the best ranked station that has one
+    Args:
+        rank_idx:   int array of shape [grid, rank] indexing columns of readings. -1 marks an empty rank.
+        readings:   float array of shape [timestamp, station] with NaN for missing readings
+    Returns:
+        values:     float array of shape [timestamp, grid]. NaN where no ranked station has a reading.
+        chosen:     int array of shape [timestamp, grid] of the chosen rank. -1 where no reading was found.
+    '''
+    # Pad with an all-NaN column so that empty ranks (-1) gather a missing reading
+    padded = np.concatenate([readings,np.full((readings.shape[0],1),np.nan)],axis=1)
+    candidates = padded[:,rank_idx] # [timestamp, grid, rank]
+    available = ~np.isnan(candidates)
+
+    chosen = available.argmax(axis=2) # first available rank
+    found = available.any(axis=2)
+    values = np.take_along_axis(candidates,chosen[...,None],axis=2)[...,0]
+    chosen[~found] = -1
+    return values, chosen
+
+
+def resolve_measure(rank_df:pd.DataFrame,items_df:pd.DataFrame,query:str=None)->pd.DataFrame:
+    '''Assign a reading to every grid at every timestamp of items_df, falling back down the
+    station ranking whenever the nearest station has no reading.
+    Args:
+        rank_df:    Ranking table written by nea_assignment.py for one measure
+        items_df:   NEA readings for the same measure, covering any number of timestamps
+        query:      If provided, only rankings active at this timestamp are used
+    Returns:
+        pandas DataFrame of the following schema:
+            - timestamp
+            - grid_num
+            - station_id:   Station whose reading was used
+            - rank:         Rank of that station for the grid, 0 being the nearest
+            - value
+        Grids for which no ranked station has a reading are kept with a NaN value.
+    '''
+    grid_nums, ranked = get_rank_matrix(rank_df,query)
+    timestamps, stations, readings = get_reading_matrix(items_df)
+
+    # Map station ids in the ranking to columns of the reading matrix
+    ranked_ids = np.where(ranked==None,'',ranked).astype(str)
+    pos = np.searchsorted(stations,ranked_ids).clip(max=len(stations)-1)
+    rank_idx = np.where(stations[pos]==ranked_ids,pos,-1)
+
+    values, chosen = resolve_readings(rank_idx,readings)
+
+    found = chosen>=0
+    station_idx = np.take_along_axis(np.broadcast_to(rank_idx,chosen.shape+rank_idx.shape[1:]),
+                                     chosen.clip(min=0)[...,None],axis=2)[...,0]
+    station_id = np.where(found,stations[station_idx],None)
+
+    n_timestamps, n_grids = values.shape
+    return pd.DataFrame({
+        'timestamp':np.repeat(timestamps,n_grids),
+        'grid_num':np.tile(grid_nums,n_timestamps),
+        'station_id':station_id.ravel(),
+        'rank':chosen.ravel(),
+        'value':values.ravel()
+    })
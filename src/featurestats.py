@@ -0,0 +1,370 @@
+import os
+import csv
+import glob
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+from src.trainingdata import CATEGORICALS
+
+QUANTILES = np.linspace(0,1,11)
+BUCKETS = 10
+# Hidden, so the glob of partition statistics does not pick it up
+MANIFEST = '.manifest.json'
+
+
+class QuantileSketch():
+    '''Mergeable quantile sketch built from a stack of compactors
+    Args:
+        k:  Capacity of every level. Rank error is about log2(n/k)/k.
+    Comments:
+        Level h holds items of weight 2**h. A level over capacity is sorted and every other
+        item promoted to the next level, alternating the offset so errors cancel out. Merging
+        concatenates levels and compacts again, so sketches of any partitions can be combined.
+    '''
+    def __init__(self,k:int=1024):
+        self.k=k
+        self.levels=[np.empty(0)]
+        self.compactions=0
+
+    def update(self,values:np.ndarray):
+        self.levels[0] = np.concatenate([self.levels[0],np.asarray(values,dtype=np.float64)])
+        self.compact()
+        return self
+
+    def compact(self):
+        h = 0
+        while h<len(self.levels):
+            if len(self.levels[h])>self.k:
+                if h+1==len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(self.levels[h])
+                # Odd item out stays behind so no weight is lost
+                keep = items[len(items)-len(items)%2:]
+                self.levels[h+1] = np.concatenate([self.levels[h+1],items[self.compactions%2:len(items)-len(items)%2:2]])
+                self.levels[h] = keep
+                self.compactions += 1
+            h += 1
+
+    def merge(self,other):
+        for h, items in enumerate(other.levels):
+            if h==len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[h] = np.concatenate([self.levels[h],items])
+        self.compactions += other.compactions
+        self.compact()
+        return self
+
+    def weighted(self):
+        '''Sorted items and their cumulative weights'''
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level),2.0**h) for h,level in enumerate(self.levels)])
+        order = np.argsort(items,kind='stable')
+        return items[order], np.cumsum(weights[order])
+
+    def quantiles(self,q)->np.ndarray:
+        items, cumulative = self.weighted()
+        if not len(items):
+            return np.full(len(np.atleast_1d(q)),np.nan)
+        idx = np.searchsorted(cumulative,np.atleast_1d(q)*cumulative[-1],side='left').clip(max=len(items)-1)
+        return items[idx]
+
+    def histogram(self,edges:np.ndarray)->np.ndarray:
+        '''Approximate counts between consecutive edges'''
+        items, cumulative = self.weighted()
+        if not len(items):
+            return np.zeros(len(edges)-1)
+        below = np.concatenate([[0],cumulative])[np.searchsorted(items,edges[1:-1],side='left')]
+        return np.diff(np.concatenate([[0],below,[cumulative[-1]]]))
+
+    def to_dict(self)->dict:
+        return {'k':self.k,'compactions':self.compactions,'levels':[level.tolist() for level in self.levels]}
+
+    @classmethod
+    def from_dict(cls,d:dict):
+        sketch = cls(d['k'])
+        sketch.compactions = d['compactions']
+        sketch.levels = [np.array(level,dtype=np.float64) for level in d['levels']]
+        return sketch
+
+
+class NumericStats():
+    '''One-pass count, mean and variance (Welford, merged with Chan's formula), min/max, zeros and a quantile sketch'''
+    def __init__(self,is_int:bool=False,k:int=1024):
+        self.is_int=is_int
+        self.count=0
+        self.missing=0
+        self.zeros=0
+        self.mean=0.
+        self.m2=0.
+        self.min=np.inf
+        self.max=-np.inf
+        self.sketch=QuantileSketch(k)
+
+    def combine(self,count:int,mean:float,m2:float):
+        '''Chan's parallel update of mean and sum of squared deviations'''
+        total = self.count+count
+        if count==0:
+            return
+        delta = mean-self.mean
+        self.mean += delta*count/total
+        self.m2 += m2+delta**2*self.count*count/total
+        self.count = total
+
+    def update(self,values):
+        values = np.asarray(values,dtype=np.float64)
+        present = values[~np.isnan(values)]
+        self.missing += len(values)-len(present)
+        if not len(present):
+            return self
+        mean = present.mean()
+        self.combine(len(present),mean,((present-mean)**2).sum())
+        self.zeros += int((present==0).sum())
+        self.min = min(self.min,present.min())
+        self.max = max(self.max,present.max())
+        self.sketch.update(present)
+        return self
+
+    def merge(self,other):
+        self.combine(other.count,other.mean,other.m2)
+        self.missing += other.missing
+        self.zeros += other.zeros
+        self.min = min(self.min,other.min)
+        self.max = max(self.max,other.max)
+        self.sketch.merge(other.sketch)
+        return self
+
+    @property
+    def std(self)->float:
+        return np.sqrt(self.m2/self.count) if self.count else np.nan
+
+    def summary(self)->dict:
+        edges = np.linspace(self.min,self.max,BUCKETS+1) if self.count else np.zeros(BUCKETS+1)
+        quantiles = self.sketch.quantiles(QUANTILES)
+        # The extremes are known exactly
+        quantiles[QUANTILES==0], quantiles[QUANTILES==1] = self.min, self.max
+        return {
+            'count':self.count,'missing':self.missing,'zeros':self.zeros,
+            'mean':self.mean,'std':self.std,'min':self.min,'max':self.max,
+            'quantiles':quantiles.tolist(),
+            'histogram':{'edges':edges.tolist(),'counts':self.sketch.histogram(edges).tolist()}
+        }
+
+    def to_dict(self)->dict:
+        return {'type':'numeric','is_int':self.is_int,'count':self.count,'missing':self.missing,'zeros':self.zeros,
+                'mean':self.mean,'m2':self.m2,'min':self.min,'max':self.max,'sketch':self.sketch.to_dict()}
+
+    @classmethod
+    def from_dict(cls,d:dict):
+        stats = cls(d['is_int'])
+        for key in ['count','missing','zeros','mean','m2','min','max']:
+            setattr(stats,key,d[key])
+        stats.sketch = QuantileSketch.from_dict(d['sketch'])
+        return stats
+
+
+class CategoricalStats():
+    '''Exact value counts of a categorical feature'''
+    def __init__(self,is_int:bool=True):
+        self.is_int=is_int
+        self.missing=0
+        self.counts={}
+
+    @property
+    def count(self)->int:
+        return sum(self.counts.values())
+
+    def update(self,values):
+        values = pd.Series(values)
+        self.missing += int(values.isna().sum())
+        for value, n in values.dropna().value_counts().items():
+            value = str(int(value)) if self.is_int else str(value)
+            self.counts[value] = self.counts.get(value,0)+int(n)
+        return self
+
+    def merge(self,other):
+        self.missing += other.missing
+        for value, n in other.counts.items():
+            self.counts[value] = self.counts.get(value,0)+n
+        return self
+
+    def summary(self)->dict:
+        top = sorted(self.counts.items(),key=lambda item:-item[1])
+        return {'count':self.count,'missing':self.missing,'unique':len(self.counts),'top':top[:10]}
+
+    def to_dict(self)->dict:
+        return {'type':'categorical','is_int':self.is_int,'missing':self.missing,'counts':self.counts}
+
+    @classmethod
+    def from_dict(cls,d:dict):
+        stats = cls(d['is_int'])
+        stats.missing = d['missing']
+        stats.counts = dict(d['counts'])
+        return stats
+
+
+class DatasetStats():
+    '''Per-feature statistics of a dataset, or of one partition of it
+    Args:
+        categoricals:   Columns summarized as value counts instead of numeric statistics
+        exclude:        Columns that are not summarized
+    '''
+    def __init__(self,categoricals:list=CATEGORICALS,exclude:list=['timestamp']):
+        self.categoricals=list(categoricals)
+        self.exclude=list(exclude)
+        self.rows=0
+        self.features={}
+
+    def update(self,df:pd.DataFrame):
+        '''Add a chunk of rows'''
+        for c in df.columns:
+            if c in self.exclude:
+                continue
+            if c not in self.features:
+                is_int = pd.api.types.is_integer_dtype(df[c])
+                if c in self.categoricals:
+                    self.features[c] = CategoricalStats(is_int)
+                elif pd.api.types.is_numeric_dtype(df[c]):
+                    self.features[c] = NumericStats(is_int)
+                else:
+                    continue
+            self.features[c].update(df[c].to_numpy())
+        self.rows += len(df)
+        return self
+
+    def merge(self,other):
+        self.rows += other.rows
+        for c, stats in other.features.items():
+            if c in self.features:
+                self.features[c].merge(stats)
+            else:
+                self.features[c] = stats
+        return self
+
+    def summary(self)->pd.DataFrame:
+        '''One row per feature, in the spirit of the StatisticsGen visualization'''
+        return pd.DataFrame([{'feature':c,'type':type(stats).__name__,**stats.summary()}
+                             for c, stats in self.features.items()]).set_index('feature')
+
+    def schema(self)->str:
+        '''Schema in the text format of tensorflow_metadata Schema, for tfx.dsl.Importer instead of SchemaGen'''
+        lines = []
+        for c, stats in self.features.items():
+            total = stats.count+stats.missing
+            kind = 'INT' if stats.is_int else 'BYTES' if isinstance(stats,CategoricalStats) else 'FLOAT'
+            lines += ['feature {',f'  name: "{c}"',f'  type: {kind}']
+            if isinstance(stats,NumericStats) and stats.count:
+                bound = (lambda v:str(int(v))) if stats.is_int else (lambda v:repr(float(v)))
+                domain = 'int_domain' if stats.is_int else 'float_domain'
+                lines += [f'  {domain} {{',f'    min: {bound(stats.min)}',f'    max: {bound(stats.max)}','  }']
+            lines += ['  presence {',f'    min_fraction: {stats.count/total if total else 1.0:.6g}','    min_count: 1','  }',
+                      '  shape {','    dim {','      size: 1','    }','  }','}']
+        return '\n'.join(lines)+'\n'
+
+    def save(self,path:str):
+        with open(path,'w') as f:
+            json.dump({'categoricals':self.categoricals,'exclude':self.exclude,'rows':self.rows,
+                       'features':{c:stats.to_dict() for c,stats in self.features.items()}},f)
+
+    @classmethod
+    def load(cls,path:str):
+        with open(path) as f:
+            d = json.load(f)
+        stats = cls(d['categoricals'],d['exclude'])
+        stats.rows = d['rows']
+        types = {'numeric':NumericStats,'categorical':CategoricalStats}
+        stats.features = {c:types[s['type']].from_dict(s) for c,s in d['features'].items()}
+        return stats
+
+
+def get_fingerprint(path:str,offset:int,size:int=4096)->str:
+    '''sha256 of the bytes just before offset, to tell an appended CSV from a rewritten one'''
+    with open(path,'rb') as f:
+        f.seek(max(offset-size,0))
+        return hashlib.sha256(f.read(min(offset,size))).hexdigest()
+
+
+def get_offset(path:str,output:str)->int:
+    '''Byte offset up to which the CSV is already summarised in output, 0 if it has to be read from the start'''
+    try:
+        with open(os.path.join(output,MANIFEST)) as f:
+            manifest = json.load(f)
+    except (OSError,ValueError):
+        return 0
+    offset = manifest['offset']
+    if manifest['path']!=os.path.abspath(path) or os.path.getsize(path)<offset or get_fingerprint(path,offset)!=manifest['fingerprint']:
+        return 0
+    return offset
+
+
+def compute_partitions(path:str,output:str,chunksize:int=500000,overwrite:bool=False)->list:
+    '''Stream a training CSV and write the statistics of every date to <output>/<date>.json
+    Args:
+        path:       Training CSV with a timestamp column
+        output:     Directory of partition statistics
+        overwrite:  If False, only rows appended since the last run are read and merged into the statistics
+                    of their dates. If the CSV was rewritten instead, it is read again but dates that
+                    already have statistics are skipped.
+    Returns:
+        List of dates written
+    Comments:
+        The byte offset read so far is kept in <output>/.manifest.json with a fingerprint of the
+        bytes before it, so a daily run only reads and summarises the new days.
+    '''
+    os.makedirs(output,exist_ok=True)
+    done = set() if overwrite else {os.path.basename(p)[:-5] for p in glob.glob(os.path.join(output,'*.json'))}
+    offset = 0 if overwrite else get_offset(path,output)
+    partitions = {}
+    with open(path,'rb') as f:
+        names = next(csv.reader([f.readline().decode()]))
+        if offset:
+            f.seek(offset)
+        for chunk in pd.read_csv(f,names=names,header=None,chunksize=chunksize):
+            dates = pd.to_datetime(chunk['timestamp']).dt.strftime('%Y-%m-%d')
+            for date, rows in chunk.groupby(dates.to_numpy()):
+                if date not in partitions:
+                    if date in done and not offset:
+                        continue
+                    # Appended rows of a date already summarised, i.e. the last day of the previous run
+                    partitions[date] = DatasetStats.load(os.path.join(output,f'{date}.json')) if date in done else DatasetStats()
+                partitions[date].update(rows)
+        end = f.tell()
+
+    for date, stats in partitions.items():
+        stats.save(os.path.join(output,f'{date}.json'))
+    with open(os.path.join(output,MANIFEST),'w') as f:
+        json.dump({'path':os.path.abspath(path),'offset':end,'fingerprint':get_fingerprint(path,end)},f)
+    print(f"Computed statistics for {len(partitions)} partition(s) from {(end-offset)/1024**2:.1f}MB of {path}"
+          +(f", resumed at byte {offset}" if offset else f", skipped {len(done)} existing"))
+    return sorted(partitions)
+
+
+def combine(output:str,start:str=None,end:str=None)->DatasetStats:
+    '''Merge partition statistics, optionally only of dates between start and end'''
+    stats = DatasetStats()
+    for p in sorted(glob.glob(os.path.join(output,'*.json'))):
+        date = os.path.basename(p)[:-5]
+        if (start and date<start) or (end and date>end):
+            continue
+        stats.merge(DatasetStats.load(p))
+    return stats
+
+
+if __name__=='__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Computes mergeable per-day feature statistics and a schema from a training CSV')
+    parser.add_argument('--data','-i', type=str, help='Training CSV i.e. full_2019_2grid.csv')
+    parser.add_argument('--output','-o', nargs='?', default='./stats', type=str, help='Directory of partition statistics')
+    parser.add_argument('--schema', nargs='?', default='schema.pbtxt', type=str, help='Path to write the schema to')
+    parser.add_argument('--overwrite', action="store_true", help='If provided, recompute partitions that already have statistics')
+    args = parser.parse_args()
+
+    compute_partitions(args.data,args.output,overwrite=args.overwrite)
+    stats = combine(args.output)
+    print(f"Statistics of {stats.rows} rows")
+    print(stats.summary()[['count','missing','mean','std','min','max']].to_string())
+    with open(args.schema,'w') as f:
+        f.write(stats.schema())
+    print(f"Schema written to {args.schema}")
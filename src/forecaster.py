@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+
+FEATURES = ['taxi_count','air_temperature','rainfall','relative_humidity','sin_day','cos_day','sin_hour','cos_hour','sin_mth','cos_mth']
+LABELS = ['y_30','y_60']
+
+
+def add_time_features(df:pd.DataFrame)->pd.DataFrame:
+    '''Vectorized cyclical day, hour and month features, as computed in prediction-v2'''
+    timestamp = pd.to_datetime(df['timestamp'])
+    df = df.copy()
+    df['sin_day'] = np.sin(timestamp.dt.weekday/7*2*np.pi)
+    df['cos_day'] = np.cos(timestamp.dt.weekday/7*2*np.pi)
+    df['sin_hour'] = np.sin(timestamp.dt.hour/24*2*np.pi)
+    df['cos_hour'] = np.cos(timestamp.dt.hour/24*2*np.pi)
+    df['sin_mth'] = np.sin(timestamp.dt.month/12*2*np.pi)
+    df['cos_mth'] = np.cos(timestamp.dt.month/12*2*np.pi)
+    return df
+
+
+class Forecaster():
+    '''Per-grid ridge regression over the serving feature space, fitted for all grids at once
+    Args:
+        grid_nums:  List of grid_num to fit a model for
+        features:   Feature columns, in the order of the coefficients
+        labels:     Targets to fit, one set of coefficients each
+        alpha:      Ridge penalty. The intercept is not penalized.
+    Comments:
+        Fitting accumulates X'X and X'y per grid over any number of chunks, then solves every
+        grid's normal equations in a single batched np.linalg.solve. Coefficients are stored as
+        an array of shape [grid, feature + intercept, label].
+    '''
+    def __init__(self,grid_nums,features:list=FEATURES,labels:list=LABELS,alpha:float=1.0):
+        self.grid_nums=np.array(sorted(grid_nums),dtype=int)
+        self.features=list(features)
+        self.labels=list(labels)
+        self.alpha=alpha
+        k = len(self.features)+1
+        self.xtx=np.zeros((len(self.grid_nums),k,k))
+        self.xty=np.zeros((len(self.grid_nums),k,len(self.labels)))
+        self.count=np.zeros(len(self.grid_nums),dtype=int)
+        self.coef=None
+
+    def grid_index(self,grid_nums)->np.ndarray:
+        grid_nums = np.asarray(grid_nums,dtype=int)
+        idx = np.searchsorted(self.grid_nums,grid_nums).clip(max=len(self.grid_nums)-1)
+        return np.where(self.grid_nums[idx]==grid_nums,idx,-1)
+
+    def design(self,df:pd.DataFrame)->np.ndarray:
+        '''Feature matrix with a trailing intercept column'''
+        if not set(self.features).issubset(df.columns):
+            df = add_time_features(df)
+        x = df[self.features].to_numpy(dtype=np.float64)
+        return np.concatenate([x,np.ones((len(x),1))],axis=1)
+
+    def partial_fit(self,df:pd.DataFrame):
+        '''Accumulate sufficient statistics from a chunk of training rows'''
+        df = df.dropna(subset=self.labels)
+        x = self.design(df)
+        y = df[self.labels].to_numpy(dtype=np.float64)
+        g = self.grid_index(df['grid_num'])
+        keep = (g>=0) & ~np.isnan(x).any(axis=1)
+        x, y, g = x[keep], y[keep], g[keep]
+
+        order = np.argsort(g,kind='stable')
+        grids, starts = np.unique(g[order],return_index=True)
+        for grid, xg, yg in zip(grids,np.split(x[order],starts[1:]),np.split(y[order],starts[1:])):
+            self.xtx[grid] += xg.T@xg
+            self.xty[grid] += xg.T@yg
+            self.count[grid] += len(xg)
+        return self
+
+    def solve(self):
+        penalty = self.alpha*np.eye(self.xtx.shape[1])
+        penalty[-1,-1] = 0
+        # Small jitter keeps grids without training rows solvable, they predict 0
+        self.coef = np.linalg.solve(self.xtx+penalty+1e-9*np.eye(self.xtx.shape[1]),self.xty)
+        print(f"Solved {len(self.grid_nums)} grid model(s) from {self.count.sum()} rows")
+        return self
+
+    def fit(self,path:str,chunksize:int=500000):
+        '''Fit from a training CSV in chunks'''
+        for chunk in pd.read_csv(path,chunksize=chunksize):
+            self.partial_fit(chunk)
+        return self.solve()
+
+    def predict(self,df:pd.DataFrame)->np.ndarray:
+        '''Predictions of shape [row, label] for rows with grid_num and feature columns.
+        Rows of unknown grids get NaN.'''
+        x = self.design(df)
+        g = self.grid_index(df['grid_num'])
+        y = np.einsum('nf,nfl->nl',x,self.coef[g.clip(min=0)])
+        y[g<0] = np.nan
+        return y
+
+    def save(self,path:str):
+        np.savez(path,grid_nums=self.grid_nums,coef=self.coef.astype(np.float32),
+                 features=np.array(self.features),labels=np.array(self.labels))
+
+    @classmethod
+    def load(cls,path:str):
+        with np.load(path) as f:
+            model = cls(f['grid_nums'],f['features'].tolist(),f['labels'].tolist())
+            model.coef = f['coef'].astype(np.float64)
+        return model
+
+
+if __name__=='__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Fits per-grid ridge forecasters from a training CSV')
+    parser.add_argument('--data','-i', type=str, help='Training CSV i.e. full_2019_2grid.csv')
+    parser.add_argument('--output','-o', nargs='?', default='forecaster.npz', type=str, help='Path to write coefficients to')
+    parser.add_argument('--alpha','-a', nargs='?', default=1.0, type=float, help='Ridge penalty')
+    parser.add_argument('--labels','-l', nargs='+', default=LABELS, type=str, help='Target columns i.e. y_30 y_60')
+    args = parser.parse_args()
+
+    grid_nums = np.unique(pd.read_csv(args.data,usecols=['grid_num'])['grid_num'])
+    Forecaster(grid_nums,labels=args.labels,alpha=args.alpha).fit(args.data).save(args.output)
+    print(f"Coefficients written to {args.output}")
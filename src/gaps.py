@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+
+from src import archive
+from src import alignment
+
+# Storage prefix and sink table of every stream
+STREAMS = {
+    'taxi':('taxis','taxi-availability'),
+    'rainfall':('rainfall','rainfall-items'),
+    'air-temperature':('air-temperature','air-temperature-items'),
+    'relative-humidity':('relative-humidity','relative-humidity-items')
+}
+# Repaired snapshots are stored under this prefix, which the parser functions skip, as they are loaded by repair_gaps.py
+REPAIR_PREFIX = 'repair'
+
+
+def get_storage_snapshots(fs,bucket:str,stream:str,start,end)->pd.DataFrame:
+    '''Objects of a stream in storage between start and end
+    Args:
+        fs:         gcsfs.GCSFileSystem object, or any fsspec filesystem
+        bucket:     i.e. ml-eng-cs611-group-project-taxis
+        stream:     taxi, rainfall, air-temperature or relative-humidity
+    Returns:
+        pandas DataFrame of the snapshots of the collectors and of earlier repairs, of the schema:
+            - snapshot_timestamp:   Timestamp in the object name
+            - filename
+    '''
+    prefix = STREAMS[stream][0]
+    # Only list the days of the range instead of the whole prefix
+    filenames = [name for date in pd.date_range(pd.Timestamp(start).normalize(),end,freq='D')
+                 for root in [[bucket],[bucket,REPAIR_PREFIX]]
+                 for name in fs.glob('/'.join(root+[prefix,f"{date:%Y-%m-%d}*"]))]
+    df = pd.DataFrame({'filename':filenames})
+    df['snapshot_timestamp'] = pd.to_datetime([archive.get_timestamp(name) for name in filenames])
+    return df.sort_values('snapshot_timestamp',kind='stable')
+
+
+def query_sink_timestamps(stream:str,start,end,project_id:str='ml-eng-cs611-group-project',dataset_id:str='taxi_dataset_reference')->pd.Series:
+    '''Distinct timestamps of a stream already loaded to GBQ between start and end'''
+    sql = f"""
+    SELECT DISTINCT timestamp
+    FROM `{dataset_id}.{STREAMS[stream][1]}`
+    WHERE timestamp BETWEEN '{pd.Timestamp(start)}' AND '{pd.Timestamp(end)}'
+    """
+    return pd.read_gbq(sql, project_id=project_id)['timestamp']
+
+
+def plan(schedule:pd.DatetimeIndex,storage:pd.DataFrame,sink,tolerance:str='5min')->pd.DataFrame:
+    '''Work needed to complete one stream over the schedule
+    Args:
+        schedule:   Canonical timestamps i.e. from alignment.get_schedule
+        storage:    Objects in storage, see get_storage_snapshots
+        sink:       Timestamps already loaded, see query_sink_timestamps
+                    All three may be tz-aware, they are compared in naive Singapore time.
+        tolerance:  Largest distance between a canonical timestamp and a snapshot covering it
+    Returns:
+        pandas DataFrame with one row per canonical timestamp missing in storage or sink:
+            - timestamp
+            - fetch:    True if no object covers the timestamp, so it has to be fetched from the API
+            - load:     True if the sink does not cover the timestamp
+            - filename: Existing object to load from, None when it has to be fetched
+    '''
+    # read_gbq labels the stored wall-clock times of the sink as UTC, the object names are naive
+    storage = storage.assign(snapshot_timestamp=alignment.to_naive(storage['snapshot_timestamp']).astype('datetime64[ns]'))
+    schedule = alignment.to_naive(schedule).astype('datetime64[ns]')
+    sink = alignment.to_naive(sink).astype('datetime64[ns]')
+
+    stored = alignment.match_snapshots(storage['snapshot_timestamp'],schedule,tolerance)
+    loaded = alignment.match_snapshots(sink,schedule,tolerance)
+    schedule = stored['timestamp'].to_numpy()
+
+    # Slots covered anywhere are removed in one set difference per target
+    missing_storage = np.setdiff1d(schedule,stored.dropna()['timestamp'].to_numpy(),assume_unique=True)
+    missing_sink = np.setdiff1d(schedule,loaded.dropna()['timestamp'].to_numpy(),assume_unique=True)
+    missing = np.union1d(missing_storage,missing_sink)
+
+    filenames = storage.drop_duplicates('snapshot_timestamp').set_index('snapshot_timestamp')['filename']
+    stored = stored.set_index('timestamp').loc[missing,'snapshot_timestamp']
+    return pd.DataFrame({
+        'timestamp':missing,
+        'fetch':np.isin(missing,missing_storage),
+        'load':np.isin(missing,missing_sink),
+        'filename':[None if pd.isna(t) else filenames[t] for t in stored]
+    })
+
+
+def get_intervals(timestamps,freq:str='15min')->pd.DataFrame:
+    '''Collapse timestamps into runs of consecutive slots
+    Returns:
+        pandas DataFrame of the schema:
+            - start
+            - end
+            - slots
+    '''
+    timestamps = pd.DatetimeIndex(np.sort(np.asarray(timestamps,dtype='datetime64[ns]')))
+    run = np.cumsum(np.diff(timestamps.asi8,prepend=timestamps.asi8[:1])!=pd.Timedelta(freq).value)
+    df = pd.DataFrame({'timestamp':timestamps,'run':run})
+    return df.groupby('run')['timestamp'].agg(start='min',end='max',slots='count').reset_index(drop=True)
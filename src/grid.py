@@ -0,0 +1,22 @@
+import numpy as np
+
+# Geometry of the 22 x 13 grid in updated codes/filter_grids_2, numbered row by row from the north west corner
+LONGITUDE_ORIGIN = 103.6
+LATITUDE_ORIGIN = 1.208
+LONGITUDE_STEP = 0.020454545454545583
+LATITUDE_STEP = 0.020538461538461547
+N_COLUMNS = 22
+N_ROWS = 13
+
+
+def get_grid_num(longitude,latitude):
+    '''Vectorized mapping of coordinates to grid_num
+    Args:
+        longitude:  float or array of longitudes in degrees
+        latitude:   float or array of latitudes in degrees
+    Returns:
+        int array of grid_num, using the same arithmetic as get_grid_longitude + get_grid_latitude
+    '''
+    column = np.ceil((np.asarray(longitude)-LONGITUDE_ORIGIN)/LONGITUDE_STEP)
+    row = N_ROWS - np.ceil((np.asarray(latitude)-LATITUDE_ORIGIN)/LATITUDE_STEP)
+    return (column + row*N_COLUMNS).astype(int)
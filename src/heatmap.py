@@ -0,0 +1,177 @@
+import os
+import time
+import zlib
+import struct
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
+
+from src import grid
+from src import taxicodec
+
+GRID_FILE = './updated codes/filter_grids_2/filter_grids_2.shp'
+# Colour ramp from empty to busiest pixel, interpolated into a 256 entry lookup table
+RAMP = np.array([[0,0,4],[40,11,84],[101,21,110],[159,42,99],[212,72,66],[245,125,21],[250,193,39],[252,255,164]])
+BACKGROUND = np.array([24,24,24],dtype=np.uint8) # Pixels outside the filtered grids
+
+
+def get_lut(ramp:np.ndarray=RAMP)->np.ndarray:
+    '''256 x 3 uint8 lookup table interpolated from the anchors of ramp'''
+    anchors = np.linspace(0,255,len(ramp))
+    return np.stack([np.interp(np.arange(256),anchors,ramp[:,c]) for c in range(3)],axis=1).astype(np.uint8)
+
+
+class Raster():
+    '''Fixed-size density image georeferenced once against the grid shapefile
+    Args:
+        extent:     (min longitude, min latitude, max longitude, max latitude) covered by the image
+        width:      Image width in pixels
+        height:     Image height in pixels
+        grid_nums:  If provided, grid_num of the filtered grids. Pixels outside them are drawn as background.
+    '''
+    def __init__(self,extent,width:int=440,height:int=260,grid_nums=None):
+        self.extent=tuple(float(v) for v in extent)
+        self.width=width
+        self.height=height
+        min_lon, min_lat, max_lon, max_lat = self.extent
+        self.lon_edges=np.linspace(min_lon,max_lon,width+1)
+        self.lat_edges=np.linspace(min_lat,max_lat,height+1)
+
+        # Row 0 is the northern edge, as the image is drawn
+        lon = (self.lon_edges[:-1]+self.lon_edges[1:])/2
+        lat = ((self.lat_edges[:-1]+self.lat_edges[1:])/2)[::-1]
+        lon, lat = np.meshgrid(lon,lat)
+        if grid_nums is None:
+            self.mask=np.ones((height,width),dtype=bool)
+        else:
+            self.mask=np.isin(grid.get_grid_num(lon,lat),np.asarray(grid_nums))
+
+    @classmethod
+    def from_gridfile(cls,gridfile:str=GRID_FILE,pixels_per_grid:int=20):
+        '''Image covering the grid shapefile, pixels_per_grid pixels along each side of a grid'''
+        import geopandas as gpd
+        grids = gpd.read_file(gridfile)
+        min_lon, min_lat, max_lon, max_lat = grids.total_bounds
+        width = int(round((max_lon-min_lon)/grid.LONGITUDE_STEP))*pixels_per_grid
+        height = int(round((max_lat-min_lat)/grid.LATITUDE_STEP))*pixels_per_grid
+        return cls((min_lon,min_lat,max_lon,max_lat),width,height,grids['grid_num'].to_numpy())
+
+    def density(self,longitude,latitude)->np.ndarray:
+        '''Taxi count per pixel as a float32 array of shape [height, width], north up'''
+        counts, _, _ = np.histogram2d(latitude,longitude,bins=(self.lat_edges,self.lon_edges))
+        return counts[::-1].astype(np.float32)
+
+    def colorize(self,density:np.ndarray,vmax:float,lut:np.ndarray=None)->np.ndarray:
+        '''RGB uint8 image of shape [height, width, 3] on a log scale up to vmax'''
+        lut = get_lut() if lut is None else lut
+        level = np.log1p(density)*(255/np.log1p(vmax))
+        rgb = lut[np.clip(level,0,255).astype(np.uint8)]
+        rgb[~self.mask] = BACKGROUND
+        return rgb
+
+
+def write_png(path:str,rgb:np.ndarray):
+    '''Write an RGB uint8 array as an 8-bit PNG'''
+    def chunk(kind,data):
+        return struct.pack('>I',len(data))+kind+data+struct.pack('>I',zlib.crc32(kind+data))
+
+    height, width, _ = rgb.shape
+    # Filter type 0 in front of every row
+    rows = np.concatenate([np.zeros((height,1),dtype=np.uint8),rgb.reshape(height,-1)],axis=1)
+    with open(path,'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR',struct.pack('>IIBBBBB',width,height,8,2,0,0,0)))
+        f.write(chunk(b'IDAT',zlib.compress(rows.tobytes(),1)))
+        f.write(chunk(b'IEND',b''))
+
+
+def iter_source(path:str):
+    '''Yields (timestamp, longitude, latitude) of every snapshot in a file of taxicodec blocks
+    (taxi_load.py --compact) or a daily taxi archive (compact.py)'''
+    from src import archive
+    from src import jsonParser
+    with open(path,'rb') as f:
+        magic = f.read(4)
+    if magic==taxicodec.MAGIC:
+        with open(path,'rb') as f:
+            yield from taxicodec.iter_snapshots(f.read())
+    else:
+        parser = jsonParser.jsonParser()
+        for name, data in archive.SnapshotArchive(path):
+            df = parser.load_taxi_data(name,data)
+            yield df['timestamp'].iloc[0], df['longitude'].to_numpy(), df['latitude'].to_numpy()
+
+
+# Raster is built once per worker process rather than shipped with every task
+_raster = None
+
+def init_worker(raster:Raster):
+    global _raster
+    _raster = raster
+
+
+def render_file(path:str,output:str,vmax:float,save_density:bool=False)->int:
+    '''Render every snapshot of one source file to <output>/<timestamp>.png
+    Args:
+        save_density:   If True, also write the stacked densities and timestamps of the file to
+                        <output>/<file name>.npz for dashboards
+    Returns:
+        Number of frames written
+    '''
+    lut = get_lut()
+    frames, densities, timestamps = 0, [], []
+    for timestamp, longitude, latitude in iter_source(path):
+        density = _raster.density(longitude,latitude)
+        write_png(os.path.join(output,f"{pd.Timestamp(timestamp):%Y-%m-%dT%H-%M-%S}.png"),_raster.colorize(density,vmax,lut))
+        frames += 1
+        if save_density:
+            densities.append(density)
+            timestamps.append(pd.Timestamp(timestamp).value)
+    if densities:
+        np.savez_compressed(os.path.join(output,os.path.basename(path).split('.')[0]+'.npz'),
+                            density=np.stack(densities),timestamp=np.array(timestamps),extent=np.array(_raster.extent))
+    return frames
+
+
+def render(paths:list,output:str,raster:Raster=None,vmax:float=30,workers:int=None,save_density:bool=False)->int:
+    '''Render frames of many source files, one file per process
+    Args:
+        paths:      Files of taxicodec blocks or daily taxi archives
+        output:     Directory to write frames to
+        raster:     Defaults to Raster.from_gridfile()
+        vmax:       Taxis per pixel drawn at full intensity. Fixed across frames so they can be compared.
+        workers:    Size of the process pool, defaults to the number of cores
+    Returns:
+        Number of frames written
+    '''
+    raster = Raster.from_gridfile() if raster is None else raster
+    os.makedirs(output,exist_ok=True)
+    start = time.monotonic()
+    frames = 0
+    with ProcessPoolExecutor(max_workers=workers,initializer=init_worker,initargs=(raster,)) as executor:
+        futures = [executor.submit(render_file,path,output,vmax,save_density) for path in paths]
+        for future in tqdm(as_completed(futures),total=len(futures),desc='Files rendered'):
+            frames += future.result()
+
+    elapsed = time.monotonic()-start
+    print(f"Rendered {frames} frame(s) of {raster.width}x{raster.height} in {elapsed:.1f}s ({frames/elapsed*60:.0f} frames/min)")
+    return frames
+
+
+if __name__=='__main__':
+    import argparse
+    import glob
+
+    parser = argparse.ArgumentParser(description='Renders taxi density heatmaps for every snapshot of taxicodec block files or daily taxi archives')
+    parser.add_argument('--input','-i', nargs='+', type=str, help='Source files or glob patterns')
+    parser.add_argument('--output','-o', nargs='?', default='./frames', type=str, help='Directory to write frames to')
+    parser.add_argument('--gridfile','-g', nargs='?', default=GRID_FILE, type=str, help='Path to gridfiles (static data)')
+    parser.add_argument('--pixels','-p', nargs='?', default=20, type=int, help='Pixels along each side of a grid')
+    parser.add_argument('--vmax','-v', nargs='?', default=30, type=float, help='Taxis per pixel drawn at full intensity')
+    parser.add_argument('--workers','-w', nargs='?', default=None, type=int, help='Number of worker processes. Defaults to the number of cores')
+    parser.add_argument('--density', action="store_true", help='If provided, also write the density arrays of every file as npz')
+    args = parser.parse_args()
+
+    paths = sorted(path for pattern in args.input for path in glob.glob(pattern))
+    render(paths,args.output,Raster.from_gridfile(args.gridfile,args.pixels),args.vmax,args.workers,args.density)
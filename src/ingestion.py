@@ -0,0 +1,196 @@
+import os
+import time
+import pandas as pd
+
+from src import jsonParser
+from src import grid
+from src import stationmeta
+
+MEASURES = ['rainfall','air-temperature','relative-humidity']
+TAXI_TABLES = ['taxi-availability','assignment-taxi']
+
+
+class GbqSink():
+    '''Appends frames to BigQuery tables through a single reused client
+    Args:
+        project:    GCP project name i.e. ml-eng-cs611-group-project
+        dataset_id: GBQ dataset ID i.e. taxi_dataset
+    '''
+    def __init__(self,project:str,dataset_id:str):
+        self.project=project
+        self.dataset_id=dataset_id
+        self.client=None
+
+    def write(self,table_id:str,df:pd.DataFrame):
+        from google.cloud import bigquery
+        if self.client is None:
+            self.client=bigquery.Client(project=self.project)
+        job_config = bigquery.LoadJobConfig(write_disposition='WRITE_APPEND')
+        destination = '.'.join([self.project,self.dataset_id,table_id])
+        self.client.load_table_from_dataframe(df,destination,job_config=job_config).result()
+
+
+class LocalSink():
+    '''Appends frames to one CSV per table, standing in for BigQuery when running locally
+    Args:
+        directory:  Directory to write <table_id>.csv files to
+    '''
+    def __init__(self,directory:str):
+        self.directory=directory
+        os.makedirs(directory,exist_ok=True)
+
+    def write(self,table_id:str,df:pd.DataFrame):
+        path = os.path.join(self.directory,table_id+'.csv')
+        df.to_csv(path,mode='a',header=not os.path.exists(path),index=False)
+
+
+def assign_taxi_counts(taxi_df:pd.DataFrame)->pd.DataFrame:
+    '''Count taxis per grid for every timestamp in taxi_df
+    Returns:
+        pandas DataFrame of the same schema as the assignment-taxi table:
+            - timestamp
+            - grid_num
+            - taxi_count
+    '''
+    counts = taxi_df.groupby(['timestamp',grid.get_grid_num(taxi_df['longitude'],taxi_df['latitude'])]).size()
+    counts.index.names = ['timestamp','grid_num']
+    df = counts.rename('taxi_count').reset_index()
+    df['taxi_count'] = df['taxi_count'].astype(float)
+    return df
+
+
+class IngestionWorker():
+    '''Buffers snapshot events and writes each target table with a single append per flush
+    Args:
+        sink:       GbqSink or LocalSink
+        fs:         gcsfs.GCSFileSystem object, if snapshot paths are Google Cloud URLs
+        max_rows:   Flush once this many rows are buffered across all tables
+        max_wait:   Flush once the oldest buffered event is this many seconds old
+        trackers:   Dictionary of measure to stationmeta.StationTracker holding the stored station state.
+                    Measures without one start from an empty state.
+    '''
+    def __init__(self,sink,fs=None,max_rows:int=200000,max_wait:float=30,trackers:dict=None):
+        self.sink=sink
+        self.trackers={} if trackers is None else trackers
+        self.parser=jsonParser.jsonParser(fs)
+        self.max_rows=max_rows
+        self.max_wait=max_wait
+        self.events=[]
+        self.rows=0
+        self.first_event=None
+
+    def parse(self,path:str)->dict:
+        '''Parse one snapshot into a dictionary of table_id to DataFrame'''
+        measure = os.path.basename(os.path.dirname(path))
+        if measure=='taxis':
+            taxi_data = self.parser.load_taxi_data(path)
+            return {'taxi-availability':taxi_data,'assignment-taxi':assign_taxi_counts(taxi_data)}
+        elif measure in MEASURES:
+            metadata = self.parser.get_metadata(path,measure)
+            # Full snapshots are still read by the views i.e. all-item-join-live, until they move to <measure>-stations
+            tables = {measure+'-items':self.parser.get_items(path,measure),measure+'-metadata':metadata}
+            # Station changes are only written when they happen
+            tracker = self.trackers.setdefault(measure,stationmeta.StationTracker())
+            changes = tracker.update(metadata)
+            if len(changes):
+                tables[measure+'-stations'] = changes
+            return tables
+        else:
+            raise ValueError(f"Cannot determine stream of {path}")
+
+    def submit(self,path:str):
+        '''Buffer a new snapshot, flushing if a threshold is reached'''
+        try:
+            tables = self.parse(path)
+        except Exception as e:
+            print(f"Skipping {path}: {e}")
+            return
+        if self.first_event is None:
+            self.first_event=time.monotonic()
+        self.events.append(tables)
+        self.rows+=sum(len(df) for df in tables.values())
+        if self.rows>=self.max_rows:
+            self.flush()
+
+    def poll(self):
+        '''Flush if the oldest buffered event has waited long enough'''
+        if self.first_event is not None and time.monotonic()-self.first_event>=self.max_wait:
+            self.flush()
+
+    def flush(self):
+        if not self.events:
+            return
+        tables = {}
+        for i, event in enumerate(self.events):
+            for table_id, df in event.items():
+                tables.setdefault(table_id,[]).append(df.assign(_event=i) if table_id in TAXI_TABLES else df)
+
+        start = time.monotonic()
+        for table_id, dfs in tables.items():
+            df = pd.concat(dfs,ignore_index=True)
+            if table_id in TAXI_TABLES:
+                # Snapshots truncated to the same minute land on the same timestamp, keep only the latest of them
+                df = df[df['_event']==df.groupby('timestamp')['_event'].transform('max')].drop(columns='_event')
+            self.sink.write(table_id,df)
+            # Written tables are dropped from the buffer at once, so a retry after a failed flush does not append them again
+            for event in self.events:
+                event.pop(table_id,None)
+            self.rows = sum(len(df) for event in self.events for df in event.values())
+        # Station changes are only part of the stored state once every table is written, a failed flush keeps them pending
+        for tracker in self.trackers.values():
+            tracker.commit()
+        print(f"Flushed {len(self.events)} snapshot(s), {sum(len(df) for dfs in tables.values() for df in dfs)} rows to {len(tables)} table(s) in {time.monotonic()-start:.2f}s")
+
+        self.events=[]
+        self.rows=0
+        self.first_event=None
+
+
+class DirectoryWatcher():
+    '''Polls a local directory laid out like the buckets (taxis/<ts>.json, <measure>/<ts>.json)
+    and reports newly created snapshots, standing in for the bucket finalize trigger.
+    Args:
+        root:       Directory to watch
+        existing:   If True, files already present are reported once their size is stable
+    Comments:
+        A new file is only reported once its size is the same on two consecutive polls, so
+        files that are still being written are not read half way.
+    '''
+    def __init__(self,root:str,existing:bool=False):
+        self.root=root
+        self.seen=set() if existing else set(self.list_files())
+        self.pending={}
+
+    def list_files(self):
+        for directory, _, files in os.walk(self.root):
+            for file in files:
+                if file.endswith('.json'):
+                    yield os.path.join(directory,file)
+
+    def poll(self)->list:
+        ready, pending = [], {}
+        for path in set(self.list_files())-self.seen:
+            try:
+                size = os.path.getsize(path)
+            except FileNotFoundError:
+                continue
+            if size>0 and self.pending.get(path)==size:
+                ready.append(path)
+            else:
+                pending[path] = size
+        self.pending = pending
+        self.seen.update(ready)
+        return sorted(ready)
+
+
+def run(worker:IngestionWorker,watcher:DirectoryWatcher,interval:float=1):
+    '''Feed new files from watcher to worker until interrupted'''
+    print(f"Watching {watcher.root}")
+    try:
+        while True:
+            for path in watcher.poll():
+                worker.submit(path)
+            worker.poll()
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        worker.flush()
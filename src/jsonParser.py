@@ -1,26 +1,70 @@
-import json
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 from shapely import wkt
 import re
 from datetime import datetime
 
+from src.compression import decompress, loads
+
+def compact_frame(df:pd.DataFrame)->pd.DataFrame:
+    '''Memory-lean dtypes: categorical strings, float32 values and coordinates'''
+    for column in df.columns:
+        if column=='timestamp':
+            continue
+        elif pd.api.types.is_float_dtype(df[column]):
+            df[column] = df[column].astype(np.float32)
+        elif pd.api.types.is_object_dtype(df[column]) or pd.api.types.is_string_dtype(df[column]):
+            df[column] = df[column].astype('category')
+    return df
+
 class jsonParser():
-    def __init__(self,fs=None):
+    def __init__(self,fs=None,compact:bool=False):
         '''
         Args:
             fs: gcsfs.GCSFileSystem object
+            compact: If True, parsed frames use memory-lean dtypes, see compact_frame
         Comments:
             If fs is present, uses gcsfs context to open file.
             Otherwise, a local filesystem context is used.
         '''
         self.fs=fs
+        self.compact=compact
+
+    def read_json(self,path:str):
+        '''Read a snapshot from GCS or the local filesystem, compressed or not'''
+        if self.fs!=None:
+            with self.fs.open(path,'rb') as f:
+                return loads(f.read())
+        else:
+            with open(path,'rb') as f:
+                return loads(f.read())
+
+    def iter_archive(self,path:str):
+        '''Iterate a daily snapshot archive written by compact.py in one sequential read
+        Args:
+            path: Path to archive. Accepts Google Cloud URL if initialized with GCSFileSystem.
+        Yields:
+            (name, data) where name is the original object name and data the decoded JSON,
+            to be passed on to get_items, get_metadata or load_taxi_data
+        '''
+        from src import archive
+        return iter(archive.SnapshotArchive(path,self.fs))
+
+    def read_archive(self,path:str,timestamp):
+        '''Seek straight to the latest snapshot at or before timestamp in a daily archive
+        Returns:
+            (name, data) as in iter_archive
+        '''
+        from src import archive
+        return archive.SnapshotArchive(path,self.fs).read(timestamp)
 
-    def get_items(self,path:str,kind:str):
+    def get_items(self,path:str,kind:str,data:dict=None):
         '''Parse items key from NEA JSON
         Args:
             path: Path to file. Accepts Google Cloud URL if initialized with GCSFileSystem.
             kind: Display for description i.e. 'Relative Humidity'
+            data: If provided, already decoded JSON i.e. from iter_archive. path is then only used for the timestamp.
             
         Returns:
             pandas DataFrame object of the following schema:
@@ -29,12 +73,8 @@ class jsonParser():
                 - value
                 - Description
         '''
-        if self.fs!=None:
-            with self.fs.open(path) as f:
-                data = json.load(f)
-        else:
-            with open(path,'r') as f:
-                data = json.load(f)
+        if data is None:
+            data = self.read_json(path)
         
         pattern = r"\d\d\d\d-\d\d-\d\dT\d\d-\d\d-\d\d"
         re_timestamp = re.compile(pattern)
@@ -43,24 +83,26 @@ class jsonParser():
         timestamp = re_timestamp.findall(path)[0]
         timestamp = datetime.strptime(timestamp[:16], '%Y-%m-%dT%H-%M')
 
+        # Scalars are broadcast to every reading
         df = pd.DataFrame({
-            'timestamp':[timestamp for i in range(len(items['readings']))],
-            'station_id':[[(k,v) for k,v in obj.items()][0][1] for obj in items['readings']],
-            'value':[[(k,v) for k,v in obj.items()][1][1] for obj in items['readings']],
-            'Description':[kind for i in range(len(items['readings']))]})
+            'timestamp':pd.Timestamp(timestamp),
+            'station_id':[list(obj.values())[0] for obj in items['readings']],
+            'value':[list(obj.values())[1] for obj in items['readings']],
+            'Description':kind})
         
         df['value']=df['value'].astype('float')
         # df['timestamp']=pd.to_datetime(df['timestamp']).dt.tz_localize(None)
         df['timestamp']=pd.to_datetime(df['timestamp'])
 
-        return df
+        return compact_frame(df) if self.compact else df
 
 
-    def get_metadata(self,path:str,kind:str):
+    def get_metadata(self,path:str,kind:str,data:dict=None):
         '''Parse metadata key from NEA JSON
         Args:
             path: Path to file. Accepts Google Cloud URL if initialized with GCSFileSystem.
             kind: Display for description
+            data: If provided, already decoded JSON i.e. from iter_archive. path is then only used for the timestamp.
 
         Returns:
             pandas DataFrame object of the following schema:
@@ -74,19 +116,14 @@ class jsonParser():
                 - Description                
         '''
 
-        if self.fs!=None:
-            with self.fs.open(path) as f:
-                data = json.load(f)
-        else:
-            with open(path,'r') as f:
-                data = json.load(f)
+        if data is None:
+            data = self.read_json(path)
         
         metadata = data['metadata']
         pattern = r"\d\d\d\d-\d\d-\d\dT\d\d-\d\d-\d\d"
         re_timestamp = re.compile(pattern)
         timestamp = re_timestamp.findall(path)[0]
         timestamp = datetime.strptime(timestamp[:16], '%Y-%m-%dT%H-%M')
-        timestamp = [timestamp for i in range(len(metadata['stations']))]
         
         # timestamp = [data['items'][0]['timestamp'] for i in range(len(metadata['stations']))]
         location = [station['location'] for station in metadata['stations']]
@@ -97,27 +134,29 @@ class jsonParser():
         reading_type = metadata['reading_type']
         reading_unit = metadata['reading_unit']
         
+        # Scalars are broadcast to every station
         df = pd.DataFrame(
             {
-                'timestamp':timestamp,            
+                'timestamp':pd.Timestamp(timestamp),
                 'name':name,
                 'latitude':latitude,
                 'longitude':longitude,
                 'station':station,
-                'reading_type':[reading_type for i in range(len(metadata['stations']))],
-                'reading_unit':[reading_unit for i in range(len(metadata['stations']))],
-                'Description':[kind for i in range(len(metadata['stations']))]
+                'reading_type':reading_type,
+                'reading_unit':reading_unit,
+                'Description':kind
             }
         )        
         # df['timestamp'] = pd.to_datetime(df['timestamp']).dt.tz_localize(None)
         df['timestamp'] = pd.to_datetime(df['timestamp'])
 
-        return df
+        return compact_frame(df) if self.compact else df
 
-    def load_taxi_data(self,path):
+    def load_taxi_data(self,path,data:dict=None):
         '''Parse taxi coordinates from JSON
         Args:
             path: Path to file. Accepts Google Cloud URL if initialized with GCSFileSystem.
+            data: If provided, already decoded JSON i.e. from iter_archive. path is then only used for the timestamp.
             
         Returns:
             pandas DataFrame object of the following schema:
@@ -126,28 +165,19 @@ class jsonParser():
                 - latitude
                 
         '''
-        if self.fs!=None:
-            with self.fs.open(path) as f:
-                lta_data=json.load(f)
-
-        else:
-            with open(path,'r') as f:
-                lta_data=json.load(f)
+        lta_data = self.read_json(path) if data is None else data
         
         features = lta_data['features'][0]
-        coordinates = features['geometry']['coordinates']
-        longitude = [i[0] for i in coordinates]
-        latitude = [i[1] for i in coordinates]
+        coordinates = np.array(features['geometry']['coordinates'],dtype=float).reshape(-1,2)
         
         pattern = r"\d\d\d\d-\d\d-\d\dT\d\d-\d\d-\d\d"
         re_timestamp = re.compile(pattern)
         timestamp = re_timestamp.findall(path)[0]
         timestamp = datetime.strptime(timestamp[:16], '%Y-%m-%dT%H-%M')
-        timestamp = [timestamp for i in range(len(coordinates))]
-        df = pd.DataFrame({'timestamp':timestamp,'longitude':longitude,'latitude':latitude})
+        df = pd.DataFrame({'timestamp':pd.Timestamp(timestamp),'longitude':coordinates[:,0],'latitude':coordinates[:,1]})
         df['timestamp'] = pd.to_datetime(df['timestamp'])
         df['timestamp'] = df['timestamp'].dt.tz_localize(None)
-        return df
+        return compact_frame(df) if self.compact else df
     
     def load_taxi_gdf(self,path):
         '''Parse taxi coordinates from JSON
@@ -160,13 +190,7 @@ class jsonParser():
                 - timestamp
                 - geometry
         '''
-        if self.fs!=None:
-            with self.fs.open(path) as f:
-                lta_data=json.load(f)
-
-        else:
-            with open(path,'r') as f:
-                lta_data=json.load(f)
+        lta_data = self.read_json(path)
                 
         timestamp = lta_data['features'][0]['properties']['timestamp']
         taxi_list = lta_data['features'][0]['geometry']['coordinates']
@@ -0,0 +1,101 @@
+import numpy as np
+
+GRID_FILE = './updated codes/filter_grids_2/filter_grids_2.shp'
+METRES_PER_DEGREE = 111320 # Along a meridian, and along the equator which Singapore is close enough to
+
+
+def get_bounds(gridfile:str=GRID_FILE):
+    '''grid_num and (min longitude, min latitude, max longitude, max latitude) of every grid, sorted by grid_num'''
+    import geopandas as gpd
+    grids = gpd.read_file(gridfile)
+    grid_nums = grids['grid_num'].to_numpy().astype(int)
+    order = np.argsort(grid_nums)
+    return grid_nums[order], grids.geometry.bounds.to_numpy()[order]
+
+
+def box_distance(longitude,latitude,bounds:np.ndarray)->np.ndarray:
+    '''Metres from a point to the nearest edge of every box, 0 inside'''
+    dx = np.maximum(bounds[:,0]-longitude,0)+np.maximum(longitude-bounds[:,2],0)
+    dy = np.maximum(bounds[:,1]-latitude,0)+np.maximum(latitude-bounds[:,3],0)
+    return np.hypot(dx,dy)*METRES_PER_DEGREE
+
+
+def build(grid_nums:np.ndarray,bounds:np.ndarray,radius:float=1000)->dict:
+    '''CSR adjacency of grids within radius of each other
+    Args:
+        grid_nums:  Sorted grid_num
+        bounds:     Box of every grid
+        radius:     Walking distance in metres. Grids whose boxes are within radius of a grid's box
+                    are its neighbours, a superset of the grids within radius of any point in it.
+    Returns:
+        Dictionary of arrays to save with np.savez:
+            - grid_nums
+            - bounds
+            - indptr:       Neighbours of grid i are indices[indptr[i]:indptr[i+1]]
+            - indices:      Positions in grid_nums, nearest first
+            - radius
+    '''
+    # Gap between boxes along each axis, 0 when they overlap
+    dx = np.maximum(bounds[None,:,0]-bounds[:,None,2],0)+np.maximum(bounds[:,None,0]-bounds[None,:,2],0)
+    dy = np.maximum(bounds[None,:,1]-bounds[:,None,3],0)+np.maximum(bounds[:,None,1]-bounds[None,:,3],0)
+    distance = np.hypot(dx,dy)*METRES_PER_DEGREE
+    # Centroid distance breaks ties between touching boxes
+    centroid = (bounds[:,:2]+bounds[:,2:])/2
+    order_key = np.hypot(*(centroid[None,:,:]-centroid[:,None,:]).transpose(2,0,1))
+
+    adjacent = (distance<=radius) & ~np.eye(len(grid_nums),dtype=bool)
+    indices, counts = [], []
+    for i in range(len(grid_nums)):
+        neighbours = np.flatnonzero(adjacent[i])
+        indices.append(neighbours[np.argsort(order_key[i,neighbours],kind='stable')])
+        counts.append(len(neighbours))
+    indptr = np.concatenate([[0],np.cumsum(counts)])
+    print(f"Built adjacency of {len(grid_nums)} grids within {radius}m: {indptr[-1]} edges, "
+          f"{indptr[-1]/max(len(grid_nums),1):.1f} neighbours per grid")
+    return {'grid_nums':grid_nums,'bounds':bounds,'indptr':indptr,'indices':np.concatenate(indices).astype(np.int32),
+            'radius':np.float64(radius)}
+
+
+class Neighbours():
+    '''Nearby grids of a point, read from a precomputed adjacency
+    Args:
+        path:   npz written by build
+    '''
+    def __init__(self,path:str):
+        with np.load(path) as f:
+            self.grid_nums=f['grid_nums']
+            self.bounds=f['bounds']
+            self.indptr=f['indptr']
+            self.indices=f['indices']
+            self.radius=float(f['radius'])
+
+    def get(self,grid_num:int,longitude:float,latitude:float,radius:float=None):
+        '''Neighbouring grids within radius of a point in grid_num
+        Returns:
+            grid_nums:  Nearest first
+            distances:  Metres from the point to the nearest edge of each grid
+        '''
+        radius = self.radius if radius is None else min(radius,self.radius)
+        i = np.searchsorted(self.grid_nums,grid_num)
+        if i==len(self.grid_nums) or self.grid_nums[i]!=grid_num:
+            return np.array([],dtype=int), np.array([])
+        candidates = self.indices[self.indptr[i]:self.indptr[i+1]]
+        distances = box_distance(longitude,latitude,self.bounds[candidates])
+        # The adjacency is ordered from the centre of grid_num, not from the point
+        order = np.argsort(distances,kind='stable')
+        order = order[distances[order]<=radius]
+        return self.grid_nums[candidates[order]], distances[order]
+
+
+if __name__=='__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Precomputes the adjacency of grids within walking distance for nearby grid recommendations')
+    parser.add_argument('--gridfile','-g', nargs='?', default=GRID_FILE, type=str, help='Path to gridfiles (static data)')
+    parser.add_argument('--radius','-r', nargs='?', default=1000, type=float, help='Walking distance in metres')
+    parser.add_argument('--output','-o', nargs='?', default='./cloud_functions/neighbours.npz', type=str, help='Path to write the adjacency to')
+    args = parser.parse_args()
+
+    grid_nums, bounds = get_bounds(args.gridfile)
+    np.savez(args.output,**build(grid_nums,bounds,args.radius))
+    print(f"Adjacency written to {args.output}")
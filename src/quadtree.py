@@ -0,0 +1,167 @@
+import os
+import numpy as np
+import pandas as pd
+
+from src import grid
+
+GRID_FILE = './updated codes/filter_grids_2/filter_grids_2.shp'
+# Square covering the 22 x 13 grid from its south west corner, so every leaf is square
+SIDE = max(grid.N_COLUMNS*grid.LONGITUDE_STEP,grid.N_ROWS*grid.LATITUDE_STEP)
+EXTENT = (grid.LONGITUDE_ORIGIN,grid.LATITUDE_ORIGIN,grid.LONGITUDE_ORIGIN+SIDE,grid.LATITUDE_ORIGIN+SIDE)
+
+
+class QuadTree():
+    '''Adaptive partition of the map, split where historical taxi density is high
+    Args:
+        max_depth:  Finest level. The finest cells are (extent side / 2**max_depth) wide.
+        extent:     (min longitude, min latitude, max longitude, max latitude) of the root, should be square
+    Comments:
+        Densities are accumulated on the finest level only. Coarser levels are summed bottom up
+        into a pyramid, then nodes are split top down while above the target occupancy. A lookup
+        table over the finest cells maps any point to its leaf with one index computation and
+        one gather.
+    '''
+    def __init__(self,max_depth:int=7,extent:tuple=EXTENT):
+        self.max_depth=max_depth
+        self.extent=tuple(float(v) for v in extent)
+        self.size=2**max_depth
+        self.density=np.zeros((self.size,self.size))
+        self.snapshots=0
+        self.leaves=None
+        self.table=None
+
+    def cell(self,longitude,latitude):
+        '''Finest level (row, column) of points, row 0 at the south. -1 for points outside the extent.'''
+        min_lon, min_lat, max_lon, max_lat = self.extent
+        column = np.floor((np.asarray(longitude)-min_lon)/(max_lon-min_lon)*self.size).astype(int)
+        row = np.floor((np.asarray(latitude)-min_lat)/(max_lat-min_lat)*self.size).astype(int)
+        outside = (column<0) | (column>=self.size) | (row<0) | (row>=self.size)
+        return np.where(outside,-1,row), np.where(outside,-1,column)
+
+    def add(self,longitude,latitude,snapshots:int=1):
+        '''Accumulate the taxis of one or more snapshots into the finest level density'''
+        row, column = self.cell(longitude,latitude)
+        inside = row>=0
+        self.density += np.bincount(row[inside]*self.size+column[inside],minlength=self.size**2).reshape(self.size,self.size)
+        self.snapshots += snapshots
+        return self
+
+    def pyramid(self)->list:
+        '''Mean taxis per snapshot at every level, from the root (1 x 1) to the finest level'''
+        levels = [self.density/max(self.snapshots,1)]
+        while len(levels[0])>1:
+            finer = levels[0]
+            n = len(finer)//2
+            levels.insert(0,finer.reshape(n,2,n,2).sum(axis=(1,3)))
+        return levels
+
+    def build(self,target:float=10,min_depth:int=2):
+        '''Split nodes until every leaf holds at most target taxis per snapshot on average
+        Args:
+            target:     Occupancy of a leaf, in mean taxis per snapshot
+            min_depth:  Nodes above this level are always split
+        '''
+        levels = self.pyramid()
+        leaves = []
+        nodes = [(0,0,0)]
+        while nodes:
+            depth, row, column = nodes.pop()
+            if depth<self.max_depth and (depth<min_depth or levels[depth][row,column]>target):
+                nodes += [(depth+1,2*row+dr,2*column+dc) for dr in (1,0) for dc in (1,0)]
+            else:
+                leaves.append((depth,row,column,levels[depth][row,column]))
+        self.leaves = pd.DataFrame(leaves,columns=['depth','row','column','occupancy']).sort_values(
+            ['depth','row','column'],ignore_index=True)
+        self.table = self.get_table()
+        print(f"Built {len(self.leaves)} leaves, depths {self.leaves['depth'].min()} to {self.leaves['depth'].max()}, "
+              f"max occupancy {self.leaves['occupancy'].max():.1f} per snapshot")
+        return self
+
+    def get_table(self)->np.ndarray:
+        '''Leaf index of every finest level cell'''
+        table = np.full((self.size,self.size),-1,dtype=np.int32)
+        for leaf in self.leaves.itertuples():
+            span = 2**(self.max_depth-leaf.depth)
+            table[leaf.row*span:(leaf.row+1)*span,leaf.column*span:(leaf.column+1)*span] = leaf.Index
+        return table
+
+    def lookup(self,longitude,latitude)->np.ndarray:
+        '''Vectorized leaf index of points, -1 for points outside the extent'''
+        row, column = self.cell(longitude,latitude)
+        return np.where(row>=0,self.table[row.clip(min=0),column.clip(min=0)],-1)
+
+    def count(self,longitude,latitude)->np.ndarray:
+        '''Taxis per leaf of one snapshot'''
+        leaf = self.lookup(longitude,latitude)
+        return np.bincount(leaf[leaf>=0],minlength=len(self.leaves))
+
+    def bounds(self)->np.ndarray:
+        '''(min longitude, min latitude, max longitude, max latitude) of every leaf'''
+        min_lon, min_lat, max_lon, max_lat = self.extent
+        width = (max_lon-min_lon)/2.0**self.leaves['depth'].to_numpy()
+        height = (max_lat-min_lat)/2.0**self.leaves['depth'].to_numpy()
+        west = min_lon+self.leaves['column'].to_numpy()*width
+        south = min_lat+self.leaves['row'].to_numpy()*height
+        return np.column_stack([west,south,west+width,south+height])
+
+    def to_gdf(self,gridfile:str=GRID_FILE):
+        '''Leaves overlapping the filtered grids, with the grid_num and intersect fields of filter_grids_2
+        so they can replace it in get_grid_data and the assignment scripts. The grid numbers are not
+        arithmetic, so taxis are only counted per leaf with the saved tree i.e. lookup, count or
+        --tree of taxi_assignment.py and backfill.py.'''
+        import shapely
+        import geopandas as gpd
+        boxes = shapely.box(*self.bounds().T)
+        land = gpd.read_file(gridfile).union_all()
+        keep = shapely.intersects(boxes,land)
+        gdf = gpd.GeoDataFrame({
+            'grid_num':np.flatnonzero(keep)+1, # Leaf index + 1, grid numbers start at 1
+            'intersect':np.ones(keep.sum(),dtype=np.int32),
+            'depth':self.leaves['depth'].to_numpy()[keep],
+            'occupancy':self.leaves['occupancy'].to_numpy()[keep]
+        },geometry=boxes[keep])
+        return gdf
+
+    def save(self,path:str):
+        np.savez(path,extent=np.array(self.extent),max_depth=self.max_depth,density=self.density,
+                 snapshots=self.snapshots,leaves=self.leaves[['depth','row','column']].to_numpy(),
+                 occupancy=self.leaves['occupancy'].to_numpy())
+
+    @classmethod
+    def load(cls,path:str):
+        with np.load(path) as f:
+            tree = cls(int(f['max_depth']),tuple(f['extent']))
+            tree.density = f['density']
+            tree.snapshots = int(f['snapshots'])
+            tree.leaves = pd.DataFrame(f['leaves'],columns=['depth','row','column'])
+            tree.leaves['occupancy'] = f['occupancy']
+        tree.table = tree.get_table()
+        return tree
+
+
+if __name__=='__main__':
+    import argparse
+    import glob
+    from src import heatmap
+
+    parser = argparse.ArgumentParser(description='Builds an adaptive quadtree grid from historical taxi density and exports it as a shapefile')
+    parser.add_argument('--input','-i', nargs='+', type=str, help='taxicodec block files or daily taxi archives, or glob patterns')
+    parser.add_argument('--output','-o', nargs='?', default='./quadtree_grids/quadtree_grids.shp', type=str, help='Shapefile to write the leaves to')
+    parser.add_argument('--target','-t', nargs='?', default=10, type=float, help='Mean taxis per snapshot at which a leaf is split')
+    parser.add_argument('--depth','-d', nargs='?', default=7, type=int, help='Deepest level of the tree')
+    parser.add_argument('--gridfile','-g', nargs='?', default=GRID_FILE, type=str, help='Path to gridfiles (static data), leaves outside them are dropped')
+    parser.add_argument('--tree', nargs='?', default='quadtree.npz', type=str, help='Path to save the tree for lookups')
+    args = parser.parse_args()
+
+    tree = QuadTree(args.depth)
+    for path in sorted(path for pattern in args.input for path in glob.glob(pattern)):
+        for timestamp, longitude, latitude in heatmap.iter_source(path):
+            tree.add(longitude,latitude)
+    print(f"Accumulated {tree.snapshots} snapshot(s)")
+    tree.build(args.target)
+    tree.save(args.tree)
+
+    gdf = tree.to_gdf(args.gridfile)
+    os.makedirs(os.path.dirname(args.output) or '.',exist_ok=True)
+    gdf.to_file(args.output)
+    print(f"Wrote {len(gdf)} leaves to {args.output}")
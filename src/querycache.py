@@ -0,0 +1,148 @@
+import os
+import re
+import json
+import uuid
+import hashlib
+import pandas as pd
+
+re_timestamp = re.compile(r"'(\d\d\d\d-\d\d-\d\d(?:[ T]\d\d:\d\d(?::\d\d)?)?)")
+
+
+def normalize(sql:str)->str:
+    '''Collapse whitespace so reformatted but identical queries share an entry'''
+    return ' '.join(sql.split())
+
+
+def get_key(sql:str,project_id:str,**params)->str:
+    '''sha256 of the normalized SQL, project and any other read_gbq parameters'''
+    payload = json.dumps({'sql':normalize(sql),'project_id':project_id,**params},sort_keys=True,default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class QueryCache():
+    '''Read-through cache of GBQ query results, stored as Parquet on local disk
+    Args:
+        root:           Directory of cached results, safe to share between processes
+        max_bytes:      Least recently read results are evicted once the cache is larger than this
+        live_window:    Queries whose latest timestamp literal is within this of now are never cached,
+                        as the live interval may still be loading. Queries without a timestamp
+                        literal read a whole table that can grow, so they are never cached either.
+    '''
+    def __init__(self,root:str='./.querycache',max_bytes:int=2*1024**3,live_window:str='1D'):
+        self.root=root
+        self.max_bytes=max_bytes
+        self.live_window=pd.Timedelta(live_window)
+        self.hits=0
+        self.misses=0
+        self.bypassed=0
+        os.makedirs(root,exist_ok=True)
+
+    def is_live(self,sql:str)->bool:
+        timestamps = re_timestamp.findall(sql)
+        if not timestamps:
+            return True
+        latest = max(pd.Timestamp(t.replace('T',' ')) for t in timestamps)
+        return latest>=pd.Timestamp.now()-self.live_window
+
+    def read_gbq(self,sql:str,project_id:str,**kwargs)->pd.DataFrame:
+        '''pd.read_gbq, answered from disk when the same query was run before'''
+        if self.is_live(sql):
+            self.bypassed += 1
+            return pd.read_gbq(sql,project_id=project_id,**kwargs)
+
+        path = os.path.join(self.root,get_key(sql,project_id,**kwargs)+'.parquet')
+        try:
+            df = pd.read_parquet(path)
+            os.utime(path) # Modification time is the last read for eviction
+            self.hits += 1
+            return df
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            # i.e. ArrowInvalid for a truncated or corrupt entry, which is rewritten below
+            print(f"Unreadable cache entry {path}, querying again: {e!r}")
+
+        self.misses += 1
+        df = pd.read_gbq(sql,project_id=project_id,**kwargs)
+        # Written under a unique name and renamed, so concurrent readers never see a partial file
+        tmp = f'{path}.{uuid.uuid4().hex}.tmp'
+        df.to_parquet(tmp,index=False)
+        os.replace(tmp,path)
+        self.evict()
+        return df
+
+    def entries(self)->pd.DataFrame:
+        '''path, size and mtime of every cached result'''
+        rows = []
+        for file in os.listdir(self.root):
+            if file.endswith('.parquet'):
+                path = os.path.join(self.root,file)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                rows.append((path,stat.st_size,stat.st_mtime))
+        return pd.DataFrame(rows,columns=['path','size','mtime'])
+
+    def evict(self)->int:
+        '''Remove least recently read results until the cache fits max_bytes
+        Returns:
+            Number of results removed
+        '''
+        df = self.entries().sort_values('mtime',ascending=False)
+        over = df[df['size'].cumsum()>self.max_bytes]
+        for path in over['path']:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return len(over)
+
+    def clear(self):
+        for path in self.entries()['path']:
+            os.remove(path)
+
+    def counters(self)->dict:
+        return {'hits':self.hits,'misses':self.misses,'bypassed':self.bypassed}
+
+    def add(self,counters:dict):
+        '''Add counters of another QueryCache on the same root, i.e. of a worker process'''
+        for key, value in counters.items():
+            setattr(self,key,getattr(self,key)+value)
+        return self
+
+    def stats(self)->dict:
+        entries = self.entries()
+        lookups = self.hits+self.misses
+        return {'hits':self.hits,'misses':self.misses,'bypassed':self.bypassed,
+                'hit_rate':self.hits/lookups if lookups else 0.,
+                'entries':len(entries),'bytes':int(entries['size'].sum())}
+
+    def report(self):
+        stats = self.stats()
+        print(f"Query cache: {stats['hits']} hit(s), {stats['misses']} miss(es), {stats['bypassed']} bypassed "
+              f"({stats['hit_rate']:.0%} hit rate), {stats['entries']} entries, {stats['bytes']/1024**2:.1f}MB in {self.root}")
+
+
+def read_gbq(sql:str,project_id:str,cache:QueryCache=None)->pd.DataFrame:
+    '''pd.read_gbq through cache if one is provided'''
+    if cache is None:
+        return pd.read_gbq(sql,project_id=project_id)
+    return cache.read_gbq(sql,project_id)
+
+
+if __name__=='__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Inspects or trims the local GBQ query-result cache')
+    parser.add_argument('--root','-r', nargs='?', default='./.querycache', type=str, help='Cache directory')
+    parser.add_argument('--max_bytes','-m', nargs='?', default=2*1024**3, type=int, help='Size to trim the cache to')
+    parser.add_argument('--clear', action="store_true", help='If provided, remove every cached result')
+    args = parser.parse_args()
+
+    cache = QueryCache(args.root,args.max_bytes)
+    if args.clear:
+        cache.clear()
+    else:
+        print(f"Evicted {cache.evict()} result(s)")
+    cache.report()
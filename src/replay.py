@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import bisect
+import random
+import threading
+import numpy as np
+import pandas as pd
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from src import grid
+from src.compression import decompress
+from src.archive import get_timestamp
+
+# Endpoint path of every stream, relative to the API base i.e. https://api.data.gov.sg/v1
+ENDPOINTS = {
+    'taxis':'transport/taxi-availability',
+    'rainfall':'environment/rainfall',
+    'air-temperature':'environment/air-temperature',
+    'relative-humidity':'environment/relative-humidity'
+}
+READINGS = {
+    'rainfall':('TB1 Rainfall 5 Minute Total F','mm',0.,1.5),
+    'air-temperature':('DBT 1M F','deg C',28.,2.),
+    'relative-humidity':('RH 1M F','percentage',80.,8.)
+}
+
+
+class SyntheticSource():
+    '''Deterministic API responses for any timestamp
+    Args:
+        taxis:      Number of taxis per snapshot
+        stations:   Number of weather stations
+        seed:       Responses depend only on seed and the requested timestamp
+    '''
+    def __init__(self,taxis:int=3000,stations:int=60,seed:int=0):
+        self.taxis=taxis
+        self.seed=seed
+        rng = np.random.default_rng(seed)
+        self.stations=[{'id':f'S{100+i}','device_id':f'S{100+i}','name':f'Station {i}',
+                        'location':{'latitude':float(lat),'longitude':float(lon)}}
+                       for i,(lon,lat) in enumerate(zip(rng.uniform(103.62,104.0,stations),rng.uniform(1.25,1.45,stations)))]
+
+    def get(self,stream:str,timestamp:pd.Timestamp)->bytes:
+        # Upstream publishes a new taxi snapshot every minute and weather readings every 5 minutes
+        timestamp = timestamp.floor('1min' if stream=='taxis' else '5min')
+        rng = np.random.default_rng([self.seed,timestamp.value//10**9])
+        iso = timestamp.strftime('%Y-%m-%dT%H:%M:%S+08:00')
+        if stream=='taxis':
+            longitude = rng.uniform(grid.LONGITUDE_ORIGIN+0.02,grid.LONGITUDE_ORIGIN+0.4,self.taxis).round(6)
+            latitude = rng.uniform(grid.LATITUDE_ORIGIN+0.04,grid.LATITUDE_ORIGIN+0.24,self.taxis).round(6)
+            data = {'type':'FeatureCollection','features':[{
+                'type':'Feature',
+                'geometry':{'type':'MultiPoint','coordinates':np.column_stack([longitude,latitude]).tolist()},
+                'properties':{'timestamp':iso,'taxi_count':self.taxis,'api_info':{'status':'healthy'}}}]}
+        else:
+            reading_type, reading_unit, mean, std = READINGS[stream]
+            values = np.maximum(rng.normal(mean,std,len(self.stations)),0).round(1)
+            data = {'metadata':{'stations':self.stations,'reading_type':reading_type,'reading_unit':reading_unit},
+                    'items':[{'timestamp':iso,'readings':[{'station_id':s['id'],'value':float(v)} for s,v in zip(self.stations,values)]}],
+                    'api_info':{'status':'healthy'}}
+        return json.dumps(data).encode()
+
+
+class RecordedSource():
+    '''Serves recorded snapshots, the latest at or before the requested timestamp
+    Args:
+        root:   Directory laid out like the buckets i.e. taxis/<ts>.json and <measure>/<ts>.json.
+                Compressed snapshots are served decompressed, as the API would.
+    '''
+    def __init__(self,root:str):
+        self.root=root
+        self.index={}
+        for stream in ENDPOINTS:
+            directory = os.path.join(root,stream)
+            files = sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+            entries = sorted((get_timestamp(file),os.path.join(directory,file)) for file in files if file.endswith('.json'))
+            self.index[stream] = ([t for t,_ in entries],[p for _,p in entries])
+        print("Recorded snapshots: "+', '.join(f'{s}[{len(t)}]' for s,(t,_) in self.index.items()))
+
+    def get(self,stream:str,timestamp:pd.Timestamp)->bytes:
+        timestamps, paths = self.index[stream]
+        i = bisect.bisect_right(timestamps,timestamp.to_pydatetime())-1
+        if i<0:
+            raise KeyError(f"No {stream} snapshot at or before {timestamp}")
+        with open(paths[i],'rb') as f:
+            return decompress(f.read())
+
+
+class ReplayServer():
+    '''Local stand-in for api.data.gov.sg, serving <base>/transport/taxi-availability and
+    <base>/environment/<measure> keyed by the date_time parameter
+    Args:
+        source:         SyntheticSource or RecordedSource
+        port:           0 picks a free port
+        latency:        Seconds added to every response
+        jitter:         Up to this many seconds of uniformly random extra latency
+        error_rate:     Fraction of requests answered with an error status
+        speedup:        Without date_time, responses are for a virtual clock starting at start and
+                        running speedup times faster than real time
+        start:          Start of the virtual clock, defaults to now
+    '''
+    def __init__(self,source,port:int=0,latency:float=0,jitter:float=0,error_rate:float=0,speedup:float=1,start=None):
+        self.source=source
+        self.latency=latency
+        self.jitter=jitter
+        self.error_rate=error_rate
+        self.speedup=speedup
+        self.start=pd.Timestamp.now().floor('s') if start is None else pd.Timestamp(start)
+        self.started=time.monotonic()
+        self.requests=0
+        self.errors=0
+        self.lock=threading.Lock()
+        self.routes={endpoint:stream for stream,endpoint in ENDPOINTS.items()}
+        self.httpd=ThreadingHTTPServer(('127.0.0.1',port),self.handler())
+        self.httpd.daemon_threads=True
+        self.thread=None
+
+    @property
+    def base_url(self)->str:
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/v1"
+
+    def now(self)->pd.Timestamp:
+        return self.start+pd.Timedelta(seconds=(time.monotonic()-self.started)*self.speedup)
+
+    def handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                stream = server.routes.get(url.path.replace('/v1/','',1).strip('/'))
+                with server.lock:
+                    server.requests += 1
+                time.sleep(server.latency+random.uniform(0,server.jitter))
+                if stream is None:
+                    return self.reply(404,b'{"message":"Not found"}')
+                if random.random()<server.error_rate:
+                    with server.lock:
+                        server.errors += 1
+                    return self.reply(random.choice([429,500,503]),b'{"message":"Injected error"}')
+
+                date_time = parse_qs(url.query).get('date_time')
+                timestamp = pd.Timestamp(date_time[0]).tz_localize(None) if date_time else server.now()
+                try:
+                    body = server.source.get(stream,timestamp)
+                except KeyError as e:
+                    return self.reply(404,json.dumps({'message':str(e)}).encode())
+                self.reply(200,body)
+
+            def reply(self,status:int,body:bytes):
+                self.send_response(status)
+                self.send_header('Content-Type','application/json')
+                self.send_header('Content-Length',str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self,format,*args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever,daemon=True)
+        self.thread.start()
+        print(f"Replay server listening on {self.base_url}")
+        return self
+
+    def __exit__(self,*exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
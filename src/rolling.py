@@ -0,0 +1,141 @@
+import numpy as np
+import pandas as pd
+
+FEATURES = ['taxi_count','rainfall','air_temperature','relative_humidity']
+
+
+class RollingFeatures():
+    '''Incrementally maintained lag and rolling window features for every grid
+    Args:
+        grid_nums:      List of grid_num to track
+        features:       Base features delivered with every interval
+        windows:        Rolling window lengths in intervals, i.e. (2,4) is 30 and 60 minutes at 15 minute intervals
+        lags:           Lags in intervals to expose for each of lag_features
+        lag_features:   Base features to expose lags for
+        freq:           Interval between updates
+    Comments:
+        The last few intervals are kept in a ring buffer of shape [slot, grid, feature].
+        Each update subtracts the values leaving every window from running sums and adds
+        the new values, so an update costs O(grids) regardless of window length.
+        Missing values (NaN) are excluded from sums and means.
+    '''
+    def __init__(self,grid_nums,features:list=FEATURES,windows:tuple=(2,4),lags:tuple=(1,2,3,4),
+                 lag_features:list=['taxi_count'],freq:str='15min'):
+        self.grid_nums=np.array(sorted(grid_nums),dtype=int)
+        self.grid_index={grid_num:i for i,grid_num in enumerate(self.grid_nums)}
+        self.features=list(features)
+        self.windows=tuple(windows)
+        self.lags=tuple(lags)
+        self.lag_index=[self.features.index(feature) for feature in lag_features]
+        self.lag_features=list(lag_features)
+        self.freq=pd.Timedelta(freq)
+
+        self.size=max(max(self.windows),max(self.lags)+1)
+        shape=(len(self.grid_nums),len(self.features))
+        self.buffer=np.full((self.size,)+shape,np.nan)
+        self.sums={w:np.zeros(shape) for w in self.windows}
+        self.counts={w:np.zeros(shape,dtype=int) for w in self.windows}
+        self.n=0 # Number of intervals pushed so far
+        self.timestamp=None
+
+        minutes=int(self.freq.total_seconds()//60)
+        self.names = list(self.features)
+        self.names += [f'{feature}_lag_{lag}' for feature in self.lag_features for lag in self.lags]
+        self.names += [f'{feature}_sum_{w*minutes}min' for w in self.windows for feature in self.features]
+        self.names += [f'{feature}_mean_{w*minutes}min' for w in self.windows for feature in self.features]
+
+    def _push(self,row:np.ndarray):
+        slot = self.n%self.size
+        present = ~np.isnan(row)
+        filled = np.where(present,row,0)
+        for w in self.windows:
+            if self.n>=w:
+                # Value leaving the window of length w
+                outgoing = self.buffer[(self.n-w)%self.size]
+                self.sums[w] -= np.nan_to_num(outgoing)
+                self.counts[w] -= ~np.isnan(outgoing)
+            self.sums[w] += filled
+            self.counts[w] += present
+        self.buffer[slot] = row
+        self.n += 1
+
+        if self.n%(1024*self.size)==0:
+            self._recompute()
+
+    def _recompute(self):
+        '''Rebuild running sums from the buffer to shed accumulated floating point error'''
+        for w in self.windows:
+            window = self.buffer[[(self.n-1-i)%self.size for i in range(min(w,self.n))]]
+            self.sums[w] = np.nansum(window,axis=0)
+            self.counts[w] = (~np.isnan(window)).sum(axis=0)
+
+    def update(self,timestamp,values):
+        '''Push the next interval
+        Args:
+            timestamp:  Timestamp of the interval. Skipped intervals are pushed as missing.
+            values:     Either a float array of shape [grid, feature] in grid_nums order, or a
+                        pandas DataFrame with a grid_num column and one column per feature
+        '''
+        timestamp = pd.Timestamp(timestamp)
+        if isinstance(values,pd.DataFrame):
+            row = np.full(self.buffer.shape[1:],np.nan)
+            idx = [self.grid_index[grid_num] for grid_num in values['grid_num'].astype(int)]
+            row[idx] = values[self.features].to_numpy(dtype=float)
+        else:
+            row = np.asarray(values,dtype=float)
+
+        if self.timestamp is not None:
+            if timestamp<=self.timestamp:
+                raise ValueError(f"{timestamp} is not after the last update {self.timestamp}")
+            gap = int((timestamp-self.timestamp)//self.freq)-1
+            for _ in range(min(gap,self.size)):
+                self._push(np.full(row.shape,np.nan))
+        self._push(row)
+        self.timestamp=timestamp
+
+    def lag(self,lag:int)->np.ndarray:
+        '''Values of all features lag intervals ago, of shape [grid, feature]'''
+        if lag>=min(self.n,self.size):
+            return np.full(self.buffer.shape[1:],np.nan)
+        return self.buffer[(self.n-1-lag)%self.size]
+
+    def vector(self,grid_num:int)->np.ndarray:
+        '''Current feature vector of one grid, in the order of self.names'''
+        i = self.grid_index[int(grid_num)]
+        current = self.lag(0)[i]
+        lagged = [self.lag(lag)[i,j] for j in self.lag_index for lag in self.lags]
+        sums = [self.sums[w][i] for w in self.windows]
+        with np.errstate(invalid='ignore',divide='ignore'):
+            means = [self.sums[w][i]/self.counts[w][i] for w in self.windows]
+        return np.concatenate([current,lagged]+sums+means)
+
+    def frame(self)->pd.DataFrame:
+        '''Current feature vectors of all grids'''
+        lagged = [self.lag(lag)[:,[j]] for j in self.lag_index for lag in self.lags]
+        sums = [self.sums[w] for w in self.windows]
+        with np.errstate(invalid='ignore',divide='ignore'):
+            means = [self.sums[w]/self.counts[w] for w in self.windows]
+        df = pd.DataFrame(np.concatenate([self.lag(0)]+lagged+sums+means,axis=1),columns=self.names)
+        df.insert(0,'grid_num',self.grid_nums)
+        df.insert(0,'timestamp',self.timestamp)
+        return df
+
+    def backfill(self,history:pd.DataFrame):
+        '''Rebuild state from a long format history table of the schema timestamp, grid_num, *features.
+        Only the most recent intervals that fit in the ring buffer are replayed.
+        '''
+        timestamps = np.sort(pd.to_datetime(history['timestamp']).unique())[-self.size:]
+        history = history[pd.to_datetime(history['timestamp']).isin(timestamps)]
+        for timestamp, df in history.groupby('timestamp',sort=True):
+            self.update(timestamp,df)
+        print(f"Backfilled {len(timestamps)} interval(s) up to {self.timestamp}")
+
+    def backfill_cube(self,cube,end=None):
+        '''Rebuild state from a cube.FeatureCube, replaying the intervals up to end'''
+        end = cube.end if end is None else pd.Timestamp(end)
+        start = max(end-(self.size-1)*self.freq,cube.start)
+        window = cube.window(start,end)
+        grid_idx = cube.grid_index(self.grid_nums)
+        feature_idx = [cube.features.index(feature) for feature in self.features]
+        for i in range(window.shape[0]):
+            self.update(start+i*self.freq,window[i][np.ix_(grid_idx,feature_idx)])
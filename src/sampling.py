@@ -0,0 +1,159 @@
+import glob
+import numpy as np
+import pandas as pd
+
+from src import grid
+
+STRATA = ['grid_num','hour','weekday']
+
+
+class ReservoirSampler():
+    '''Uniform or stratified sample without replacement of a stream of DataFrame chunks, in one pass
+    Args:
+        size:   Rows kept per stratum, or in total if by is empty
+        by:     Columns to stratify by, any of grid_num, hour and weekday (derived from timestamp)
+                or existing columns
+        seed:   Samples depend only on seed and the order of the rows
+    Comments:
+        Every row gets a uniform random key and the size rows with the smallest keys of each stratum
+        are kept, so memory is bounded by size per stratum plus one chunk. Keys are drawn from one
+        generator in row order, so the sample does not depend on how the stream is chunked.
+    '''
+    def __init__(self,size:int=1000,by:list=[],seed:int=0):
+        self.size=size
+        self.by=list(by)
+        self.seed=seed
+        self.rng=np.random.default_rng(seed)
+        self.reservoir=None
+        self.counts=pd.Series(dtype=np.int64)
+        self.rows=0
+
+    def strata(self,df:pd.DataFrame)->pd.DataFrame:
+        '''Add the derived stratum columns'''
+        if 'hour' in self.by and 'hour' not in df:
+            df['hour'] = pd.to_datetime(df['timestamp']).dt.hour
+        if 'weekday' in self.by and 'weekday' not in df:
+            df['weekday'] = pd.to_datetime(df['timestamp']).dt.weekday
+        return df
+
+    def update(self,df:pd.DataFrame):
+        df = self.strata(df.copy())
+        df['_key'] = self.rng.random(len(df))
+        self.rows += len(df)
+        if self.by:
+            counts = df.groupby(self.by).size()
+            self.counts = counts if self.counts.empty else self.counts.add(counts,fill_value=0).astype(np.int64)
+        else:
+            self.counts = pd.Series({'all':self.rows})
+
+        # Rows above the largest key of a full stratum can never enter it
+        if self.reservoir is not None:
+            if self.by:
+                keys = self.reservoir.groupby(self.by)['_key'].agg(['max','size'])
+                threshold = keys['max'].where(keys['size']>=self.size,1.0)
+                df = df[df['_key']<df.join(threshold.rename('_threshold'),on=self.by)['_threshold'].fillna(1.0)]
+            elif len(self.reservoir)>=self.size:
+                df = df[df['_key']<self.reservoir['_key'].max()]
+            df = pd.concat([self.reservoir,df],ignore_index=True)
+
+        df = df.sort_values('_key',kind='stable')
+        if self.by:
+            df = df[df.groupby(self.by).cumcount()<self.size]
+        else:
+            df = df.iloc[:self.size]
+        self.reservoir = df.reset_index(drop=True)
+        return self
+
+    def sample(self)->pd.DataFrame:
+        '''Sampled rows in key order, with the weight i.e. rows of the stratum in the stream per sampled row,
+        so estimates from a stratified sample can be reweighted to the population'''
+        if self.reservoir is None:
+            return pd.DataFrame()
+        df = self.reservoir.drop(columns='_key')
+        if self.by:
+            sampled = df.groupby(self.by).size()
+            weight = (self.counts/sampled).rename('weight')
+            df = df.join(weight,on=self.by)
+        else:
+            df['weight'] = self.rows/max(len(df),1)
+        return df
+
+
+def iter_archive(paths:list):
+    '''Yields one DataFrame of timestamp, longitude, latitude, grid_num per file of taxicodec blocks
+    or daily taxi archive, so a file is the unit of memory'''
+    from src import heatmap
+    for path in paths:
+        snapshots = list(heatmap.iter_source(path))
+        if not snapshots:
+            continue
+        longitude = np.concatenate([s[1] for s in snapshots])
+        latitude = np.concatenate([s[2] for s in snapshots])
+        yield pd.DataFrame({
+            'timestamp':np.repeat(pd.to_datetime([s[0] for s in snapshots]),[len(s[1]) for s in snapshots]),
+            'longitude':longitude,
+            'latitude':latitude,
+            'grid_num':grid.get_grid_num(longitude,latitude)
+        })
+
+
+def iter_csv(path:str,chunksize:int=500000):
+    '''Yields chunks of a CSV with a timestamp column i.e. full_2019_2grid.csv'''
+    for chunk in pd.read_csv(path,chunksize=chunksize,parse_dates=['timestamp']):
+        yield chunk
+
+
+def iter_warehouse(table_id:str,start,end,project_id:str='ml-eng-cs611-group-project',dataset_id:str='taxi_dataset_reference'):
+    '''Yields one day of a GBQ table at a time, so a year is never loaded at once'''
+    for date in pd.date_range(pd.Timestamp(start).normalize(),pd.Timestamp(end).normalize(),freq='D'):
+        sql = f"""
+        SELECT *
+        FROM `{dataset_id}.{table_id}`
+        WHERE timestamp >= '{date}' AND timestamp < '{date+pd.Timedelta(days=1)}'
+        ORDER BY timestamp
+        """
+        df = pd.read_gbq(sql, project_id=project_id)
+        print(f"{date:%Y-%m-%d}: {len(df)} rows")
+        if len(df):
+            yield df
+
+
+def sample(chunks,size:int=1000,by:list=[],seed:int=0)->pd.DataFrame:
+    '''Draw a sample from an iterable of chunks
+    Returns:
+        pandas DataFrame of the sampled rows with a weight column
+    '''
+    sampler = ReservoirSampler(size,by,seed)
+    for chunk in chunks:
+        sampler.update(chunk)
+    df = sampler.sample()
+    print(f"Sampled {len(df)} of {sampler.rows} rows"+(f" in {len(sampler.counts)} strata of {', '.join(by)}" if by else ''))
+    return df
+
+
+if __name__=='__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Draws reproducible uniform or stratified samples from the archive, a CSV or the warehouse in one pass')
+    parser.add_argument('--source','-s', nargs='?', default='archive', type=str, help='archive, csv or gbq')
+    parser.add_argument('--input','-i', nargs='+', type=str, help='Archive files or glob patterns, the CSV, or the GBQ table id')
+    parser.add_argument('--start', nargs='?', default=None, type=str, help='First date to sample, for --source gbq')
+    parser.add_argument('--end', nargs='?', default=None, type=str, help='Last date to sample, for --source gbq')
+    parser.add_argument('--size','-n', nargs='?', default=1000, type=int, help='Rows per stratum, or in total if not stratified')
+    parser.add_argument('--by','-b', nargs='*', default=[], type=str, help=f'Columns to stratify by i.e. {" ".join(STRATA)}')
+    parser.add_argument('--seed', nargs='?', default=0, type=int, help='Seed of the random keys')
+    parser.add_argument('--output','-o', nargs='?', default='sample.csv', type=str, help='Path to write the sample to')
+    parser.add_argument('--project', nargs='?', default='ml-eng-cs611-group-project', type=str, help='Name of GCP Project')
+    parser.add_argument('--dataset_id', nargs='?', default='taxi_dataset_reference', type=str, help='Name of GBQ dataset')
+    args = parser.parse_args()
+
+    if args.source=='archive':
+        chunks = iter_archive(sorted(path for pattern in args.input for path in glob.glob(pattern)))
+    elif args.source=='csv':
+        chunks = iter_csv(args.input[0])
+    else:
+        chunks = iter_warehouse(args.input[0],args.start,args.end,args.project,args.dataset_id)
+
+    df = sample(chunks,args.size,args.by,args.seed)
+    df.to_csv(args.output,index=False)
+    print(f"Sample written to {args.output}")
@@ -0,0 +1,181 @@
+import bisect
+import numpy as np
+import pandas as pd
+
+KEY = 'station'
+ATTRIBUTES = ['name','latitude','longitude','reading_type','reading_unit']
+COLUMNS = [KEY]+ATTRIBUTES+['Description','valid_from','active']
+
+
+def get_changes(state:pd.DataFrame,metadata:pd.DataFrame)->pd.DataFrame:
+    '''Change events of one metadata snapshot against the current state
+    Args:
+        state:      Active stations, one row per station with the ATTRIBUTES
+        metadata:   Snapshot of the schema returned by jsonParser.get_metadata
+    Returns:
+        pandas DataFrame of the <measure>-stations schema, with a row for every station that
+        appeared or changed (active True) or disappeared (active False) at the snapshot timestamp:
+            - station
+            - name
+            - latitude
+            - longitude
+            - reading_type
+            - reading_unit
+            - Description
+            - valid_from
+            - active
+    '''
+    timestamp = pd.Timestamp(metadata['timestamp'].iloc[0])
+    description = metadata['Description'].iloc[0]
+    merged = metadata[[KEY]+ATTRIBUTES].merge(state[[KEY]+ATTRIBUTES],on=KEY,how='outer',suffixes=('','_previous'),indicator=True)
+
+    unchanged = np.ones(len(merged),dtype=bool)
+    for c in ATTRIBUTES:
+        unchanged &= (merged[c]==merged[c+'_previous']).to_numpy()
+    added_or_changed = (merged['_merge']=='left_only') | ((merged['_merge']=='both') & ~unchanged)
+    removed = merged['_merge']=='right_only'
+
+    changes = merged[added_or_changed | removed].copy()
+    changes['active'] = ~removed[added_or_changed | removed]
+    for c in ATTRIBUTES:
+        # Removed stations keep their last known attributes
+        changes[c] = changes[c].where(changes['active'],changes[c+'_previous'])
+    changes['Description'] = description
+    changes['valid_from'] = timestamp
+    # Outer merge against an empty state leaves the coordinates as object
+    changes[['latitude','longitude']] = changes[['latitude','longitude']].astype(np.float64)
+    return changes[COLUMNS].reset_index(drop=True)
+
+
+def apply_changes(state:pd.DataFrame,changes:pd.DataFrame)->pd.DataFrame:
+    '''State after change events'''
+    state = state[~state[KEY].isin(changes[KEY])]
+    return pd.concat([state,changes[changes['active']]],ignore_index=True)[COLUMNS]
+
+
+def empty_state()->pd.DataFrame:
+    return pd.DataFrame({c:pd.Series(dtype=np.float64 if c in ['latitude','longitude'] else object) for c in COLUMNS})
+
+
+class StationTracker():
+    '''Keeps the active stations of one measure and emits only their changes
+    Args:
+        state:  Active stations to start from, i.e. from query_current_stations. Empty if None.
+    Comments:
+        Changes returned by update are pending until commit is called once they are written.
+        rollback discards them after a failed write, so the next update emits them again.
+    '''
+    def __init__(self,state:pd.DataFrame=None):
+        self.state=empty_state() if state is None else state[state['active'].astype(bool)][COLUMNS]
+        self.pending=self.state
+
+    def update(self,metadata:pd.DataFrame)->pd.DataFrame:
+        '''Change events of a new snapshot against the state including pending changes, usually empty'''
+        changes = get_changes(self.pending,metadata)
+        if len(changes):
+            self.pending = apply_changes(self.pending,changes)
+        return changes
+
+    def commit(self):
+        '''Pending changes were written'''
+        self.state=self.pending
+
+    def rollback(self):
+        '''Pending changes were not written'''
+        self.pending=self.state
+
+
+def compress(metadata:pd.DataFrame)->pd.DataFrame:
+    '''Convert a full per-snapshot metadata history, as stored in <measure>-metadata, into change events'''
+    timestamps, t_idx = np.unique(metadata['timestamp'].to_numpy(),return_inverse=True)
+    stations, s_idx = np.unique(metadata[KEY].to_numpy().astype(str),return_inverse=True)
+    # Every distinct set of attributes of a station is a version
+    version_idx = metadata.groupby([KEY]+ATTRIBUTES,sort=False,dropna=False).ngroup().to_numpy()
+    versions = metadata.iloc[np.unique(version_idx,return_index=True)[1]].reset_index(drop=True)
+
+    # Version of every station at every snapshot, -1 while absent, with an initial absent row
+    table = np.full((len(timestamps)+1,len(stations)),-1)
+    table[t_idx.ravel()+1,s_idx.ravel()] = version_idx
+    t, station = np.nonzero(table[1:]!=table[:-1])
+    current, previous = table[t+1,station], table[t,station]
+
+    active = current>=0
+    changes = versions.iloc[np.where(active,current,previous)][[KEY]+ATTRIBUTES].reset_index(drop=True)
+    changes['Description'] = metadata['Description'].iloc[0] if len(metadata) else None
+    changes['valid_from'] = timestamps[t]
+    changes['active'] = active
+    return changes.sort_values(['valid_from',KEY],kind='stable').reset_index(drop=True)[COLUMNS]
+
+
+def get_intervals(changes:pd.DataFrame)->pd.DataFrame:
+    '''Validity intervals of change events, valid_to is NaT for versions still active'''
+    df = changes.sort_values([KEY,'valid_from'],kind='stable').copy()
+    df['valid_to'] = df.groupby(KEY)['valid_from'].shift(-1)
+    return df[df['active'].astype(bool)].drop(columns='active').reset_index(drop=True)
+
+
+class StationIndex():
+    '''As-of lookup of the active stations of one measure
+    Args:
+        changes:    Change events of the <measure>-stations table
+    Comments:
+        The active station set is materialized once at every change time, so a lookup is a
+        single bisect over the change times.
+    '''
+    def __init__(self,changes:pd.DataFrame):
+        changes = changes.assign(valid_from=pd.to_datetime(changes['valid_from'])).sort_values('valid_from',kind='stable')
+        self.times=[]
+        self.versions=[]
+        state = empty_state()
+        for valid_from, group in changes.groupby('valid_from',sort=True):
+            state = apply_changes(state,group)
+            self.times.append(valid_from)
+            self.versions.append(state)
+
+    def __len__(self):
+        return len(self.times)
+
+    def as_of(self,timestamp)->pd.DataFrame:
+        '''Stations active at timestamp'''
+        i = bisect.bisect_right(self.times,pd.Timestamp(timestamp))-1
+        if i<0:
+            raise KeyError(f"No station metadata at or before {timestamp}")
+        return self.versions[i]
+
+
+def query_changes(measure:str,end=None,project_id:str='ml-eng-cs611-group-project',dataset_id:str='taxi_dataset_reference')->pd.DataFrame:
+    '''All change events of a measure, optionally only those up to end'''
+    sql = f"""
+    SELECT *
+    FROM `{dataset_id}.{measure}-stations`
+    """
+    if end is not None:
+        sql += f"WHERE valid_from <= '{end}'\n"
+    return pd.read_gbq(sql, project_id=project_id)
+
+
+def query_current_stations(measure:str,project_id:str='ml-eng-cs611-group-project',dataset_id:str='taxi_dataset_reference')->pd.DataFrame:
+    '''Latest version of every station of a measure, to initialize a StationTracker'''
+    sql = f"""
+    SELECT *
+    FROM `{dataset_id}.{measure}-stations`
+    QUALIFY ROW_NUMBER() OVER (PARTITION BY station ORDER BY valid_from DESC) = 1
+    """
+    return pd.read_gbq(sql, project_id=project_id)
+
+
+if __name__=='__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Migrates per-snapshot station metadata tables into change-detected <measure>-stations tables')
+    parser.add_argument('--project','-p', nargs='?', default='ml-eng-cs611-group-project', type=str, help='GCP project name i.e. ml-eng-cs611-group-project')
+    parser.add_argument('--dataset_id','-d', nargs='?', default='taxi_dataset_reference', type=str, help='GBQ dataset ID i.e. taxi_dataset_reference')
+    parser.add_argument('--measure','-m', nargs='?',type=str, help='NEA measure i.e. air-temperature,relative-humidity or rainfall. Default to all 3')
+    args = parser.parse_args()
+
+    measures = [args.measure] if args.measure else ['rainfall','air-temperature','relative-humidity']
+    for measure in measures:
+        metadata = pd.read_gbq(f"SELECT * FROM `{args.dataset_id}.{measure}-metadata`", project_id=args.project)
+        changes = compress(metadata)
+        print(f"[{measure}] {len(metadata)} metadata rows compressed to {len(changes)} change event(s)")
+        changes.to_gbq('.'.join([args.dataset_id,f'{measure}-stations']),args.project,if_exists='replace')
@@ -0,0 +1,95 @@
+import zlib
+import struct
+import numpy as np
+import pandas as pd
+
+from src import grid
+
+# Block layout: magic, timestamp (ns since epoch), number of taxis, payload length, followed by
+# a zlib compressed int32 payload of latitude deltas then longitude deltas
+HEADER = struct.Struct('<4sqII')
+MAGIC = b'TXB1'
+SCALE = 1e6 # Fixed-point resolution of a microdegree, about 0.1m
+
+
+def encode_snapshot(timestamp,longitude,latitude)->bytes:
+    '''Encode one taxi availability snapshot into a compact block
+    Args:
+        timestamp:  Timestamp of the snapshot, stored once for the whole block
+        longitude:  Array of taxi longitudes in degrees
+        latitude:   Array of taxi latitudes in degrees
+    Returns:
+        bytes of the encoded block
+    Comments:
+        Coordinates are quantized to int32 microdegree offsets from the grid origin and sorted
+        by latitude, so the delta encoded latitudes are small and non-negative and compress well.
+        Taxi order within a snapshot is not preserved.
+    '''
+    lon_q = np.rint((np.asarray(longitude,dtype=np.float64)-grid.LONGITUDE_ORIGIN)*SCALE).astype(np.int32)
+    lat_q = np.rint((np.asarray(latitude,dtype=np.float64)-grid.LATITUDE_ORIGIN)*SCALE).astype(np.int32)
+
+    order = np.lexsort((lon_q,lat_q))
+    lon_q, lat_q = lon_q[order], lat_q[order]
+    deltas = np.concatenate([np.diff(lat_q,prepend=np.int32(0)),np.diff(lon_q,prepend=np.int32(0))])
+
+    payload = zlib.compress(deltas.astype('<i4').tobytes())
+    header = HEADER.pack(MAGIC,pd.Timestamp(timestamp).value,len(order),len(payload))
+    return header+payload
+
+
+def decode_snapshot(buffer,offset:int=0):
+    '''Decode the block starting at offset
+    Returns:
+        timestamp:      pandas Timestamp of the snapshot
+        longitude:      float64 array of longitudes
+        latitude:       float64 array of latitudes
+        next_offset:    Offset of the following block in buffer
+    '''
+    magic, timestamp, count, length = HEADER.unpack_from(buffer,offset)
+    if magic!=MAGIC:
+        raise ValueError(f"Not a taxi block at offset {offset}")
+    start = offset+HEADER.size
+    deltas = np.frombuffer(zlib.decompress(buffer[start:start+length]),dtype='<i4')
+
+    lat_q = np.cumsum(deltas[:count],dtype=np.int64)
+    lon_q = np.cumsum(deltas[count:],dtype=np.int64)
+    longitude = lon_q/SCALE+grid.LONGITUDE_ORIGIN
+    latitude = lat_q/SCALE+grid.LATITUDE_ORIGIN
+    return pd.Timestamp(timestamp), longitude, latitude, start+length
+
+
+def encode_frame(df:pd.DataFrame)->bytes:
+    '''Encode a frame of the schema returned by jsonParser.load_taxi_data, one block per timestamp'''
+    blocks = [encode_snapshot(timestamp,group['longitude'].to_numpy(),group['latitude'].to_numpy())
+              for timestamp,group in df.groupby('timestamp',sort=True)]
+    return b''.join(blocks)
+
+
+def iter_snapshots(buffer):
+    '''Yields (timestamp, longitude, latitude) for every block in buffer'''
+    offset = 0
+    while offset<len(buffer):
+        timestamp, longitude, latitude, offset = decode_snapshot(buffer,offset)
+        yield timestamp, longitude, latitude
+
+
+def decode_frame(buffer)->pd.DataFrame:
+    '''Decode every block in buffer
+    Returns:
+        pandas DataFrame object of the same schema as jsonParser.load_taxi_data:
+            - timestamp
+            - longitude
+            - latitude
+    '''
+    timestamps, longitudes, latitudes, counts = [], [], [], []
+    for timestamp, longitude, latitude in iter_snapshots(buffer):
+        timestamps.append(timestamp)
+        longitudes.append(longitude)
+        latitudes.append(latitude)
+        counts.append(len(longitude))
+
+    return pd.DataFrame({
+        'timestamp':np.repeat(pd.DatetimeIndex(timestamps),counts),
+        'longitude':np.concatenate(longitudes) if longitudes else np.array([]),
+        'latitude':np.concatenate(latitudes) if latitudes else np.array([])
+    })
@@ -0,0 +1,187 @@
+import numpy as np
+import pandas as pd
+
+LABEL = 'y_30'
+EXCLUDE = ['timestamp','y_30','y_60']
+CATEGORICALS = ['grid_num','month','hour']
+VOCABULARIES = {'month':list(range(1,13)),'hour':list(range(24))}
+
+
+class Encoder():
+    '''Encodes training rows into standardized float32 numerics and integer category indices,
+    replacing pd.get_dummies over the full CSV.
+    Args:
+        categoricals:   Columns to encode as category indices
+        vocabularies:   Known vocabulary per categorical. Others are collected by fit.
+        exclude:        Columns that are neither features nor categoricals, including labels
+    '''
+    def __init__(self,categoricals:list=CATEGORICALS,vocabularies:dict=VOCABULARIES,exclude:list=EXCLUDE):
+        self.categoricals=list(categoricals)
+        self.vocabularies={k:np.array(v) for k,v in vocabularies.items()}
+        self.exclude=list(exclude)
+        self.numeric=None
+        self.mean=None
+        self.std=None
+
+    def fit(self,path:str,chunksize:int=500000):
+        '''Single streamed pass over the CSV collecting vocabularies and numeric mean/std'''
+        values = {c:set() for c in self.categoricals if c not in self.vocabularies}
+        count, total, total_sq = 0, 0, 0
+        for chunk in pd.read_csv(path,chunksize=chunksize):
+            if self.numeric is None:
+                self.numeric = [c for c in chunk.columns if c not in self.categoricals+self.exclude
+                                and pd.api.types.is_numeric_dtype(chunk[c])]
+            for c in values:
+                values[c].update(chunk[c].unique().tolist())
+            x = chunk[self.numeric].to_numpy(dtype=np.float64)
+            count += len(x)
+            total += x.sum(axis=0)
+            total_sq += (x**2).sum(axis=0)
+
+        for c in values:
+            self.vocabularies[c] = np.array(sorted(values[c]))
+        self.mean = (total/count).astype(np.float32)
+        self.std = np.sqrt(np.maximum(total_sq/count-(total/count)**2,0)).astype(np.float32)
+        self.std[self.std==0] = 1
+        print(f"Fitted encoder on {count} rows: {len(self.numeric)} numeric, "+
+              ', '.join(f'{c}[{len(self.vocabularies[c])}]' for c in self.categoricals))
+        return self
+
+    @property
+    def sizes(self):
+        '''Vocabulary size of each categorical. Index size is reserved for unseen values.'''
+        return [len(self.vocabularies[c])+1 for c in self.categoricals]
+
+    def encode(self,df:pd.DataFrame):
+        '''
+        Returns:
+            numeric:    float32 array of shape [row, numeric feature], standardized
+            categories: int32 array of shape [row, categorical] of vocabulary indices
+        '''
+        numeric = (df[self.numeric].to_numpy(dtype=np.float32)-self.mean)/self.std
+        categories = np.empty((len(df),len(self.categoricals)),dtype=np.int32)
+        for j,c in enumerate(self.categoricals):
+            vocabulary = self.vocabularies[c]
+            values = df[c].to_numpy()
+            idx = np.searchsorted(vocabulary,values).clip(max=len(vocabulary)-1)
+            categories[:,j] = np.where(vocabulary[idx]==values,idx,len(vocabulary))
+        return numeric, categories
+
+    def to_csr(self,numeric:np.ndarray,categories:np.ndarray):
+        '''Sparse design matrix equivalent to the numerics followed by one-hot columns of every categorical'''
+        from scipy import sparse
+        n, k = numeric.shape
+        offsets = k+np.concatenate([[0],np.cumsum(self.sizes)[:-1]])
+        indices = np.concatenate([np.tile(np.arange(k),(n,1)),categories+offsets],axis=1)
+        data = np.concatenate([numeric,np.ones(categories.shape,dtype=np.float32)],axis=1)
+        indptr = np.arange(0,n*indices.shape[1]+1,indices.shape[1])
+        return sparse.csr_matrix((data.ravel(),indices.ravel(),indptr),shape=(n,k+sum(self.sizes)))
+
+
+def iter_batches(path:str,encoder:Encoder,label:str=LABEL,batch_size:int=1024,chunksize:int=500000,
+                 subset:str=None,test_size:float=0.25,seed:int=622):
+    '''Stream encoded batches from a CSV without loading it
+    Args:
+        path:       Path to training CSV i.e. full_2019_2grid.csv
+        encoder:    Fitted Encoder
+        label:      Label column
+        subset:     'train' or 'test' to keep one side of a reproducible random split, None for all rows
+        test_size:  Fraction of rows assigned to the test split
+        seed:       Seed for the split
+    Yields:
+        (numeric, categories, y) arrays of at most batch_size rows
+    '''
+    rng = np.random.default_rng(seed)
+    for chunk in pd.read_csv(path,chunksize=chunksize):
+        if subset is not None:
+            is_test = rng.random(len(chunk))<test_size
+            chunk = chunk[is_test if subset=='test' else ~is_test]
+        numeric, categories = encoder.encode(chunk)
+        y = chunk[label].to_numpy(dtype=np.float32)
+        for i in range(0,len(chunk),batch_size):
+            yield numeric[i:i+batch_size], categories[i:i+batch_size], y[i:i+batch_size]
+
+
+def make_tf_dataset(path:str,encoder:Encoder,label:str=LABEL,batch_size:int=128,**kwargs):
+    '''Lazily fed tf.data.Dataset of ({'numeric', *categoricals}, label) batches for embedding models'''
+    import tensorflow as tf
+
+    def generator():
+        for numeric, categories, y in iter_batches(path,encoder,label,batch_size,**kwargs):
+            features = {'numeric':numeric}
+            features.update({c:categories[:,j] for j,c in enumerate(encoder.categoricals)})
+            yield features, y
+
+    signature = {'numeric':tf.TensorSpec((None,len(encoder.numeric)),tf.float32)}
+    signature.update({c:tf.TensorSpec((None,),tf.int32) for c in encoder.categoricals})
+    return tf.data.Dataset.from_generator(generator,output_signature=(signature,tf.TensorSpec((None,),tf.float32))
+                                          ).prefetch(tf.data.experimental.AUTOTUNE)
+
+
+def make_keras_model(encoder:Encoder,embedding_dim:int=1):
+    '''Linear model over numerics plus one embedding per categorical. With embedding_dim=1 this is
+    the same model as a Dense layer over the one-hot columns from pd.get_dummies.'''
+    import tensorflow as tf
+
+    numeric = tf.keras.Input(shape=(len(encoder.numeric),),name='numeric')
+    inputs = {'numeric':numeric}
+    terms = [numeric]
+    for c,size in zip(encoder.categoricals,encoder.sizes):
+        inputs[c] = tf.keras.Input(shape=(),dtype=tf.int32,name=c)
+        terms.append(tf.keras.layers.Embedding(size,embedding_dim,name=f'{c}_embedding')(inputs[c]))
+    x = tf.keras.layers.Concatenate()(terms)
+    output = tf.keras.layers.Dense(1,activation='linear')(x)
+    model = tf.keras.Model(inputs=inputs,outputs=output)
+    model.compile(optimizer='adam',loss='mse')
+    return model
+
+
+class LinearModel():
+    '''NumPy linear regression trained by minibatch Adam over encoded batches. Each categorical
+    contributes one weight per category, so the one-hot matrix is never materialized.'''
+    def __init__(self,encoder:Encoder,learning_rate:float=0.01):
+        self.encoder=encoder
+        self.learning_rate=learning_rate
+        self.weights=[np.zeros(len(encoder.numeric))]+[np.zeros(size) for size in encoder.sizes]+[np.zeros(1)]
+        self.moments=[(np.zeros_like(w),np.zeros_like(w)) for w in self.weights]
+        self.steps=0
+
+    def predict(self,numeric:np.ndarray,categories:np.ndarray)->np.ndarray:
+        y = numeric@self.weights[0]+self.weights[-1][0]
+        for j in range(categories.shape[1]):
+            y += self.weights[1+j][categories[:,j]]
+        return y
+
+    def partial_fit(self,numeric:np.ndarray,categories:np.ndarray,y:np.ndarray)->float:
+        error = self.predict(numeric,categories)-y
+        n = len(y)
+        grads = [numeric.T@error/n]
+        for j in range(categories.shape[1]):
+            grad = np.zeros_like(self.weights[1+j])
+            np.add.at(grad,categories[:,j],error/n)
+            grads.append(grad)
+        grads.append(np.array([error.mean()]))
+
+        self.steps += 1
+        beta1, beta2 = 0.9, 0.999
+        for w,(m,v),g in zip(self.weights,self.moments,grads):
+            m *= beta1; m += (1-beta1)*g
+            v *= beta2; v += (1-beta2)*g**2
+            w -= self.learning_rate*(m/(1-beta1**self.steps))/(np.sqrt(v/(1-beta2**self.steps))+1e-8)
+        return float((error**2).mean())
+
+    def fit(self,path:str,epochs:int=2,**kwargs):
+        for epoch in range(epochs):
+            total, count = 0, 0
+            for numeric, categories, y in iter_batches(path,self.encoder,subset='train',**kwargs):
+                total += self.partial_fit(numeric,categories,y)*len(y)
+                count += len(y)
+            print(f"Epoch {epoch+1}: train mse {total/count:.4f}")
+        return self
+
+    def evaluate(self,path:str,**kwargs)->float:
+        total, count = 0, 0
+        for numeric, categories, y in iter_batches(path,self.encoder,subset='test',**kwargs):
+            total += ((self.predict(numeric,categories)-y)**2).sum()
+            count += len(y)
+        return total/count
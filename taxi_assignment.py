@@ -5,18 +5,22 @@ import geopandas as gpd
 from scipy.spatial import distance
 from tqdm import tqdm
 
-import math
 from datetime import datetime,timedelta
 from collections import Counter
 import warnings
 warnings.filterwarnings('ignore')
 
-def query_taxi_availability(query:str, project_id:str='ml-eng-cs611-group-project',dataset_id:str='taxi_dataset_reference')->type(pd.DataFrame):
+from src import grid
+from src import quadtree
+from src import querycache
+
+def query_taxi_availability(query:str, project_id:str='ml-eng-cs611-group-project',dataset_id:str='taxi_dataset_reference',cache:querycache.QueryCache=None)->type(pd.DataFrame):
     '''Query LTA BigQuery for taxi coordinates
     Args:        
         query_timestamp:    i.e. 2022-06-01 13:15:00
         project_id:         Google Cloud project_id
         dataset_id:         Google Cloud dataset_id
+        cache:              If provided, querycache.QueryCache to read historical results from
     Returns:
         pandas.DataFrame containing metadata for taxi data of the schema
             - timestamp:datetime.timestamp  Timestamp of observation for a taxi
@@ -29,7 +33,7 @@ def query_taxi_availability(query:str, project_id:str='ml-eng-cs611-group-projec
     WHERE timestamp = '{query}'
     """
 
-    return pd.read_gbq(sql, project_id=project_id)
+    return querycache.read_gbq(sql, project_id, cache)
 
 
 def get_grid_data(gridfile:str)->type(gpd.GeoDataFrame):
@@ -53,30 +57,26 @@ def get_grid_data(gridfile:str)->type(gpd.GeoDataFrame):
     return grids_df
 
 
-def assign_taxis(taxi_df:type(pd.DataFrame),grids)->type(pd.DataFrame):
+def assign_taxis(taxi_df:type(pd.DataFrame),grids,tree:quadtree.QuadTree=None)->type(pd.DataFrame):
     '''Numerically determine grid number of each taxi, and counts the number of taxis in each grid
     Args:
         taxi_df:pandas.DataFrame
         grids:geopandas.DataFrame
+        tree:quadtree.QuadTree:     If provided, taxis are assigned to its leaves, for grids written by QuadTree.to_gdf
     Yields:
         taxi_clean:pandas.DataFrame containing metadata for taxi data of the schema
             - timestamp:datetime.timestamp  Timestamp for assignment
             - grid_num:int                  Unique grid in Singapore GeoDataFrame
             - taxi_count:float              Number of taxis in grid
     '''
-    def get_grid_longitude(longitude:float):
-        '''Maps longitude to a grid'''
-        return math.ceil((longitude-103.6)/0.020454545454545583)
-
-
-    def get_grid_latitude(latitude:float):
-        '''Maps latitude to a grid'''
-        return (13 - math.ceil((latitude -1.208)/0.020538461538461547))*22
-    
     longitude_array = taxi_df['longitude'].to_numpy()
     latitude_array = taxi_df['latitude'].to_numpy()
 
-    test = [get_grid_longitude(longitude_array[i]) + get_grid_latitude(latitude_array[i]) for i in range(len(longitude_array))]
+    if tree is None:
+        test = grid.get_grid_num(longitude_array,latitude_array).tolist()
+    else:
+        # Grid numbers of QuadTree.to_gdf are the leaf index + 1
+        test = (tree.lookup(longitude_array,latitude_array)+1).tolist()
 
     # getting dictionary of items
     c = Counter(test)
@@ -105,8 +105,10 @@ if __name__ == '__main__':
     parser.add_argument('--dataset_id','-d', nargs='?', default='taxi_dataset_reference', type=str, help='GBQ dataset ID i.e. taxi_dataset. For live data, use taxi_dataset')
     parser.add_argument('--table_id','-t', nargs='?', default='assignment-taxi', type=str, help='GBQ table ID i.e. assignment-taxi')
     parser.add_argument('--gridfile','-g', nargs='?', default='./updated codes/filter_grids_2/filter_grids_2.shp', type=str, help='Path to gridfiles (static data)')    
+    parser.add_argument('--tree', nargs='?', default=None, type=str, help='If provided, tree saved by src/quadtree.py, for a --gridfile written by it')
     parser.add_argument('--query','-q', type=str, help='Timestamp to start assignment i.e. 2022-06-01 13:15:00')
     parser.add_argument('--batch','-B', nargs='?', default=0, type=int, help='No. of 15 min intervals to batch process')
+    parser.add_argument('--cache','-c', nargs='?', default=None, const='./.querycache', type=str, help='If provided, directory to cache historical query results in')
     args = parser.parse_args()
     
     project = args.project    
@@ -119,10 +121,12 @@ if __name__ == '__main__':
     print(f"Assigning taxi data for timestamp {query} and {batch} more batch(es)")
 
     fs = gcsfs.GCSFileSystem(project=project)
+    cache = querycache.QueryCache(args.cache) if args.cache else None
         
     ### Read grid file data and preprocess
     grids_df = get_grid_data(gridfile)
     grid_nums = list(grids_df['grid_num'].unique())    
+    tree = quadtree.QuadTree.load(args.tree) if args.tree else None
 
     ### Assign taxis to grid
     query_datetime = datetime.strptime(query,'%Y-%m-%d %H:%M:%S')
@@ -130,9 +134,9 @@ if __name__ == '__main__':
     date_list=[query_datetime + timedelta(minutes=15*x) for x in range(1+batch)]
     df_list=[]
     for date in tqdm(date_list):
-        taxi = query_taxi_availability(date)
+        taxi = query_taxi_availability(date,cache=cache)
         try:
-            taxi_df = assign_taxis(taxi,grids_df)
+            taxi_df = assign_taxis(taxi,grids_df,tree)
             df_list.append(taxi_df)
         except:
             print(f"Empty data for {date}")
@@ -140,4 +144,6 @@ if __name__ == '__main__':
 
     ### Write to BigQuery
     consolidated_df.to_gbq('.'.join([dataset_id,table_id]),project,if_exists='append')
-    print(f"Loaded {1+batch} timestamp(s) successfully")
\ No newline at end of file
+    print(f"Loaded {1+batch} timestamp(s) successfully")
+    if cache is not None:
+        cache.report()
\ No newline at end of file
@@ -2,6 +2,7 @@ import gcsfs
 import re
 
 from src import jsonParser
+from src import taxicodec
 
 def load_taxi_to_gbq(project:str,dataset_id:str,filename:str,fs=None):
     '''Load a single json 
@@ -19,6 +20,29 @@ def load_taxi_to_gbq(project:str,dataset_id:str,filename:str,fs=None):
     print(f"Writing taxi data")
     taxi_data.to_gbq(dataset_id+'.'+'taxi-availability',project,chunksize=None,if_exists='append')
 
+def load_taxi_to_blocks(filenames:list,out_path:str,fs=None):
+    '''Encode many taxi JSON files into a single file of compact snapshot blocks
+    Args:
+        filenames:list:     Paths to taxi JSON files
+        out_path:str:       Path of the block file to write. Accepts Google Cloud URL if fs is provided.
+        fs:                 gcsfs.GCSFileSystem object
+    '''
+    parser = jsonParser.jsonParser(fs)
+    blocks = []
+    for filename in filenames:
+        print(f"Current processing {filename}")
+        taxi_data = parser.load_taxi_data(filename)
+        blocks.append(taxicodec.encode_frame(taxi_data))
+
+    data = b''.join(blocks)
+    print(f"Writing {len(blocks)} snapshot(s) to {out_path} ({len(data)} bytes)")
+    if fs!=None:
+        with fs.open(out_path,'wb') as f:
+            f.write(data)
+    else:
+        with open(out_path,'wb') as f:
+            f.write(data)
+
 def get_start_index(start_file:str,file_list:list):
     '''Iteratively search from start of file list to find first occurence of end_file.
     Args:
@@ -70,6 +94,7 @@ if __name__ == '__main__':
     parser.add_argument('--batch','-B', action="store_true", help='If provided, trigger batch loading')
     parser.add_argument('--endfile','-e', nargs='?', default="", type=str, help='If provided, load data up to this file/date')
     parser.add_argument('--startfile','-s', nargs='?', default="", type=str, help='If provided, load data from this file/date')
+    parser.add_argument('--compact','-c', nargs='?', default=None, type=str, help='If provided with --batch, write compact snapshot blocks to this path instead of GBQ')
     args = parser.parse_args()
     
     project = args.project
@@ -79,6 +104,7 @@ if __name__ == '__main__':
     batch=args.batch
     start_file = args.startfile
     end_file = args.endfile
+    compact = args.compact
     
     fs = gcsfs.GCSFileSystem(project=project)
         
@@ -88,8 +114,11 @@ if __name__ == '__main__':
         start_index = get_start_index(start_file,filenames)
         end_index = get_end_index(end_file,filenames)
         filenames = filenames[start_index:end_index]
-        for file in filenames:
-            load_taxi_to_gbq(project,dataset_id,file,fs)
+        if compact:
+            load_taxi_to_blocks(filenames,compact,fs)
+        else:
+            for file in filenames:
+                load_taxi_to_gbq(project,dataset_id,file,fs)
         print("Last file loaded.")
         
     else:
@@ -0,0 +1,26 @@
+import pandas as pd
+
+from src import alignment
+
+
+def test_to_naive_drops_the_utc_label_of_gbq_timestamps():
+    # read_gbq returns the stored Singapore wall-clock time labelled as UTC
+    sink = pd.Series(pd.to_datetime(['2022-06-01 13:15:00','2022-06-01 13:30:00']).tz_localize('UTC'))
+    assert list(alignment.to_naive(sink)) == [pd.Timestamp('2022-06-01 13:15:00'),pd.Timestamp('2022-06-01 13:30:00')]
+
+
+def test_to_naive_converts_feed_offsets():
+    assert alignment.to_naive(['2022-06-01T05:15:00+00:00'])[0] == pd.Timestamp('2022-06-01 05:15:00')
+    assert alignment.to_naive(['2022-06-01T13:15:00+08:00'])[0] == pd.Timestamp('2022-06-01 13:15:00')
+    assert list(alignment.to_naive(['2022-06-01T13:15:00+08:00','2022-06-01 13:20:00'])) == \
+        [pd.Timestamp('2022-06-01 13:15:00'),pd.Timestamp('2022-06-01 13:20:00')]
+
+
+def test_align_streams_matches_gbq_frames_to_their_schedule():
+    df = pd.DataFrame({
+        'timestamp':pd.to_datetime(['2022-06-01 13:14:58','2022-06-01 13:30:02']).tz_localize('UTC'),
+        'taxi_count':[1,2]
+    })
+    aligned, report = alignment.align_streams({'taxi':df},'2022-06-01 13:15:00','2022-06-01 13:30:00')
+    assert report.loc[0,'gaps'] == 0
+    assert list(aligned['taxi']['timestamp']) == [pd.Timestamp('2022-06-01 13:15:00'),pd.Timestamp('2022-06-01 13:30:00')]
@@ -0,0 +1,224 @@
+import io
+import sys
+import json
+import time
+import random
+import threading
+import contextlib
+import urllib.request
+import numpy as np
+import pandas as pd
+from types import SimpleNamespace
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from src import grid
+
+SOURCE = './cloud_functions/prediction-v2.py'
+TARGET = 'hello_world'
+STREETS = ['Orchard Road','Ang Mo Kio Avenue 3','Tampines Street 81','Jurong West Street 52','Bukit Timah Road',
+           'Serangoon Avenue 2','Toa Payoh Lorong 1','Woodlands Drive 14','Marine Parade Road','Clementi Avenue 3']
+
+
+class Dependencies():
+    '''Timed stand-ins for the warehouse, geocoder and prediction backends of the webhook
+    Args:
+        latency:    Dictionary of dependency name (warehouse, geocoder, prediction) to seconds per call
+        jitter:     Up to this fraction of the latency is added at random
+    Comments:
+        Time spent in every dependency is accumulated per request thread, so the server side
+        latency of a request can be split into dependencies and the function itself.
+    '''
+    def __init__(self,latency:dict,jitter:float=0.2,grid_nums=None):
+        self.latency=latency
+        self.jitter=jitter
+        self.grid_nums=np.arange(grid.N_COLUMNS*grid.N_ROWS)+1 if grid_nums is None else np.asarray(grid_nums)
+        self.local=threading.local()
+
+    def wait(self,name:str,start:float):
+        time.sleep(self.latency[name]*(1+random.uniform(0,self.jitter)))
+        calls = getattr(self.local,'calls',None)
+        if calls is not None:
+            calls[name] = calls.get(name,0)+time.perf_counter()-start
+
+    def read_gbq(self,query:str,project_id:str=None,**kwargs)->pd.DataFrame:
+        '''One 15 minute slice of the all-item-join-live view'''
+        start = time.perf_counter()
+        timestamp = pd.Timestamp(query.split("timestamp = '")[1].split("'")[0])
+        rng = np.random.default_rng(timestamp.value//10**9)
+        n = len(self.grid_nums)
+        df = pd.DataFrame({
+            'taxi_count':rng.poisson(8,n).astype(float),'air_temperature':rng.normal(28,2,n),
+            'rainfall':np.where(rng.random(n)<0.1,rng.exponential(2,n),0),'relative_humidity':rng.normal(80,8,n),
+            'grid_num':self.grid_nums,'timestamp':timestamp})
+        self.wait('warehouse',start)
+        return df
+
+    def geocode(self,url:str,*args,**kwargs):
+        '''Geocoding response with a location inside the grid for any address'''
+        start = time.perf_counter()
+        rng = random.Random(url)
+        location = {'lat':rng.uniform(1.30,1.42),'lng':rng.uniform(103.70,103.95)}
+        self.wait('geocoder',start)
+        return SimpleNamespace(json=lambda:{'results':[{'geometry':{'location':location}}]})
+
+    def prediction_client(self):
+        dependencies = self
+
+        class PredictionServiceClient():
+            def __init__(self,client_options=None):
+                pass
+
+            def endpoint_path(self,project,location,endpoint):
+                return f'projects/{project}/locations/{location}/endpoints/{endpoint}'
+
+            def predict(self,endpoint,instances):
+                start = time.perf_counter()
+                dependencies.wait('prediction',start)
+                return SimpleNamespace(predictions=[[instance['taxi_count'][0]+random.uniform(-3,3)] for instance in instances])
+
+        return PredictionServiceClient
+
+
+@contextlib.contextmanager
+def host(source:str=SOURCE,target:str=TARGET,dependencies:Dependencies=None,backend:str='vertex',model_path:str=None):
+    '''Load the webhook with the functions-framework and point its backends at the stand-ins
+    Yields:
+        (WSGI app recording per request server time and dependency times, list of those records)
+    Comments:
+        The webhook calls pd.read_gbq, which can only be replaced on pandas itself.
+        It is restored on exit.
+    '''
+    import functions_framework
+    import pandas
+
+    app = functions_framework.create_app(target,source)
+    # The framework registers the source under its file name
+    module = sys.modules[source.split('/')[-1][:-3]]
+    module.requests = SimpleNamespace(get=dependencies.geocode)
+    module.aiplatform = SimpleNamespace(gapic=SimpleNamespace(PredictionServiceClient=dependencies.prediction_client()))
+    module.PREDICTION_BACKEND = backend
+    if backend=='local':
+        module.LOCAL_MODEL_PATH = model_path
+        predict_local = module.predict_local
+
+        def timed_predict_local(*args,**kwargs):
+            start = time.perf_counter()
+            result = predict_local(*args,**kwargs)
+            calls = dependencies.local.calls
+            calls['prediction'] = calls.get('prediction',0)+time.perf_counter()-start
+            return result
+        module.predict_local = timed_predict_local
+
+    records = []
+    lock = threading.Lock()
+
+    def timed_app(environ,start_response):
+        dependencies.local.calls = {}
+        start = time.perf_counter()
+        body = app(environ,start_response)
+        record = {'server':time.perf_counter()-start,**dependencies.local.calls}
+        with lock:
+            records.append(record)
+        return body
+
+    # create, as pandas 3 no longer has read_gbq
+    with mock.patch.object(pandas,'read_gbq',dependencies.read_gbq,create=True):
+        yield timed_app, records
+
+
+def get_payload(rng:random.Random,address_fraction:float)->dict:
+    '''Dialogflow webhook request of the coordinate or the street address intent'''
+    if rng.random()<address_fraction:
+        return {'queryResult':{'action':'Prediction.Prediction-address','parameters':{
+            'street-address':{'street-address':f"{rng.randint(1,999)} {rng.choice(STREETS)}"}}}}
+    return {'queryResult':{'action':'Prediction.Prediction-next','outputContexts':[{'parameters':{
+        'longitude':[rng.uniform(103.70,103.95)],'latitude':[rng.uniform(1.30,1.42)]}}]}}
+
+
+def fire(url:str,requests:int,concurrency:int,address_fraction:float=0.5,seed:int=0)->pd.DataFrame:
+    '''Send webhook requests at a fixed concurrency
+    Returns:
+        pandas DataFrame with one row per request of the schema:
+            - intent
+            - status
+            - latency:  Client side seconds
+    '''
+    rng = random.Random(seed)
+    payloads = [get_payload(rng,address_fraction) for _ in range(requests)]
+
+    def send(payload):
+        request = urllib.request.Request(url,data=json.dumps(payload).encode(),headers={'Content-Type':'application/json'})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        return {'intent':payload['queryResult']['action'],'status':status,'latency':time.perf_counter()-start}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(send,payload) for payload in payloads]
+        return pd.DataFrame([future.result() for future in as_completed(futures)])
+
+
+def summarize(results:pd.DataFrame,records:list)->pd.DataFrame:
+    '''Latency percentiles per intent and time breakdown per dependency, in milliseconds'''
+    rows = []
+    for intent, df in [('all',results)]+list(results.groupby('intent')):
+        ms = df['latency'].to_numpy()*1000
+        rows.append({'measure':f'latency {intent}','n':len(ms),'mean':ms.mean(),'p50':np.percentile(ms,50),
+                     'p95':np.percentile(ms,95),'p99':np.percentile(ms,99)})
+
+    timings = pd.DataFrame(records).fillna(0)
+    dependencies = [c for c in timings.columns if c!='server']
+    timings['function'] = timings['server']-timings[dependencies].sum(axis=1)
+    for c in dependencies+['function']:
+        called = timings.loc[timings[c]>0,c].to_numpy()*1000
+        if len(called):
+            rows.append({'measure':c,'n':len(called),'mean':called.mean(),'p50':np.percentile(called,50),
+                         'p95':np.percentile(called,95),'p99':np.percentile(called,99)})
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+    import argparse
+    import logging
+    from werkzeug.serving import make_server
+
+    parser = argparse.ArgumentParser(description='Load tests the prediction webhook locally with stubbed warehouse, geocoder and prediction backends')
+    parser.add_argument('--requests','-n', nargs='?', default=500, type=int, help='Total number of webhook requests')
+    parser.add_argument('--concurrency','-c', nargs='?', default=16, type=int, help='Requests in flight at once')
+    parser.add_argument('--address_fraction','-a', nargs='?', default=0.5, type=float, help='Fraction of street address intents, the rest send coordinates')
+    parser.add_argument('--warehouse_latency', nargs='?', default=0.8, type=float, help='Seconds per BigQuery query')
+    parser.add_argument('--geocoder_latency', nargs='?', default=0.15, type=float, help='Seconds per geocoding request')
+    parser.add_argument('--prediction_latency', nargs='?', default=0.1, type=float, help='Seconds per Vertex AI prediction')
+    parser.add_argument('--backend','-b', nargs='?', default='vertex', type=str, help='vertex to stub the endpoint, local to use the coefficients in --model')
+    parser.add_argument('--model','-m', nargs='?', default='forecaster.npz', type=str, help='Coefficients written by src/forecaster.py, for --backend local')
+    parser.add_argument('--gridfile','-g', nargs='?', default=None, type=str, help='If provided, serve only the grids of this shapefile from the warehouse')
+    args = parser.parse_args()
+
+    grid_nums = None
+    if args.gridfile:
+        import geopandas as gpd
+        grid_nums = gpd.read_file(args.gridfile)['grid_num'].to_numpy()
+    dependencies = Dependencies({'warehouse':args.warehouse_latency,'geocoder':args.geocoder_latency,
+                                 'prediction':args.prediction_latency},grid_nums=grid_nums)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    with host(dependencies=dependencies,backend=args.backend,model_path=args.model) as (app, records):
+        server = make_server('127.0.0.1',0,app,threaded=True)
+        threading.Thread(target=server.serve_forever,daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}/"
+
+        # The webhook logs every request, keep the report readable
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = fire(url,args.requests,args.concurrency,args.address_fraction)
+        elapsed = time.perf_counter()-start
+        server.shutdown()
+
+    errors = (results['status']!=200).sum()
+    print(f"{len(results)} request(s) at concurrency {args.concurrency} in {elapsed:.1f}s: "
+          f"{len(results)/elapsed:.1f} requests/s, {errors} error(s)")
+    print(summarize(results,records).to_string(index=False,float_format='%.1f'))